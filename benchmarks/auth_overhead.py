@@ -0,0 +1,76 @@
+"""Micro-benchmark of the per-request cost of ``get_current_user``.
+
+Compares a full ``jwt.decode`` (signature check and claims parsing) with a
+hit in the verified-token cache, and the same two paths through a minimal
+authenticated ASGI route::
+
+    python -m benchmarks.auth_overhead --iterations 20000
+"""
+
+import argparse
+import os
+import time
+
+os.environ.setdefault("DB_URL", "sqlite://")
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+
+from fastapi import Depends, FastAPI  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from src.authentication.dependencies import (  # noqa: E402
+    JWT,
+    get_current_user,
+    token_cache,
+)
+
+
+def time_per_call(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    token = JWT().jwt_encode_payload({"user_id": 1, "is_admin": False})
+
+    def uncached():
+        token_cache.clear()
+        get_current_user(token)
+
+    uncached_us = time_per_call(uncached, args.iterations)
+    get_current_user(token)
+    cached_us = time_per_call(lambda: get_current_user(token), args.iterations)
+
+    app = FastAPI()
+
+    @app.get("/me")
+    def me(user=Depends(get_current_user)):
+        return {"user_id": user.user_id}
+
+    client = TestClient(app)
+    headers = {"Authorization": f"Bearer {token}"}
+    requests = max(args.iterations // 10, 100)
+
+    def request_uncached():
+        token_cache.clear()
+        client.get("/me", headers=headers)
+
+    request_uncached_us = time_per_call(request_uncached, requests)
+    request_cached_us = time_per_call(
+        lambda: client.get("/me", headers=headers), requests
+    )
+
+    print(f"get_current_user  decode: {uncached_us:8.1f}us  cached: {cached_us:8.1f}us")
+    print(
+        f"GET /me request   decode: {request_uncached_us:8.1f}us  "
+        f"cached: {request_cached_us:8.1f}us"
+    )
+
+
+if __name__ == "__main__":
+    main()
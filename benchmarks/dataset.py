@@ -0,0 +1,381 @@
+"""Synthetic, seeded datasets for load tests and benchmarks.
+
+Popularity is skewed: a few posts collect most of the comments and
+reactions, and a few hashtags are on most posts, following a Zipf
+distribution with exponent ``skew``. The same ``seed`` always produces the
+same rows: timestamps fall in the year before ``EPOCH``, and nothing is
+dated before what it belongs to (a post before its author signed up, a
+comment before its post or a reply before its parent). Hashtags are
+stored the way the app stores them, one ``hashtags`` row per post and
+tag.
+
+Rows are streamed straight into the ``db.models`` tables, bypassing the
+ORM and the app's per-row commits: ``COPY`` on PostgreSQL, batched
+multi-row INSERTs elsewhere. Every user shares one precomputed password
+hash, so millions of users cost one bcrypt call::
+
+    python -m benchmarks.dataset --dataset medium
+    python -m benchmarks.dataset --db-url postgresql://localhost/myblog_load \\
+        --users 1000000 --posts 2000000 --comments 5000000 --reactions 10000000
+
+The target database must be empty; the schema is created with
+``src.db.migrate`` first.
+"""
+
+import argparse
+import csv
+import io
+import itertools
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import func, insert, select, text
+from sqlalchemy.engine import Connection, Engine
+
+PASSWORD = "benchmark"
+
+PRESETS = {
+    "small": dict(users=200, posts=500, hashtags=50, comments=2000, reactions=5000),
+    "medium": dict(
+        users=2000, posts=5000, hashtags=200, comments=20000, reactions=50000
+    ),
+    "large": dict(
+        users=20000, posts=50000, hashtags=1000, comments=200000, reactions=500000
+    ),
+}
+
+CHUNK_SIZE = 5000
+
+# Fixed, so a seed always gives the same timestamps.
+EPOCH = datetime(2025, 1, 1)
+
+
+def zipf_weights(n: int, skew: float) -> list[float]:
+    """Cumulative weights where rank ``i`` is ``1 / (i + 1) ** skew`` as likely."""
+    return list(itertools.accumulate(1 / (rank + 1) ** skew for rank in range(n)))
+
+
+def zipf_counts(total: int, weights: list[float], rng: random.Random):
+    """Split ``total`` over the ranks of ``weights``, yielding one count per
+    rank. Fractions are rounded up at random, so the sum is ``total`` on
+    average."""
+    scale = total / weights[-1] if weights else 0
+    previous = 0.0
+    for cumulative in weights:
+        expected = (cumulative - previous) * scale
+        previous = cumulative
+        yield int(expected) + (rng.random() < expected % 1)
+
+
+class BulkWriter:
+    """Buffers rows per table and writes them in chunks.
+
+    Tables are flushed together in the order they were first written to,
+    so a chunk never references a parent row that is still buffered.
+    """
+
+    def __init__(self, conn: Connection, chunk_size: int = CHUNK_SIZE) -> None:
+        self.conn = conn
+        self.chunk_size = chunk_size
+        self.copy = conn.dialect.name == "postgresql"
+        self.buffers: dict = {}
+        self.counts: dict[str, int] = {}
+
+    def add(self, table, row: dict) -> None:
+        table = getattr(table, "__table__", table)
+        buffer = self.buffers.setdefault(table, [])
+        buffer.append(row)
+        if len(buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        for table, rows in self.buffers.items():
+            if not rows:
+                continue
+            if self.copy:
+                self.copy_rows(table, rows)
+            else:
+                self.conn.execute(insert(table), rows)
+            self.counts[table.name] = self.counts.get(table.name, 0) + len(rows)
+            rows.clear()
+
+    def copy_rows(self, table, rows: list[dict]) -> None:
+        columns = list(rows[0])
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(
+            [row[column] for column in columns] for row in rows
+        )
+        buffer.seek(0)
+        cursor = self.conn.connection.dbapi_connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+        finally:
+            cursor.close()
+
+
+def reset_sequences(conn: Connection) -> None:
+    """Move PostgreSQL id sequences past the ids written explicitly here."""
+    from src.db.models import Comments, HashTags, Posts, Users
+
+    if conn.dialect.name != "postgresql":
+        return
+    for column in (
+        Users.__table__.c.user_id,
+        Posts.__table__.c.post_id,
+        Comments.__table__.c.comment_id,
+        HashTags.__table__.c.hashtag_id,
+    ):
+        table, name = column.table.name, column.name
+        conn.execute(
+            text(
+                f"SELECT setval(pg_get_serial_sequence('{table}', '{name}'), "
+                f"GREATEST((SELECT max({name}) FROM {table}), 1))"
+            )
+        )
+
+
+def seed_dataset(
+    engine: Engine,
+    users: int,
+    posts: int,
+    hashtags: int,
+    comments: int,
+    reactions: int,
+    skew: float = 1.1,
+    seed: int = 0,
+    password_hash: str | None = None,
+    tags_per_post: int = 3,
+    max_comments_per_post: int | None = None,
+    reply_ratio: float = 0.5,
+    like_ratio: float = 0.8,
+    chunk_size: int = CHUNK_SIZE,
+    progress=None,
+) -> dict:
+    """Insert a dataset into an empty database and describe what was made.
+
+    Every user's password is ``PASSWORD``; pass ``password_hash`` to skip
+    hashing it here. Each post gets up to ``tags_per_post`` hashtags. Its
+    share of ``comments`` and ``reactions`` follows its popularity rank,
+    capped at ``max_comments_per_post`` comments and one reaction per user.
+    A ``reply_ratio`` share of comments reply to an earlier comment of the
+    same post, so threads nest up to ``COMMENT_MAX_DEPTH`` levels.
+    The returned dict lists post ids and hashtags from most to least
+    popular, so benchmarks can pick targets with the same skew.
+    """
+    from src.authentication.hashing import hash_password
+    from src.db.models import Comments, Dislikes, HashTags, Likes, Posts, Users
+    from src.db.models import post_hashtag
+    from src.post.threads import comment_path
+    from src.settings.config import config
+
+    rng = random.Random(seed)
+    password_hash = password_hash or hash_password(PASSWORD)
+    start = EPOCH - timedelta(days=365)
+    vocabulary = [f"tag{rank}" for rank in range(hashtags)]
+    post_weights = zipf_weights(posts, skew)
+    tag_weights = zipf_weights(hashtags, skew)
+    # Popularity rank is shuffled against insertion order so popular posts
+    # are not all the oldest ones.
+    popular_posts = rng.sample(range(1, posts + 1), posts)
+    progress = progress or (lambda step: None)
+
+    def random_time(*after: datetime) -> datetime:
+        """A whole second between the latest of ``after`` and ``EPOCH``."""
+        earliest = max(after, default=start)
+        span = int((EPOCH - earliest).total_seconds())
+        return earliest + timedelta(seconds=rng.randrange(max(span, 1)))
+
+    # Indexed by id, to date what is written after them.
+    signed_up = [start] + [random_time() for _ in range(users)]
+    posted = [start]
+
+    with engine.begin() as conn:
+        writer = BulkWriter(conn, chunk_size)
+        for user_id in range(1, users + 1):
+            writer.add(
+                Users,
+                {
+                    "user_id": user_id,
+                    "username": f"user{user_id}",
+                    "email": f"user{user_id}@example.com",
+                    "password_hash": password_hash,
+                    "firstname": "Bench",
+                    "lastname": f"User{user_id}",
+                    "dob": None,
+                    "is_admin": user_id == 1,
+                    "is_active": True,
+                    "acct_deactivated": False,
+                    "created_at": signed_up[user_id],
+                    "image_url": config.DEFAULT_PROFILE_IMAGE,
+                },
+            )
+        writer.flush()
+        progress("users")
+
+        hashtag_id = 0
+        for post_id in range(1, posts + 1):
+            tags = sorted(
+                set(
+                    rng.choices(
+                        vocabulary,
+                        cum_weights=tag_weights,
+                        k=rng.randint(0, tags_per_post) if vocabulary else 0,
+                    )
+                )
+            )
+            user_id = rng.randint(1, users)
+            posted.append(random_time(signed_up[user_id]))
+            writer.add(
+                Posts,
+                {
+                    "post_id": post_id,
+                    "user_id": user_id,
+                    "post_title": f"Post {post_id}",
+                    "post_content": " ".join(
+                        ["Benchmark post"] + [f"#{tag}" for tag in tags]
+                    ),
+                    "post_image": None,
+                    "posted_at": posted[post_id],
+                },
+            )
+            for tag in tags:
+                hashtag_id += 1
+                writer.add(HashTags, {"hashtag_id": hashtag_id, "hashtag": tag})
+                writer.add(post_hashtag, {"post_id": post_id, "hashtag_id": hashtag_id})
+        writer.flush()
+        progress("posts")
+
+        # Ids and paths are written here, so replies can point at comments
+        # of the same post written before them.
+        comment_ids = itertools.count(1)
+        comment_counts = zipf_counts(comments, post_weights, rng)
+        for post_id, count in zip(popular_posts, comment_counts):
+            if max_comments_per_post is not None:
+                count = min(count, max_comments_per_post)
+            thread = []
+            for _ in range(count):
+                comment_id = next(comment_ids)
+                parent_id, parent_depth, parent_path = None, -1, ""
+                parent_time = posted[post_id]
+                if thread and rng.random() < reply_ratio:
+                    candidate = rng.choice(thread)
+                    if candidate[1] < config.COMMENT_MAX_DEPTH:
+                        parent_id, parent_depth, parent_path, parent_time = candidate
+                user_id = rng.randint(1, users)
+                commented_at = random_time(parent_time, signed_up[user_id])
+                path = comment_path(parent_path, comment_id)
+                thread.append((comment_id, parent_depth + 1, path, commented_at))
+                writer.add(
+                    Comments,
+                    {
+                        "comment_id": comment_id,
+                        "user_id": user_id,
+                        "post_id": post_id,
+                        "parent_id": parent_id,
+                        "depth": parent_depth + 1,
+                        "path": path,
+                        "comment_content": "Benchmark comment",
+                        "commented_at": commented_at,
+                    },
+                )
+        writer.flush()
+        progress("comments")
+
+        # Distinct users per post: a user reacts to a post at most once,
+        # either way.
+        reaction_counts = zipf_counts(reactions, post_weights, rng)
+        for post_id, count in zip(popular_posts, reaction_counts):
+            for user_id in rng.sample(range(1, users + 1), min(count, users)):
+                table = Likes if rng.random() < like_ratio else Dislikes
+                writer.add(table, {"user_id": user_id, "post_id": post_id})
+        writer.flush()
+        progress("reactions")
+
+        reset_sequences(conn)
+
+    counts = writer.counts
+    return {
+        "users": users,
+        "posts": posts,
+        "hashtags": hashtags,
+        "comments": counts.get("comments", 0),
+        "reactions": counts.get("likes", 0) + counts.get("dislikes", 0),
+        "skew": skew,
+        "seed": seed,
+        "rows": counts,
+        "popular_posts": popular_posts,
+        "post_weights": post_weights,
+        "popular_hashtags": vocabulary,
+        "hashtag_weights": tag_weights,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dataset", choices=PRESETS, default="small")
+    for key in PRESETS["small"]:
+        parser.add_argument(f"--{key}", type=int, default=None)
+    parser.add_argument("--skew", type=float, default=1.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tags-per-post", type=int, default=3)
+    parser.add_argument("--max-comments-per-post", type=int, default=None)
+    parser.add_argument("--reply-ratio", type=float, default=0.5)
+    parser.add_argument("--like-ratio", type=float, default=0.8)
+    parser.add_argument("--password-hash", default=None)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--db-url", default=None)
+    args = parser.parse_args()
+
+    sizes = {
+        key: getattr(args, key) if getattr(args, key) is not None else value
+        for key, value in PRESETS[args.dataset].items()
+    }
+    if args.db_url:
+        os.environ["DB_URL"] = args.db_url
+
+    from src.db.database import engine
+    from src.db.migrate import migrate
+    from src.db.models import Users
+
+    migrate()
+    with engine.connect() as conn:
+        if conn.execute(select(func.count()).select_from(Users)).scalar():
+            sys.exit(f"{engine.url!r} already has users; use an empty database.")
+
+    start = time.perf_counter()
+    last = [start]
+
+    def progress(step: str) -> None:
+        now = time.perf_counter()
+        print(f"{step:10} {now - last[0]:8.1f}s")
+        last[0] = now
+
+    dataset = seed_dataset(
+        engine,
+        **sizes,
+        skew=args.skew,
+        seed=args.seed,
+        password_hash=args.password_hash,
+        tags_per_post=args.tags_per_post,
+        max_comments_per_post=args.max_comments_per_post,
+        reply_ratio=args.reply_ratio,
+        like_ratio=args.like_ratio,
+        chunk_size=args.chunk_size,
+        progress=progress,
+    )
+    elapsed = time.perf_counter() - start
+    rows = sum(dataset["rows"].values())
+    print(
+        f"{engine.dialect.name}: {rows} rows in {elapsed:.1f}s "
+        f"({rows / elapsed:.0f} rows/s) "
+        + " ".join(f"{table}={count}" for table, count in dataset["rows"].items())
+    )
+
+
+if __name__ == "__main__":
+    main()
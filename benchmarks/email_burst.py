@@ -0,0 +1,124 @@
+"""Outbox throughput against a local SMTP stand-in.
+
+Starts a minimal SMTP server on localhost that counts connections and
+messages, queues a burst of emails in a scratch SQLite outbox and drains
+it::
+
+    python -m benchmarks.email_burst --emails 500
+    python -m benchmarks.email_burst --emails 500 --fresh-connections
+
+``--fresh-connections`` opens a new SMTP connection per message, i.e. the
+behaviour before the pooled sender, for comparison. ``--fail-every N``
+makes the server reject every Nth message with a temporary error to
+exercise the retry path.
+"""
+
+import argparse
+import os
+import socketserver
+import tempfile
+import threading
+import time
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, fail_every: int = 0) -> None:
+        super().__init__(("127.0.0.1", 0), SMTPHandler)
+        self.fail_every = fail_every
+        self.connections = 0
+        self.attempts = 0
+        self.messages = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line: str) -> None:
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self) -> None:
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply("220 localhost stand-in")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors="replace").strip().upper()
+            if command.startswith("EHLO"):
+                self.reply("250 localhost")
+            elif command.startswith("DATA"):
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while self.rfile.readline() not in (b".\r\n", b".\n", b""):
+                    pass
+                with server.lock:
+                    server.attempts += 1
+                    fail = (
+                        server.fail_every and server.attempts % server.fail_every == 0
+                    )
+                    if fail:
+                        server.rejected += 1
+                    else:
+                        server.messages += 1
+                self.reply("451 Try again later" if fail else "250 Queued")
+            elif command.startswith("QUIT"):
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--emails", type=int, default=500)
+    parser.add_argument("--rate", type=float, default=0)
+    parser.add_argument("--fail-every", type=int, default=0)
+    parser.add_argument("--fresh-connections", action="store_true")
+    args = parser.parse_args()
+
+    server = SMTPStandIn(args.fail_every)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    os.environ["DB_URL"] = f"sqlite:///{tempfile.mkdtemp()}/outbox.db"
+    os.environ["MAIL_SERVER"] = "127.0.0.1"
+    os.environ["MAIL_PORT"] = str(server.server_address[1])
+    os.environ["MAIL_STARTTLS"] = "false"
+    os.environ["MAIL_USE_CREDENTIALS"] = "false"
+    os.environ["OUTBOX_RATE_PER_SECOND"] = str(args.rate)
+    os.environ["OUTBOX_BACKOFF_SECONDS"] = "0"
+
+    from src.db.database import sessionLocal
+    from src.db.migrate import migrate
+    from src.db.models import OutboxEmail
+    from src import outbox
+
+    migrate()
+    if args.fresh_connections:
+        outbox.sender.idle_seconds = -1
+
+    session = sessionLocal()
+    for i in range(args.emails):
+        outbox.queue_email(
+            session, [f"user{i}@example.com"], "<p>Hello</p>", "MyBlog - Benchmark"
+        )
+
+    start = time.perf_counter()
+    while session.query(OutboxEmail).filter(OutboxEmail.status == "pending").count():
+        outbox.drain_outbox(session)
+    elapsed = time.perf_counter() - start
+    outbox.sender.close()
+    session.close()
+
+    print(
+        f"emails={args.emails} sent={server.messages} retried={server.rejected} "
+        f"smtp_connections={server.connections} elapsed={elapsed:.2f}s "
+        f"throughput={server.messages / elapsed:.0f}/s"
+    )
+
+
+if __name__ == "__main__":
+    main()
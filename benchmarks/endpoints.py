@@ -0,0 +1,322 @@
+"""End-to-end latency of the hot endpoints against a seeded dataset.
+
+Runs the app in-process on a scratch SQLite database (or ``--db-url``, e.g.
+a local PostgreSQL database created for the purpose), seeds it with
+``benchmarks.dataset`` and drives each scenario with ``--concurrency``
+clients. Targets (posts, hashtags) are picked with the same skew as the
+data. Media storage is replaced by an in-memory stand-in, so no Mega
+account is needed::
+
+    python -m benchmarks.endpoints
+    python -m benchmarks.endpoints --dataset medium --requests 500 --concurrency 8
+    python -m benchmarks.endpoints --scenarios get_post like_post --compare old.json
+
+Reports p50/p95/p99 latency, throughput and SQL statements per request for
+each scenario and saves them as JSON (``benchmarks/results/`` by default).
+``--compare`` prints the change against an earlier results file and exits
+non-zero when a scenario's p95 or query count regressed past
+``--threshold``.
+"""
+
+import argparse
+import json
+import os
+import random
+import secrets
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from .dataset import PASSWORD, PRESETS, seed_dataset
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+class StorageStandIn:
+    """In-memory replacement for the Mega client used by ``processor_image``."""
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def call(self, method: str, *args, **kwargs):
+        with self.lock:
+            self.calls += 1
+        if method == "find":
+            return ("folder", {"h": "benchmark-folder"})
+        if method == "upload":
+            return {"f": [{"h": secrets.token_hex(8)}]}
+        if method == "get_upload_link":
+            return f"https://mega.example/file/{args[0]['f'][0]['h']}"
+        return None
+
+
+def percentile(values: list[float], pct: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * pct / 100), len(values) - 1)]
+
+
+class Scenarios:
+    """Each scenario builds one request: ``(method, url, request kwargs)``."""
+
+    def __init__(self, dataset: dict, tokens: dict[int, str]) -> None:
+        self.dataset = dataset
+        self.tokens = tokens
+
+    def user(self, rng: random.Random) -> int:
+        return rng.randint(1, self.dataset["users"])
+
+    def auth(self, rng: random.Random) -> dict:
+        return {"Authorization": f"Bearer {self.tokens[self.user(rng)]}"}
+
+    def post_id(self, rng: random.Random) -> int:
+        return rng.choices(
+            self.dataset["popular_posts"], cum_weights=self.dataset["post_weights"]
+        )[0]
+
+    def hashtag(self, rng: random.Random) -> str:
+        return rng.choices(
+            self.dataset["popular_hashtags"],
+            cum_weights=self.dataset["hashtag_weights"],
+        )[0]
+
+    def list_posts(self, rng):
+        return "GET", "/api/posts/", {}
+
+    def get_post(self, rng):
+        return "GET", f"/api/posts/{self.post_id(rng)}/", {"headers": self.auth(rng)}
+
+    def posts_by_hashtag(self, rng):
+        return (
+            "GET",
+            f"/api/posts/hashtags/{self.hashtag(rng)}",
+            {"headers": self.auth(rng)},
+        )
+
+    def comment_threads(self, rng):
+        return (
+            "GET",
+            f"/api/posts/{self.post_id(rng)}/comments/threads/",
+            {"headers": self.auth(rng)},
+        )
+
+    def like_post(self, rng):
+        return (
+            "POST",
+            f"/api/posts/{self.post_id(rng)}/like/",
+            {"headers": self.auth(rng)},
+        )
+
+    def login(self, rng):
+        data = {"username": f"user{self.user(rng)}", "password": PASSWORD}
+        return "POST", "/api/auth/login/", {"data": data}
+
+    def create_post(self, rng):
+        data = {
+            "post_title": "Benchmark",
+            "post_content": f"New post #{self.hashtag(rng)}",
+        }
+        files = {"post_image": ("image.png", b"\x89PNG\r\n" + bytes(2048))}
+        return (
+            "POST",
+            "/api/posts/",
+            {"data": data, "files": files, "headers": self.auth(rng)},
+        )
+
+    names = [
+        "list_posts",
+        "get_post",
+        "posts_by_hashtag",
+        "comment_threads",
+        "like_post",
+        "login",
+        "create_post",
+    ]
+
+
+def run_scenario(app, build, requests: int, concurrency: int, warmup: int, seed: int):
+    from fastapi.testclient import TestClient
+
+    per_client = [requests // concurrency] * concurrency
+    per_client[0] += requests % concurrency
+    latencies, queries, errors = [], [], []
+    lock = threading.Lock()
+
+    def client_loop(index: int, count: int) -> None:
+        rng = random.Random(seed * 1000 + index)
+        client = TestClient(app)
+        for i in range(-warmup if index == 0 else 0, count):
+            method, url, kwargs = build(rng)
+            start = time.perf_counter()
+            response = client.request(method, url, **kwargs)
+            elapsed = (time.perf_counter() - start) * 1000
+            if i < 0:
+                continue
+            with lock:
+                if response.status_code >= 400:
+                    errors.append(response.status_code)
+                latencies.append(elapsed)
+                queries.append(int(response.headers.get("X-Query-Count", 0)))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(client_loop, range(concurrency), per_client))
+    wall = time.perf_counter() - start
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "throughput_rps": round(len(latencies) / wall, 1),
+        "queries_per_request": round(statistics.mean(queries), 2),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: dict, baseline_path: str, threshold: float) -> int:
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nagainst {baseline_path} (commit {baseline.get('commit')}):")
+    regressions = 0
+    for name, current in results["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if not before:
+            continue
+        p95 = current["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0
+        queries = current["queries_per_request"] - before["queries_per_request"]
+        regressed = p95 > threshold or queries > 0
+        regressions += regressed
+        print(
+            f"{'REGRESSED' if regressed else 'ok':10} {name:18} p95 {p95:+7.1%} "
+            f"queries {queries:+.2f}"
+        )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dataset", choices=PRESETS, default="small")
+    for key in PRESETS["small"]:
+        parser.add_argument(f"--{key}", type=int, default=None)
+    parser.add_argument("--skew", type=float, default=1.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db-url", default=None)
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=Scenarios.names, default=Scenarios.names
+    )
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--compare", default=None)
+    parser.add_argument("--threshold", type=float, default=0.25)
+    args = parser.parse_args()
+
+    sizes = {
+        key: getattr(args, key) if getattr(args, key) is not None else value
+        for key, value in PRESETS[args.dataset].items()
+    }
+    os.environ["DB_URL"] = args.db_url or f"sqlite:///{tempfile.mkdtemp()}/endpoints.db"
+    # DEBUG adds X-Query-Count to every response; the limits would otherwise
+    # turn most benchmark requests into 429s and 503s.
+    os.environ["DEBUG"] = "true"
+    for limit in ("LOGIN", "SIGNUP", "FORGET_PASSWORD", "CREATE_POST"):
+        os.environ[f"RATE_LIMIT_{limit}"] = ""
+    os.environ["MAX_CONCURRENT_REQUESTS"] = "0"
+    os.environ["SHED_ON_DB_POOL_SATURATION"] = "false"
+
+    from fastapi.testclient import TestClient
+    from src import processor_image
+    from src.authentication.dependencies import JWT
+    from src.db.database import engine, sessionLocal
+    from src.db.migrate import migrate
+    from src.db.models import Users
+    from src.main import app
+
+    migrate()
+    with sessionLocal() as session:
+        if session.query(Users).first():
+            sys.exit(
+                f"{engine.url!r} already has users; point --db-url at an empty database."
+            )
+    start = time.perf_counter()
+    dataset = seed_dataset(engine, **sizes, skew=args.skew, seed=args.seed)
+    print(
+        f"seeded {engine.dialect.name} in {time.perf_counter() - start:.1f}s: "
+        + " ".join(f"{key}={dataset[key]}" for key in sizes)
+    )
+
+    processor_image.storage = StorageStandIn()
+    jwt = JWT()
+    tokens = {
+        user_id: jwt.jwt_encode_payload({"user_id": user_id, "is_admin": user_id == 1})
+        for user_id in range(1, dataset["users"] + 1)
+    }
+    scenarios = Scenarios(dataset, tokens)
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "database": engine.dialect.name,
+        "dataset": {
+            "preset": args.dataset,
+            **sizes,
+            "skew": args.skew,
+            "seed": args.seed,
+        },
+        "concurrency": args.concurrency,
+        "scenarios": {},
+    }
+    # The lifespan starts the hashing pool and background workers as in
+    # production.
+    with TestClient(app):
+        for name in args.scenarios:
+            result = run_scenario(
+                app,
+                getattr(scenarios, name),
+                args.requests,
+                args.concurrency,
+                args.warmup,
+                args.seed,
+            )
+            results["scenarios"][name] = result
+            print(
+                f"{name:18} n={result['requests']:5d} p50={result['p50_ms']:8.1f}ms "
+                f"p95={result['p95_ms']:8.1f}ms p99={result['p99_ms']:8.1f}ms "
+                f"{result['throughput_rps']:7.1f} req/s "
+                f"{result['queries_per_request']:5.1f} queries/req"
+                + (f" errors={result['errors']}" if result["errors"] else "")
+            )
+
+    output = args.output or os.path.join(
+        RESULTS_DIR,
+        f"{results['commit']}-{results['database']}-{args.dataset}.json",
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"saved {output}")
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
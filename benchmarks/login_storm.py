@@ -0,0 +1,130 @@
+"""Login-storm load test.
+
+Serves the app with uvicorn (in a separate process, so the load generator
+does not compete with it for the GIL) on a scratch SQLite database, measures the
+latency of a non-auth endpoint (``GET /api/posts/``) on its own, then again
+while many clients hammer ``POST /api/auth/login/``::
+
+    python -m benchmarks.login_storm --clients 64 --duration 10
+    python -m benchmarks.login_storm --clients 64 --duration 10 --hash-workers 0
+
+``--hash-workers 0`` hashes on the request thread, i.e. the behaviour before
+the bounded hashing pool, for comparison.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+
+def percentile(values: list[float], pct: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * pct / 100), len(values) - 1)]
+
+
+def probe(client, url: str, stop: threading.Event) -> list[float]:
+    latencies = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        client.get(url)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def storm(client, url: str, stop: threading.Event, statuses: Counter) -> None:
+    data = {"username": "storm", "password": "storm-password"}
+    while not stop.is_set():
+        statuses[client.post(url, data=data).status_code] += 1
+
+
+def report(label: str, latencies: list[float]) -> None:
+    print(
+        f"{label:<14} n={len(latencies):6d} p50={statistics.median(latencies):7.1f}ms "
+        f"p99={percentile(latencies, 99):7.1f}ms max={max(latencies):7.1f}ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--hash-workers", type=int, default=None)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    os.environ["DB_URL"] = f"sqlite:///{tempfile.mkdtemp()}/storm.db"
+    # Every client logs in as the same user from the same address; the login
+    # limit would otherwise answer all but the first few with 429.
+    os.environ["RATE_LIMIT_LOGIN"] = ""
+    if args.hash_workers is not None:
+        os.environ["HASH_POOL_WORKERS"] = str(args.hash_workers)
+
+    import httpx
+    from src.db.migrate import migrate
+    from src.db.database import sessionLocal
+    from src.db.models import Users
+    from src.authentication.dependencies import HashVerifyPassword
+
+    migrate()
+    session = sessionLocal()
+    session.add(
+        Users(
+            username="storm",
+            email="storm@example.com",
+            password_hash=HashVerifyPassword.hash_password("storm-password"),
+            firstname="Storm",
+            lastname="User",
+            is_active=True,
+        )
+    )
+    session.commit()
+    session.close()
+
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.main:app", "--no-access-log"]
+        + ["--port", str(args.port)],
+        env=os.environ,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    base = f"http://127.0.0.1:{args.port}"
+    with httpx.Client(base_url=base, timeout=60) as client:
+        while True:
+            try:
+                client.get("/")
+                break
+            except httpx.TransportError:
+                time.sleep(0.1)
+        stop = threading.Event()
+        timer = threading.Timer(args.duration, stop.set)
+        timer.start()
+        report("idle", probe(client, "/api/posts/", stop))
+
+        stop = threading.Event()
+        statuses = Counter()
+        clients = [httpx.Client(base_url=base, timeout=60) for _ in range(args.clients)]
+        stormers = [
+            threading.Thread(target=storm, args=(c, "/api/auth/login/", stop, statuses))
+            for c in clients
+        ]
+        for thread in stormers:
+            thread.start()
+        time.sleep(0.5)
+        threading.Timer(args.duration, stop.set).start()
+        report("login storm", probe(client, "/api/posts/", stop))
+        for thread in stormers:
+            thread.join()
+        print(f"login responses: {dict(statuses)}")
+
+    server.terminate()
+    server.wait()
+
+
+if __name__ == "__main__":
+    main()
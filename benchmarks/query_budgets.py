@@ -0,0 +1,430 @@
+"""Check every auth and post route against its declared query budget.
+
+Seeds a scratch SQLite database with posts that each carry comments, likes,
+dislikes and hashtags from several users, calls every route once and
+compares the SQL statements it issued with the budget declared by
+``@query_budget``. Exits non-zero if a route has no budget, has no scenario
+here, or goes over its budget, so it can run in CI::
+
+    python -m benchmarks.query_budgets
+    python -m benchmarks.query_budgets --posts 50
+"""
+
+import argparse
+import itertools
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse
+
+ADMIN, AUTHOR, READER, SPARE, DELETED = 1, 2, 3, 4, 5
+
+
+def seed(posts: int, users: int) -> None:
+    from sqlalchemy import insert
+    from src.authentication.hashing import hash_password
+    from src.db.database import engine
+    from src.db.models import Comments, Dislikes, HashTags, Likes, Posts, Users
+    from src.db.models import post_hashtag
+    from src.post.threads import comment_path
+
+    password_hash = hash_password("secret")
+    with engine.begin() as conn:
+        conn.execute(
+            insert(Users),
+            [
+                {
+                    "user_id": user_id,
+                    "username": f"user{user_id}",
+                    "email": f"user{user_id}@example.com",
+                    "password_hash": password_hash,
+                    "firstname": "Bench",
+                    "lastname": "User",
+                    "is_active": True,
+                    "is_admin": user_id == ADMIN,
+                }
+                for user_id in range(1, users + 1)
+            ],
+        )
+        conn.execute(
+            insert(Posts),
+            [
+                {
+                    "post_id": post_id,
+                    "user_id": AUTHOR,
+                    "post_title": f"Post {post_id}",
+                    "post_content": "Hello #bench #seed",
+                }
+                for post_id in range(1, posts + 1)
+            ],
+        )
+        reactors = range(SPARE + 2, users + 1)
+        conn.execute(
+            insert(Comments),
+            [
+                {
+                    "comment_id": comment_id,
+                    "user_id": user_id,
+                    "post_id": post_id,
+                    "comment_content": "Nice",
+                    "path": comment_path("", comment_id),
+                }
+                for comment_id, (post_id, user_id) in enumerate(
+                    itertools.product(range(1, posts + 1), reactors), start=1
+                )
+            ],
+        )
+        conn.execute(
+            insert(Likes),
+            [
+                {"user_id": user_id, "post_id": post_id}
+                for post_id in range(1, posts + 1)
+                for user_id in reactors[::2]
+            ],
+        )
+        conn.execute(
+            insert(Dislikes),
+            [
+                {"user_id": user_id, "post_id": post_id}
+                for post_id in range(1, posts + 1)
+                for user_id in reactors[1::2]
+            ],
+        )
+        conn.execute(
+            insert(HashTags),
+            [
+                {"hashtag_id": post_id * 2 + offset, "hashtag": tag}
+                for post_id in range(1, posts + 1)
+                for offset, tag in enumerate(["bench", "seed"])
+            ],
+        )
+        conn.execute(
+            insert(post_hashtag),
+            [
+                {"post_id": post_id, "hashtag_id": post_id * 2 + offset}
+                for post_id in range(1, posts + 1)
+                for offset in range(2)
+            ],
+        )
+
+
+def token_from(response, key: str) -> str:
+    return urlparse(response.json()["link"][key]).path.rstrip("/").split("/")[-1]
+
+
+def auth(user_id: int) -> dict:
+    from src.authentication.dependencies import JWT
+
+    token = JWT().jwt_encode_payload({"user_id": user_id, "is_admin": user_id == ADMIN})
+    return {"Authorization": f"Bearer {token}"}
+
+
+def request(client, method: str, path: str, **kwargs):
+    response = client.request(method, path, **kwargs)
+    if response.status_code >= 400:
+        sys.exit(f"{method} {path} failed: {response.status_code} {response.text}")
+    return response
+
+
+def run_routes(call) -> None:
+    """Call every auth and post route once against the ``seed`` data.
+
+    ``call(method, path_template, path, **request_kwargs)`` makes the
+    request and returns the response.
+    """
+    from sqlalchemy import func, select
+    from src.db.database import engine
+    from src.db.models import Comments
+
+    # Auth routes, in an order where each step sets up the next.
+    login = call(
+        "POST",
+        "/api/auth/login/",
+        "/api/auth/login/",
+        data={"username": f"user{READER}", "password": "secret"},
+    )
+    call(
+        "POST",
+        "/api/auth/refresh/",
+        "/api/auth/refresh/",
+        json={"refresh_token": login.json()["refresh_token"]},
+    )
+    signup = call(
+        "POST",
+        "/api/auth/signup/",
+        "/api/auth/signup/",
+        json={
+            "email": "new@example.com",
+            "firstname": "New",
+            "lastname": "User",
+            "password": "secret",
+        },
+    )
+    call(
+        "GET",
+        "/api/auth/activate-account/{token}",
+        f"/api/auth/activate-account/{token_from(signup, 'activation_link')}",
+    )
+    call(
+        "GET",
+        "/api/auth/users/profile/",
+        "/api/auth/users/profile/",
+        headers=auth(READER),
+    )
+    call(
+        "PUT",
+        "/api/auth/users/update-profile/",
+        "/api/auth/users/update-profile/",
+        data={"firstname": "Renamed"},
+        headers=auth(READER),
+    )
+    reset = call(
+        "POST",
+        "/api/auth/users/forget-password/{email}/",
+        f"/api/auth/users/forget-password/user{READER}@example.com/",
+    )
+    reset_token = token_from(reset, "reset_link")
+    call(
+        "GET",
+        "/api/auth/reset-password/verify-token/{token}/",
+        f"/api/auth/reset-password/verify-token/{reset_token}/",
+    )
+    call(
+        "POST",
+        "/api/auth/reset-password/update-password/{token}/",
+        f"/api/auth/reset-password/update-password/{reset_token}/",
+        data={"new_password": "secret2"},
+    )
+    change = call(
+        "POST",
+        "/api/auth/users/change-email/{new_email}/",
+        "/api/auth/users/change-email/changed@example.com/",
+        headers=auth(READER),
+    )
+    call(
+        "GET",
+        "/api/auth/update-email/verify-token/{token}/",
+        f"/api/auth/update-email/verify-token/{token_from(change, 'reset_link')}/",
+    )
+    call(
+        "POST",
+        "/api/auth/change-password/{new_password}/",
+        "/api/auth/change-password/secret3/",
+        headers=auth(READER),
+    )
+    # An hour after every signup, written at UTC-5: nobody matches unless
+    # the offset is dropped.
+    after = datetime.now(timezone(-timedelta(hours=5))) + timedelta(hours=1)
+    page = call(
+        "GET",
+        "/api/auth/all-users/",
+        "/api/auth/all-users/",
+        params={"created_from": after, "created_to": after + timedelta(days=1)},
+        headers=auth(ADMIN),
+    )
+    if page.json()["users"]:
+        sys.exit("GET /api/auth/all-users/ ignored the UTC offset of created_from")
+    call("GET", "/api/auth/all-users/", "/api/auth/all-users/", headers=auth(ADMIN))
+    call(
+        "GET",
+        "/api/auth/all-users/export/",
+        "/api/auth/all-users/export/",
+        params={"is_active": True},
+        headers=auth(ADMIN),
+    )
+    call(
+        "GET",
+        "/api/auth/users/{user_id}/deactivate/",
+        f"/api/auth/users/{SPARE}/deactivate/",
+        headers=auth(ADMIN),
+    )
+    call(
+        "GET",
+        "/api/auth/users/{user_id}/reactivate",
+        f"/api/auth/users/{SPARE}/reactivate",
+        headers=auth(ADMIN),
+    )
+    call(
+        "DELETE",
+        "/api/auth/users/",
+        "/api/auth/users/",
+        json=f"user{DELETED}@example.com",
+        headers=auth(ADMIN),
+    )
+    call(
+        "POST",
+        "/api/auth/users/bulk/{action}/",
+        "/api/auth/users/bulk/deactivate/",
+        json={"user_ids": [SPARE]},
+        headers=auth(ADMIN),
+    )
+
+    # Post routes. Post 1 is the author's; the reader reacts to post 2.
+    call(
+        "POST",
+        "/api/posts/",
+        "/api/posts/",
+        data={"post_title": "Budget", "post_content": "Counting #queries"},
+        headers=auth(AUTHOR),
+    )
+    call("GET", "/api/posts/users/", "/api/posts/users/", headers=auth(AUTHOR))
+    call("GET", "/api/posts/{post_id}/", "/api/posts/1/", headers=auth(READER))
+    call("GET", "/api/posts/", "/api/posts/", params={"since": "2000-01-01T00:00:00Z"})
+    call(
+        "GET",
+        "/api/posts/most-viewed/",
+        "/api/posts/most-viewed/",
+        params={"limit": 5},
+    )
+    call(
+        "GET",
+        "/api/posts/hashtags/{hashtag}",
+        "/api/posts/hashtags/bench",
+        headers=auth(READER),
+    )
+    call(
+        "PUT",
+        "/api/posts/{post_id}/",
+        "/api/posts/1/",
+        data={"post_title": "Edited", "post_content": "Edited #bench #new"},
+        headers=auth(AUTHOR),
+    )
+    call(
+        "POST",
+        "/api/posts/{post_id}/comments/",
+        "/api/posts/2/comments/",
+        json={"comment_content": "First"},
+        headers=auth(READER),
+    )
+    with engine.connect() as conn:
+        comment_id = conn.execute(select(func.max(Comments.comment_id))).scalar()
+    # Replying is the costlier way in; its count is the one kept.
+    call(
+        "POST",
+        "/api/posts/{post_id}/comments/",
+        "/api/posts/2/comments/",
+        json={"comment_content": "Reply", "parent_id": comment_id},
+        headers=auth(READER),
+    )
+    with engine.connect() as conn:
+        reply_id = conn.execute(select(func.max(Comments.comment_id))).scalar()
+    call(
+        "GET",
+        "/api/posts/{post_id}/comments/",
+        "/api/posts/2/comments/",
+        params={"since": "2000-01-01T00:00:00Z", "limit": 10},
+        headers=auth(READER),
+    )
+    call(
+        "GET",
+        "/api/posts/{post_id}/comments/threads/",
+        "/api/posts/2/comments/threads/",
+        params={"limit": 5, "replies": 2},
+        headers=auth(READER),
+    )
+    call(
+        "GET",
+        "/api/posts/comments/{comment_id}/replies/",
+        f"/api/posts/comments/{comment_id}/replies/",
+        params={"limit": 5},
+        headers=auth(READER),
+    )
+    call(
+        "PUT",
+        "/api/posts/comments/{comment_id}/",
+        f"/api/posts/comments/{reply_id}/",
+        json={"comment_content": "Edited"},
+        headers=auth(READER),
+    )
+    # Deleting the comment takes its reply with it.
+    call(
+        "DELETE",
+        "/api/posts/comments/{comment_id}/",
+        f"/api/posts/comments/{comment_id}/",
+        headers=auth(READER),
+    )
+    call(
+        "POST", "/api/posts/{post_id}/like/", "/api/posts/2/like/", headers=auth(READER)
+    )
+    call(
+        "POST",
+        "/api/posts/{post_id}/dislike/",
+        "/api/posts/2/dislike/",
+        headers=auth(READER),
+    )
+    call(
+        "DELETE",
+        "/api/posts/{post_id}/dislike/",
+        "/api/posts/2/dislike/",
+        headers=auth(READER),
+    )
+    call(
+        "POST", "/api/posts/{post_id}/like/", "/api/posts/2/like/", headers=auth(READER)
+    )
+    call(
+        "DELETE",
+        "/api/posts/{post_id}/like/",
+        "/api/posts/2/like/",
+        headers=auth(READER),
+    )
+    call("DELETE", "/api/posts/{post_id}/", "/api/posts/1/", headers=auth(AUTHOR))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--posts", type=int, default=20)
+    parser.add_argument("--users", type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ["DB_URL"] = f"sqlite:///{tempfile.mkdtemp()}/budgets.db"
+    os.environ["HASH_POOL_WORKERS"] = "0"
+    os.environ["PASSWORD_HASH_ROUNDS"] = "4"
+
+    from fastapi.routing import APIRoute
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+    from src.main import app
+    from src.db.database import engine
+    from src.db.migrate import migrate
+
+    migrate()
+    seed(args.posts, args.users)
+    client = TestClient(app)
+
+    queries = []
+    event.listen(engine, "before_cursor_execute", lambda *a: queries.append(1))
+    results: dict[tuple[str, str], tuple[int, int]] = {}
+
+    def call(method: str, template: str, path: str, **kwargs):
+        queries.clear()
+        response = request(client, method, path, **kwargs)
+        results[(method, template)] = (len(queries), response.status_code)
+        return response
+
+    run_routes(call)
+
+    failures = 0
+    for route in app.routes:
+        if not isinstance(route, APIRoute):
+            continue
+        if not route.path.startswith(("/api/auth/", "/api/posts/")):
+            continue
+        budget = getattr(route.endpoint, "query_budget", None)
+        for method in sorted(route.methods):
+            result = results.get((method, route.path))
+            if budget is None:
+                verdict, failures = "NO BUDGET", failures + 1
+            elif result is None:
+                verdict, failures = "NO SCENARIO", failures + 1
+            elif result[0] > budget:
+                verdict, failures = "OVER", failures + 1
+            else:
+                verdict = "ok"
+            count = result[0] if result else "-"
+            print(f"{verdict:12} {method:6} {route.path:50} {count!s:>4} / {budget}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
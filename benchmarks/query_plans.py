@@ -0,0 +1,172 @@
+"""Check that the queries of ``post.utils`` and ``authentication.utils`` use
+indexes.
+
+Seeds a scratch SQLite database (or ``--db-url``, e.g. an empty local
+PostgreSQL database) with the ``benchmarks.query_budgets`` data, calls every
+auth and post route once and records each statement issued from one of
+those modules. Each distinct statement is then run through ``EXPLAIN``.
+Exits non-zero when one plans a full scan of a table that grows with use,
+so it can run in CI next to the query budgets::
+
+    python -m benchmarks.query_plans
+    python -m benchmarks.query_plans --db-url postgresql://localhost/myblog_plans -v
+
+PostgreSQL is asked to avoid sequential scans (``enable_seqscan = off``):
+one that remains means no index can serve the query, whatever the size of
+the seeded tables.
+"""
+
+import argparse
+import os
+import re
+import sys
+import tempfile
+
+from .query_budgets import ADMIN, auth, request, run_routes, seed
+
+MODULES = {
+    "post.utils": os.path.join("post", "utils.py"),
+    "authentication.utils": os.path.join("authentication", "utils.py"),
+}
+
+# Tables that stay a handful of rows whatever the traffic.
+SMALL_TABLES = {"storage_folder", "account_status_version"}
+
+# Admin user listing filters, each requested on its own so each must be
+# served by an index.
+USER_FILTERS = (
+    {"is_active": False},
+    {"acct_deactivated": True},
+    {"is_admin": True},
+    {"created_from": "2020-01-01T00:00:00", "created_to": "2021-01-01T00:00:00"},
+)
+
+# The most viewed posts within a time range are picked from the posts of
+# that range, found through the posted_at index.
+TIME_RANGE = {"since": "2020-01-01T00:00:00Z"}
+
+# Full scans that are intended, by issuing function. They only cover
+# statements without a WHERE clause: a filtered one must use an index.
+ALLOWED = {
+    "authentication.utils.get_users_page": "keyset pages over user_id and "
+    "stops after one page",
+    "authentication.utils.iter_users_csv": "exports every matching user",
+    "post.utils.get_most_viewed_posts": "walks the views index and stops "
+    "after limit rows when no time range is given",
+}
+
+# SQLite reports full index scans as "SCAN t USING INDEX i"; they read the
+# whole table as surely as "SCAN t" does.
+FULL_SCAN = {
+    "sqlite": re.compile(r"^SCAN (\w+)(?: USING (?:COVERING )?INDEX \w+)?$"),
+    "postgresql": re.compile(r"Seq Scan on (\w+)"),
+}
+
+
+def issuer() -> str | None:
+    """The innermost ``MODULES`` function on the current stack, skipping
+    comprehensions and lambdas."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        code = frame.f_code
+        for module, suffix in MODULES.items():
+            if code.co_filename.endswith(suffix) and not code.co_name.startswith("<"):
+                return f"{module}.{code.co_name}"
+        frame = frame.f_back
+    return None
+
+
+def explain(conn, statement: str, parameters) -> list[str]:
+    if conn.dialect.name == "sqlite":
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+        return [row[-1] for row in rows]
+    rows = conn.exec_driver_sql(f"EXPLAIN {statement}", parameters)
+    return [row[0] for row in rows]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    # More posts than SQLite allows terms in a compound SELECT, so a listing
+    # whose statement grows per post fails here rather than in production.
+    parser.add_argument("--posts", type=int, default=600)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--db-url", default=None)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    os.environ["DB_URL"] = args.db_url or f"sqlite:///{tempfile.mkdtemp()}/plans.db"
+    os.environ["HASH_POOL_WORKERS"] = "0"
+    os.environ["PASSWORD_HASH_ROUNDS"] = "4"
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event, select, text
+    from src.main import app
+    from src.db.database import engine
+    from src.db.migrate import migrate
+    from src.db.models import Base, Users
+
+    migrate()
+    with engine.connect() as conn:
+        if conn.execute(select(Users.user_id)).first():
+            sys.exit(f"{engine.url!r} already has users; use an empty database.")
+    seed(args.posts, args.users)
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE"))
+    client = TestClient(app)
+
+    statements: dict[str, tuple[str, object]] = {}
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if executemany or statement.lstrip().upper().startswith("INSERT"):
+            return
+        name = issuer()
+        if name:
+            statements.setdefault(statement, (name, parameters))
+
+    event.listen(engine, "before_cursor_execute", record)
+    run_routes(
+        lambda method, template, path, **kwargs: request(client, method, path, **kwargs)
+    )
+    for params in USER_FILTERS:
+        request(
+            client, "GET", "/api/auth/all-users/", params=params, headers=auth(ADMIN)
+        )
+    request(client, "GET", "/api/posts/most-viewed/", params=TIME_RANGE)
+    event.remove(engine, "before_cursor_execute", record)
+
+    pattern = FULL_SCAN[engine.dialect.name]
+    # Scans of subqueries (e.g. "SCAN anon_1") read rows already narrowed
+    # down by an index; only tables count.
+    tables = set(Base.metadata.tables) - SMALL_TABLES
+    failures = 0
+    with engine.connect() as conn:
+        if engine.dialect.name == "postgresql":
+            conn.execute(text("SET enable_seqscan = off"))
+        for statement, (name, parameters) in statements.items():
+            plan = explain(conn, statement, parameters)
+            scans = {
+                match.group(1)
+                for line in plan
+                for match in [pattern.search(line.strip())]
+                if match and match.group(1) in tables
+            }
+            if not scans:
+                verdict = "ok"
+            elif name in ALLOWED and not re.search(r"\bWHERE\b", statement):
+                verdict = "allowed"
+                scans.add(f"({ALLOWED[name]})")
+            else:
+                verdict, failures = "FULL SCAN", failures + 1
+            summary = " ".join(statement.split())
+            print(f"{verdict:10} {name:50} {', '.join(sorted(scans))}")
+            if args.verbose or verdict != "ok":
+                print(f"           {summary[:200]}")
+                for line in plan:
+                    print(f"             {line}")
+    print(f"{len(statements)} statements, {failures} full scans")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Time-to-first-request benchmark.
+
+Each run starts a fresh interpreter, imports ``src.main`` and serves
+``GET /`` through the ASGI app, timing everything from process start::
+
+    python -m benchmarks.startup --runs 5
+    python -m benchmarks.startup --runs 5 --eager
+
+``--eager`` reproduces the old boot sequence (Mega login and
+``create_all`` before the first request) so both numbers can be compared on
+the same machine and database. Uses the configured ``DB_URL`` or a scratch
+SQLite file when none is set.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+CHILD = """
+import json, time
+start = time.perf_counter()
+from fastapi.testclient import TestClient
+from src.main import app
+if {eager}:
+    from src.db.migrate import migrate
+    from src.processor_image import storage
+    migrate()
+    storage.client()
+imported = time.perf_counter()
+with TestClient(app) as client:
+    client.get("/")
+served = time.perf_counter()
+print(json.dumps({{"import": imported - start, "first_request": served - start}}))
+"""
+
+
+def run_once(eager: bool, env: dict) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD.format(eager=eager)],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--eager", action="store_true")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    if not env.get("DB_URL"):
+        scratch = os.path.join(tempfile.mkdtemp(), "startup.db")
+        env["DB_URL"] = f"sqlite:///{scratch}"
+
+    runs = [run_once(args.eager, env) for _ in range(args.runs)]
+    mode = "eager" if args.eager else "lazy"
+    for key in ("import", "first_request"):
+        values = [run[key] * 1000 for run in runs]
+        print(
+            f"{mode:>5} {key:<14} median={statistics.median(values):8.1f}ms "
+            f"min={min(values):8.1f}ms max={max(values):8.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Signup latency for a common name whose username namespace is filling up.
+
+Seeds a scratch SQLite database with ``john<symbol>doe<5 digits>`` users
+until the given fraction of the 400,000 possible usernames is taken, then
+times ``create_new_user`` and counts the queries each signup issues::
+
+    python -m benchmarks.username_saturation --saturation 0 0.5 0.9 --signups 50
+"""
+
+import argparse
+import itertools
+import os
+import random
+import statistics
+import tempfile
+import time
+
+SYMBOLS = ["", "-", "_", "."]
+NAMESPACE = [
+    f"john{symbol}doe{num:05d}"
+    for symbol, num in itertools.product(SYMBOLS, range(100000))
+]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--saturation", type=float, nargs="+", default=[0, 0.5, 0.9])
+    parser.add_argument("--signups", type=int, default=50)
+    args = parser.parse_args()
+
+    os.environ["DB_URL"] = f"sqlite:///{tempfile.mkdtemp()}/usernames.db"
+    os.environ["HASH_POOL_WORKERS"] = "0"
+    os.environ["PASSWORD_HASH_ROUNDS"] = "4"
+
+    from sqlalchemy import event, insert
+    from src.db.database import engine, sessionLocal
+    from src.db.migrate import migrate
+    from src.db.models import Users
+    from src.authentication import schemas, utils
+
+    migrate()
+    queries = []
+    event.listen(engine, "before_cursor_execute", lambda *a: queries.append(1))
+
+    random.seed(0)
+    pool = random.sample(NAMESPACE, len(NAMESPACE))
+    seeded = 0
+    for saturation in sorted(args.saturation):
+        target = int(len(NAMESPACE) * saturation)
+        with engine.begin() as conn:
+            for start in range(seeded, target, 10000):
+                rows = [
+                    {
+                        "username": username,
+                        "email": f"{username}@example.com",
+                        "password_hash": "x",
+                        "firstname": "John",
+                        "lastname": "Doe",
+                    }
+                    for username in pool[start : min(start + 10000, target)]
+                ]
+                conn.execute(insert(Users), rows)
+        seeded = max(seeded, target)
+
+        latencies, query_counts = [], []
+        for i in range(args.signups):
+            session = sessionLocal()
+            signup = schemas.UserSignUpModel(
+                email=f"bench{saturation}-{i}@example.com",
+                firstname="John",
+                lastname="Doe",
+                password="secret",
+            )
+            queries.clear()
+            start = time.perf_counter()
+            created = utils.create_new_user(signup, session)
+            latencies.append((time.perf_counter() - start) * 1000)
+            query_counts.append(len(queries))
+            pool.remove(created.username) if created.username in pool else None
+            session.close()
+        seeded += args.signups
+        print(
+            f"saturation={saturation:4.0%} signup p50={statistics.median(latencies):6.2f}ms "
+            f"max={max(latencies):6.2f}ms queries/signup mean="
+            f"{statistics.mean(query_counts):4.1f} max={max(query_counts)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
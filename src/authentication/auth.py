@@ -1,14 +1,22 @@
 from datetime import date
-from fastapi import BackgroundTasks, Body, Depends, APIRouter, File, Form, UploadFile
+from typing import Literal
+from fastapi import Body, Depends, APIRouter, File, Form, Query, UploadFile
 from fastapi.security import OAuth2PasswordRequestForm
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import EmailStr
 from ..settings.config import config
 from ..db.database import get_session
 from . import schemas, utils
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
 from .html import verification_email_html, activate_account_html
+from .hashing import hash_pool
+from . import refresh_tokens, revocation
+from .revocation import account_status
 from ..processor_image import delete_image, upload_image
+from ..outbox import queue_email
+from ..ratelimit import login_rate_limit, rate_limit
+from ..metrics import query_budget
 from ..error import (
     InvalidLoginCredentials,
     UserExistException,
@@ -20,7 +28,6 @@ from .dependencies import (
     JWT,
     HashVerifyPassword,
     get_current_user,
-    send_email,
     EmailTokenizer,
     admin_role_checker,
 )
@@ -31,11 +38,18 @@ hash_verify_pwd = HashVerifyPassword()
 auth_router = APIRouter(prefix="/api/auth", tags=["auth"])
 
 
-@auth_router.post("/login/", response_model=schemas.LoginBearerModel, status_code=200)
+@auth_router.post(
+    "/login/",
+    response_model=schemas.LoginBearerModel,
+    status_code=200,
+    dependencies=[Depends(login_rate_limit("login", config.RATE_LIMIT_LOGIN))],
+)
+@query_budget(3)
 def login(
     formdata: OAuth2PasswordRequestForm = Depends(),
     session: Session = Depends(get_session),
 ):
+    hash_pool.ensure_capacity()
     user = utils.verify_user_email_or_username(
         email_or_username=formdata.username, session=session
     )
@@ -52,30 +66,77 @@ def login(
             "Your account has been deactivated by the admin."
         )
     hash_password = user.password_hash
-    if not hash_verify_pwd.verify_password(formdata.password, hash_password):
+    payload = schemas.Payload(user_id=user.user_id, is_admin=user.is_admin)
+    # Give the DB connection back to the pool while bcrypt runs.
+    session.close()
+    verified, new_hash = hash_verify_pwd.verify_and_update(
+        formdata.password, hash_password
+    )
+    if not verified:
         raise InvalidLoginCredentials(
             "Login fail. Check your username, email, or password."
         )
-    payload = schemas.Payload(user_id=user.user_id, is_admin=user.is_admin)
+    if new_hash:
+        utils.update_password_hash(payload.user_id, new_hash, session)
+    return issue_tokens(payload, session)
+
+
+def issue_tokens(
+    payload: schemas.Payload, session: Session, family: str | None = None
+) -> dict:
     token = jwt.jwt_encode_payload(payload=payload.model_dump())
-    return {"access_token": token, "token_type": "bearer"}
+    claims = refresh_tokens.issue(session, payload.user_id, family)
+    refresh_token = jwt.create_refresh_token(payload={**payload.model_dump(), **claims})
+    session.commit()
+    return {
+        "access_token": token,
+        "token_type": "bearer",
+        "refresh_token": refresh_token,
+        "expires_in": config.ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    }
+
+
+@auth_router.post("/refresh/", response_model=schemas.LoginBearerModel, status_code=200)
+@query_budget(3)
+def refresh_access_token(
+    body: schemas.RefreshTokenModel, session: Session = Depends(get_session)
+):
+    claims = jwt.jwt_decode_token(body.refresh_token, token_type="refresh")
+    family = refresh_tokens.rotate(session, claims)
+    user = utils.get_user_by_id(claims["user_id"], session)
+    if not user:
+        raise UserNotFoundException("User cannot be found.")
+    if user.acct_deactivated:
+        raise AccountDeactivatedException(
+            "Your account has been deactivated by the admin."
+        )
+    payload = schemas.Payload(user_id=user.user_id, is_admin=user.is_admin)
+    return issue_tokens(payload, session, family)
 
 
-@auth_router.post("/signup/", response_model=schemas.EmailTokenOut, status_code=201)
+@auth_router.post(
+    "/signup/",
+    response_model=schemas.EmailTokenOut,
+    status_code=201,
+    dependencies=[Depends(rate_limit("signup", config.RATE_LIMIT_SIGNUP))],
+)
+@query_budget(10)
 def signup(
     user: schemas.UserSignUpModel,
-    background_task: BackgroundTasks,
     session: Session = Depends(get_session),
 ):
+    hash_pool.ensure_capacity()
     user_exist = utils.get_user_by_email(email=user.email, session=session)
     if user_exist:
         raise UserExistException("User with this email already exists.")
+    # Give the DB connection back to the pool while bcrypt runs.
+    session.close()
     user = utils.create_new_user(user=user, session=session)
     email_tokenizer = EmailTokenizer(session)
-    token = email_tokenizer.generate_email_token(user.email)
+    token = email_tokenizer.generate_email_token(user.email, EmailTokenizer.ACTIVATION)
     activation_link = f"http://{config.HOST_SERVER}/api/auth/activate-account/{token}"
     html, subject = activate_account_html(user, activation_link)
-    background_task.add_task(send_email, [user.email], html, subject)
+    queue_email(session, [user.email], html, subject)
     return {
         "message": "Check your email to activate your account.",
         "link": {"activation_link": activation_link},
@@ -83,10 +144,11 @@ def signup(
 
 
 @auth_router.get("/activate-account/{token}", response_model=schemas.EmailTokenOut)
+@query_budget(7)
 def activate_account(token: str, session: Session = Depends(get_session)):
     email_tokenizer = EmailTokenizer(session)
-    email_tokenizer.verify_email_token(token)
-    email = email_tokenizer.delete_email_token(token)
+    email_tokenizer.verify_email_token(token, EmailTokenizer.ACTIVATION)
+    email = email_tokenizer.delete_email_token(token, EmailTokenizer.ACTIVATION)
     user = utils.get_user_by_email(email, session)
     user.is_active = True
     session.commit()
@@ -94,17 +156,19 @@ def activate_account(token: str, session: Session = Depends(get_session)):
 
 
 @auth_router.get("/users/profile/", response_model=schemas.UserOutModel)
+@query_budget(4)
 def get_current_user_profile(
     current_user: schemas.Payload = Depends(get_current_user),
     session: Session = Depends(get_session),
 ):
     user = utils.get_user_by_id(current_user.user_id, session)
-    return user
+    return utils.users_out(session, [user])[0]
 
 
 @auth_router.put(
     "/users/update-profile/", response_model=schemas.UserOutModel, status_code=201
 )
+@query_budget(8)
 async def update_user_profile(
     firstname: str | None = Form(None, examples=["John"]),
     lastname: str | None = Form(None, examples=["Doe"]),
@@ -132,29 +196,32 @@ async def update_user_profile(
         image_url=image_url,
     )
     user = utils.update_user_profile(user_id=user_id, user_in=user_in, session=session)
-    return user
+    return utils.users_out(session, [user])[0]
 
 
 @auth_router.post(
     "/users/forget-password/{email}/",
     response_model=schemas.EmailTokenOut,
     status_code=201,
+    dependencies=[
+        Depends(rate_limit("forget-password", config.RATE_LIMIT_FORGET_PASSWORD))
+    ],
 )
-async def forget_password(
+@query_budget(6)
+def forget_password(
     email: EmailStr,
-    background_task: BackgroundTasks,
     session: Session = Depends(get_session),
 ):
     user = utils.get_user_by_email(email=email, session=session)
     if not user:
         raise UserNotFoundException(f"User with email {email} cannot be found.")
     email_tokenizer = EmailTokenizer(session=session)
-    token = email_tokenizer.generate_email_token(email)
+    token = email_tokenizer.generate_email_token(email, EmailTokenizer.PASSWORD_RESET)
     reset_link = (
         f"http://{config.HOST_SERVER}/api/auth/reset-password/verify-token/{token}/"
     )
     html, subject = verification_email_html(user, reset_link)
-    background_task.add_task(send_email, [email], html, subject)
+    queue_email(session, [email], html, subject)
     return {
         "message": "Check your email to reset your password",
         "link": {"reset_link": reset_link},
@@ -164,9 +231,10 @@ async def forget_password(
 @auth_router.get(
     "/reset-password/verify-token/{token}/", response_model=schemas.EmailTokenOut
 )
+@query_budget(2)
 def verify_password(token: str, session: Session = Depends(get_session)):
     email_tokenizer = EmailTokenizer(session=session)
-    email_tokenizer.verify_email_token(token)
+    email_tokenizer.verify_email_token(token, EmailTokenizer.PASSWORD_RESET)
     return {
         "message": f"Reset password token is succcessfully verified. Proceed to 'http://{config.HOST_SERVER}/api/auth/reset-password/update-password/{token}/' to update your password."
     }
@@ -177,13 +245,16 @@ def verify_password(token: str, session: Session = Depends(get_session)):
     response_model=schemas.EmailTokenOut,
     status_code=201,
 )
+@query_budget(5)
 def update_password(
     token: str, new_password: str = Form(), session: Session = Depends(get_session)
 ):
     email_tokenizer = EmailTokenizer(session=session)
-    email = email_tokenizer.delete_email_token(token)
+    email = email_tokenizer.delete_email_token(token, EmailTokenizer.PASSWORD_RESET)
+    password_hash = hash_verify_pwd.hash_password(new_password)
     user = utils.get_user_by_email(email=email, session=session)
-    user.password_hash = hash_verify_pwd.hash_password(new_password)
+    user.password_hash = password_hash
+    refresh_tokens.revoke(session, [user.user_id])
     session.commit()
     return {"message": "Password updated successfully."}
 
@@ -193,20 +264,25 @@ def update_password(
     response_model=schemas.EmailTokenOut,
     status_code=201,
 )
+@query_budget(6)
 def send_update_email_link(
     new_email: EmailStr,
-    background_task: BackgroundTasks,
     current_user: schemas.Payload = Depends(get_current_user),
     session: Session = Depends(get_session),
 ):
+    new_email = new_email.lower()
+    if utils.get_user_by_email(email=new_email, session=session):
+        raise UserExistException("User with this email already exists.")
     user = utils.get_user_by_id(current_user.user_id, session)
     email_tokenizer = EmailTokenizer(session=session)
-    token = email_tokenizer.generate_email_token(email=new_email, old_email=user.email)
+    token = email_tokenizer.generate_email_token(
+        email=new_email, purpose=EmailTokenizer.EMAIL_CHANGE, old_email=user.email
+    )
     reset_link = (
         f"http://{config.HOST_SERVER}/api/auth/update-email/verify-token/{token}/"
     )
     html, subject = verification_email_html(user, reset_link)
-    background_task.add_task(send_email, [new_email], html, subject)
+    queue_email(session, [new_email], html, subject)
     return {
         "message": f"Check your email {new_email} for the reset email link.",
         "link": {"reset_link": reset_link},
@@ -214,39 +290,73 @@ def send_update_email_link(
 
 
 @auth_router.get("/update-email/verify-token/{token}/")
+@query_budget(8)
 def update_email(token: str, session: Session = Depends(get_session)):
     email_tokenizer = EmailTokenizer(session=session)
-    email_tokenizer.verify_email_token(token)
-    new_email, old_email = email_tokenizer.delete_email_token(token)
+    email_tokenizer.verify_email_token(token, EmailTokenizer.EMAIL_CHANGE)
+    new_email, old_email = email_tokenizer.delete_email_token(
+        token, EmailTokenizer.EMAIL_CHANGE
+    )
+    new_email = new_email.lower()
+    # Someone may have signed up with the address since the link was sent.
+    if utils.get_user_by_email(email=new_email, session=session):
+        raise UserExistException("User with this email already exists.")
     user = utils.get_user_by_email(email=old_email, session=session)
     user.email = new_email
-    session.commit()
+    try:
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        raise UserExistException("User with this email already exists.")
     return {"message": "email changed successfully."}
 
 
 @auth_router.post("/change-password/{new_password}/")
+@query_budget(3)
 def change_password(
     new_password: str,
     current_user: schemas.Payload = Depends(get_current_user),
     session: Session = Depends(get_session),
 ):
+    password_hash = hash_verify_pwd.hash_password(new_password)
     user = utils.get_user_by_id(current_user.user_id, session)
-    user.password_hash = hash_verify_pwd.hash_password(new_password)
+    user.password_hash = password_hash
+    refresh_tokens.revoke(session, [user.user_id])
     session.commit()
     return {"message": "Password changed successfully."}
 
 
-@auth_router.get("/all-users/", response_model=list[schemas.UserOutModel])
+@auth_router.get("/all-users/", response_model=schemas.UserPageModel)
+@query_budget(2)
 def get_users(
+    filters: schemas.UserFilterModel = Depends(),
+    limit: int = Query(50, ge=1, le=500),
+    cursor: int | None = None,
     session: Session = Depends(get_session),
     current_user: schemas.Payload = Depends(get_current_user),
 ):
     admin_role_checker(current_user)
-    users = utils.get_all_users(session=session)
-    return users
+    users, next_cursor = utils.get_users_page(session, filters, limit, cursor)
+    users = utils.users_out(session, users, schemas.AdminUserOutModel)
+    return {"users": users, "next_cursor": next_cursor}
+
+
+@auth_router.get("/all-users/export/")
+@query_budget(2)
+def export_users(
+    filters: schemas.UserFilterModel = Depends(),
+    current_user: schemas.Payload = Depends(get_current_user),
+):
+    admin_role_checker(current_user)
+    return StreamingResponse(
+        utils.iter_users_csv(filters),
+        media_type="text/csv",
+        headers={"Content-Disposition": 'attachment; filename="users.csv"'},
+    )
 
 
 @auth_router.get("/users/{user_id}/deactivate/")
+@query_budget(10)
 def deactivate_user(
     user_id: int,
     current_user: schemas.Payload = Depends(get_current_user),
@@ -257,10 +367,14 @@ def deactivate_user(
     if not user:
         raise UserNotFoundException(f"User with id {user_id} cannot be found")
     user.acct_deactivated = True
+    revocation.record_status_change(session, [user_id], revocation.DEACTIVATED)
+    session.commit()
+    account_status.refresh(session)
     return {"message": f"The user with id {user_id} has been successfully deactivated"}
 
 
 @auth_router.get("/users/{user_id}/reactivate")
+@query_budget(10)
 def reactivate_user(
     user_id: int,
     current_user: schemas.Payload = Depends(get_current_user),
@@ -271,10 +385,14 @@ def reactivate_user(
     if not user:
         raise UserNotFoundException(f"User with id {user_id} cannot be found")
     user.acct_deactivated = False
+    revocation.record_status_change(session, [user_id], None)
+    session.commit()
+    account_status.refresh(session)
     return {"message": f"The user with id {user_id} has been successfully reactivated"}
 
 
 @auth_router.delete("/users/")
+@query_budget(19)
 def delete_user_by_email(
     email: str = Body(),
     current_user: schemas.Payload = Depends(get_current_user),
@@ -283,14 +401,28 @@ def delete_user_by_email(
     admin_role_checker(current_user)
     user = utils.get_user_by_email(email=email, session=session)
     if user:
-        session.delete(user)
+        utils.delete_users(session, [user.user_id])
+        revocation.record_status_change(session, [user.user_id], revocation.DELETED)
         session.commit()
+        account_status.refresh(session)
         return JSONResponse(
             content={"messge": "user deleted successfully"}, status_code=204
         )
     return JSONResponse(content={"message": "user not found"}, status_code=404)
 
 
+@auth_router.post("/users/bulk/{action}/", response_model=schemas.BulkUserResultModel)
+@query_budget(10)
+def bulk_user_action(
+    action: Literal["deactivate", "reactivate", "delete"],
+    request: schemas.BulkUserActionModel,
+    current_user: schemas.Payload = Depends(get_current_user),
+    session: Session = Depends(get_session),
+):
+    admin_role_checker(current_user)
+    return utils.bulk_user_action(session, action, request, current_user.user_id)
+
+
 # @auth_router.post("/send-sample-email/")
 # async def send_sample_email(email: list[EmailStr] = Body()):
 #     html = """
@@ -0,0 +1,62 @@
+"""Report the password-hash cost that fits a verification-time budget.
+
+Run it on the machine that serves logins::
+
+    python -m src.authentication.calibrate --target-ms 250
+
+and put the reported value in ``PASSWORD_HASH_ROUNDS``.
+"""
+
+import argparse
+import statistics
+import time
+from ..settings.config import config
+from .hashing import build_context
+
+
+def time_verify(scheme: str, rounds: int, samples: int) -> float:
+    context = build_context(scheme, rounds)
+    hashed = context.hash("calibration-password")
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        context.verify("calibration-password", hashed)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def calibrate(scheme: str, target_ms: float, samples: int) -> tuple[int, float]:
+    handler = build_context(scheme).handler(scheme)
+    rounds = handler.min_rounds if handler.rounds_cost == "log2" else 1000
+    best = (rounds, time_verify(scheme, rounds, samples))
+    while rounds < handler.max_rounds:
+        if handler.rounds_cost == "log2":
+            rounds += 1
+        else:
+            # Linear cost: jump straight to the estimate, then refine upwards.
+            per_round = best[1] / best[0]
+            rounds = max(rounds + 1, int(target_ms / per_round))
+        elapsed = time_verify(scheme, rounds, samples)
+        print(f"{scheme} rounds={rounds:<10} verify={elapsed:8.1f}ms")
+        if elapsed > target_ms:
+            break
+        best = (rounds, elapsed)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target-ms", type=float, default=250)
+    parser.add_argument("--scheme", default=config.PASSWORD_HASH_SCHEME)
+    parser.add_argument("--samples", type=int, default=5)
+    args = parser.parse_args()
+
+    rounds, elapsed = calibrate(args.scheme, args.target_ms, args.samples)
+    print(
+        f"\nPASSWORD_HASH_SCHEME={args.scheme} PASSWORD_HASH_ROUNDS={rounds} "
+        f"(verify takes {elapsed:.1f}ms, target {args.target_ms:.0f}ms)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,32 @@
-import logging
+import hashlib
 import secrets
-from jose import jwt, JWTError
-from passlib.context import CryptContext
-from pydantic import EmailStr
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from jose import jwt, JWTError, ExpiredSignatureError
 from ..settings.config import config
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from . import schemas
-from fastapi_mail import ConnectionConfig, FastMail, MessageSchema, MessageType
+from sqlalchemy import delete, select
 from sqlalchemy.orm import Session
-from ..db.models import EmailToken
+from ..db.models import EmailToken, utc_now
+from ..workers import register_worker
+from . import hashing
+from .hashing import hash_pool
+from . import revocation
+from .revocation import account_status
 from ..error import (
-    JWTDecodeError,
+    AccountDeactivatedException,
+    InvalidLoginCredentials,
+    TokenExpiredError,
     SQLAlchemyDataCreationError,
     InvalidEmailVerificationToken,
     UserRoleException,
 )
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
 
@@ -30,11 +38,15 @@ def admin_role_checker(current_user: schemas.Payload) -> None:
 class HashVerifyPassword:
     @staticmethod
     def hash_password(password: str) -> str:
-        return pwd_context.hash(password)
+        return hash_pool.run(hashing.hash_password, password)
 
     @staticmethod
     def verify_password(password: str, hash_password: str) -> bool:
-        return pwd_context.verify(password, hash_password)
+        return hash_pool.run(hashing.verify_password, password, hash_password)
+
+    @staticmethod
+    def verify_and_update(password: str, hash_password: str) -> tuple[bool, str | None]:
+        return hash_pool.run(hashing.verify_and_update, password, hash_password)
 
 
 class JWT:
@@ -42,56 +54,126 @@ class JWT:
         self.SECRET_KEY = config.SECRET_KEY
         self.ALGORITHM = config.ALGORITHM
 
-    def jwt_encode_payload(self, payload: dict) -> str:
+    def jwt_encode_payload(
+        self,
+        payload: dict,
+        expires_in: timedelta | None = None,
+        token_type: str = "access",
+    ) -> str:
+        if expires_in is None:
+            expires_in = timedelta(minutes=config.ACCESS_TOKEN_EXPIRE_MINUTES)
+        payload = {
+            **payload,
+            "type": token_type,
+            "exp": int(time.time() + expires_in.total_seconds()),
+        }
         token = jwt.encode(payload, self.SECRET_KEY, algorithm=self.ALGORITHM)
         return token
 
-    def jwt_decode_token(self, token: str) -> dict:
+    def create_refresh_token(self, payload: dict) -> str:
+        return self.jwt_encode_payload(
+            payload,
+            expires_in=timedelta(days=config.REFRESH_TOKEN_EXPIRE_DAYS),
+            token_type="refresh",
+        )
+
+    def jwt_decode_token(self, token: str, token_type: str = "access") -> dict:
         try:
             payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
-        except JWTError as e:
-            raise JWTDecodeError(str(e))
-        else:
+        except ExpiredSignatureError:
+            raise TokenExpiredError("Token has expired. Kindly login again.")
+        except JWTError:
+            raise InvalidLoginCredentials("Could not validate the token.")
+        # Tokens issued before expiry was introduced carry no exp claim.
+        if "exp" not in payload:
+            raise TokenExpiredError("Token has expired. Kindly login again.")
+        if payload.get("type") != token_type:
+            raise InvalidLoginCredentials(f"The {token_type} token is invalid.")
+        return payload
+
+
+class VerifiedTokenCache:
+    """Bounded LRU of access tokens whose signature was already verified.
+
+    Entries are dropped once the token's ``exp`` has passed, so a cache hit
+    is always a token ``jwt.decode`` would still accept.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = int(max_size)
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[schemas.Payload, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> schemas.Payload | None:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+            payload, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[token]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
             return payload
 
+    def put(self, token: str, payload: schemas.Payload, expires_at: float) -> None:
+        with self._lock:
+            self._entries[token] = (payload, expires_at)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
 
 jwt_obj = JWT()
+token_cache = VerifiedTokenCache(config.TOKEN_CACHE_SIZE)
 
 
 def get_current_user(token: str = Depends(oauth_scheme)) -> schemas.Payload:
-    payload = jwt_obj.jwt_decode_token(token=token)
-    return schemas.Payload(**payload)
-
-
-async def send_email(email: list[EmailStr], html: str, subject: str) -> None:
-    conf = ConnectionConfig(
-        MAIL_USERNAME=config.MAIL_USERNAME,
-        MAIL_PASSWORD=config.MAIL_PASSWORD,
-        MAIL_FROM=config.MAIL_FROM,
-        MAIL_PORT=config.MAIL_PORT,
-        MAIL_SERVER=config.MAIL_SERVER,
-        MAIL_STARTTLS=True,
-        MAIL_SSL_TLS=False,
-        USE_CREDENTIALS=True,
-        VALIDATE_CERTS=False,
-    )
-
-    fm = FastMail(conf)
-
-    message = MessageSchema(
-        subject=subject,
-        recipients=email,
-        body=html,
-        subtype=MessageType.html,
-    )
-    try:
-        await fm.send_message(message)
-    except Exception as e:
-        logging.error(f"Error sending email: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+    user = token_cache.get(token)
+    if user is None:
+        payload = jwt_obj.jwt_decode_token(token=token)
+        user = schemas.Payload(**payload)
+        token_cache.put(token, user, payload["exp"])
+    reason = account_status.reason(user.user_id)
+    if reason == revocation.DEACTIVATED:
+        raise AccountDeactivatedException(
+            "Your account has been deactivated by the admin."
+        )
+    if reason == revocation.DELETED:
+        raise InvalidLoginCredentials("This account no longer exists.")
+    return user
 
 
 class EmailTokenizer:
+    """Single-use email tokens for account activation, password reset and
+    email change.
+
+    Only a SHA-256 digest of each token is stored. A token is only valid for
+    the purpose it was issued for and until its ``expires_at``.
+    """
+
+    ACTIVATION = "activation"
+    PASSWORD_RESET = "password_reset"
+    EMAIL_CHANGE = "email_change"
+
     def __init__(self, session: Session):
         self.session = session
 
@@ -99,12 +181,31 @@ class EmailTokenizer:
     def generate_token_(n=20) -> str:
         return secrets.token_hex(n)
 
-    def generate_email_token(self, email: str, old_email: str | None = None) -> str:
+    @staticmethod
+    def digest(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    @classmethod
+    def lifetime(cls, purpose: str) -> timedelta:
+        return {
+            cls.ACTIVATION: timedelta(hours=config.ACTIVATION_TOKEN_TTL_HOURS),
+            cls.PASSWORD_RESET: timedelta(
+                minutes=config.PASSWORD_RESET_TOKEN_TTL_MINUTES
+            ),
+            cls.EMAIL_CHANGE: timedelta(hours=config.EMAIL_CHANGE_TOKEN_TTL_HOURS),
+        }[purpose]
+
+    def generate_email_token(
+        self, email: str, purpose: str, old_email: str | None = None
+    ) -> str:
         token = self.generate_token_()
-        if old_email:
-            add_token = EmailToken(email=email, token=token, old_email=old_email)
-        else:
-            add_token = EmailToken(email=email, token=token)
+        add_token = EmailToken(
+            email=email,
+            token=self.digest(token),
+            purpose=purpose,
+            old_email=old_email,
+            expires_at=utc_now() + self.lifetime(purpose),
+        )
         try:
             self.session.add(add_token)
             self.session.commit()
@@ -113,19 +214,27 @@ class EmailTokenizer:
             raise SQLAlchemyDataCreationError(str(e))
         return token
 
-    def verify_email_token(self, token: str) -> None:
+    def get_email_token(self, token: str, purpose: str) -> EmailToken | None:
         email_token = (
-            self.session.query(EmailToken).filter(EmailToken.token == token).first()
+            self.session.query(EmailToken)
+            .filter(
+                EmailToken.token == self.digest(token),
+                EmailToken.purpose == purpose,
+                EmailToken.expires_at > utc_now(),
+            )
+            .first()
         )
+        return email_token
+
+    def verify_email_token(self, token: str, purpose: str) -> None:
+        email_token = self.get_email_token(token, purpose)
         if not email_token:
-            raise InvalidEmailVerificationToken()
+            raise InvalidEmailVerificationToken("The token is invalid or has expired.")
         email_token.is_verified = True
         self.session.commit()
 
-    def delete_email_token(self, token: str) -> str | tuple[str, str]:
-        email_token = (
-            self.session.query(EmailToken).filter(EmailToken.token == token).first()
-        )
+    def delete_email_token(self, token: str, purpose: str) -> str | tuple[str, str]:
+        email_token = self.get_email_token(token, purpose)
         if not email_token:
             raise InvalidEmailVerificationToken("The token is invalid or has expired.")
         if not email_token.is_verified:
@@ -146,3 +255,28 @@ class EmailTokenizer:
             self.session.delete(email_token)
             self.session.commit()
             return email, old_email
+
+
+def purge_expired_email_tokens(session: Session) -> int:
+    """Delete expired email tokens in batches, committing after each one."""
+    purged = 0
+    while True:
+        expired = (
+            select(EmailToken.id)
+            .where(EmailToken.expires_at <= utc_now())
+            .limit(config.EMAIL_TOKEN_PURGE_BATCH_SIZE)
+        )
+        result = session.execute(
+            delete(EmailToken).where(EmailToken.id.in_(expired.scalar_subquery()))
+        )
+        session.commit()
+        purged += result.rowcount
+        if result.rowcount < config.EMAIL_TOKEN_PURGE_BATCH_SIZE:
+            return purged
+
+
+register_worker(
+    "email-token-purge",
+    config.EMAIL_TOKEN_PURGE_INTERVAL_SECONDS,
+    purge_expired_email_tokens,
+)
@@ -0,0 +1,137 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable
+from passlib.context import CryptContext
+from ..settings.config import config
+from ..error import ServiceOverloadedException
+
+
+def build_context(scheme: str, rounds: int | None = None) -> CryptContext:
+    """Hash with ``scheme`` at ``rounds`` and flag every other hash for upgrade.
+
+    ``rounds`` is in the scheme's own unit (a log2 cost for bcrypt, an
+    iteration count for pbkdf2); without it passlib's default is used.
+    bcrypt stays accepted when another scheme is configured so existing
+    users can still log in and get rehashed.
+    """
+    schemes = [scheme] if scheme == "bcrypt" else [scheme, "bcrypt"]
+    options = {f"{scheme}__rounds": int(rounds)} if rounds else {}
+    return CryptContext(schemes=schemes, default=scheme, deprecated="auto", **options)
+
+
+pwd_context = build_context(config.PASSWORD_HASH_SCHEME, config.PASSWORD_HASH_ROUNDS)
+
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def verify_password(password: str, hash_password: str) -> bool:
+    return pwd_context.verify(password, hash_password)
+
+
+def verify_and_update(password: str, hash_password: str) -> tuple[bool, str | None]:
+    """Verify ``password`` and return a new hash if the stored one is outdated."""
+    return pwd_context.verify_and_update(password, hash_password)
+
+
+def _lower_priority(niceness: int) -> None:
+    if niceness:
+        os.nice(niceness)
+
+
+class HashingPool:
+    """Runs password hashing in a small process pool with a bounded queue.
+
+    At most ``workers + max_pending`` hashes are admitted at once; any
+    request beyond that is rejected straight away with
+    ``ServiceOverloadedException`` instead of tying up a request thread.
+    With ``workers=0`` hashing runs inline, which is handy for local runs.
+    Pool processes run at a lower CPU priority (``niceness``) so a login
+    spike cannot crowd out the processes serving other requests.
+    """
+
+    def __init__(self, workers: int, max_pending: int, niceness: int = 0) -> None:
+        self.workers = int(workers)
+        self.niceness = int(niceness)
+        self.capacity = self.workers + int(max_pending)
+        self.in_flight = 0
+        self.rejected = 0
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_lower_priority,
+                    initargs=(self.niceness,),
+                )
+            return self._executor
+
+    def _reset(self, broken: ProcessPoolExecutor) -> None:
+        with self._lock:
+            if self._executor is broken:
+                self._executor = None
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _reject(self) -> None:
+        self.rejected += 1
+        raise ServiceOverloadedException("The server is busy. Please retry shortly.")
+
+    def _admit(self) -> None:
+        with self._lock:
+            if self.in_flight >= self.capacity:
+                self._reject()
+            self.in_flight += 1
+
+    def ensure_capacity(self) -> None:
+        """Fail fast before doing any other work for a request that will hash."""
+        if self.saturated():
+            with self._lock:
+                self._reject()
+
+    def _release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    def saturated(self) -> bool:
+        return self.in_flight >= self.capacity
+
+    def run(self, fn: Callable, *args):
+        self._admit()
+        try:
+            if self.workers <= 0:
+                return fn(*args)
+            executor = self.executor()
+            try:
+                return executor.submit(fn, *args).result()
+            except BrokenProcessPool:
+                self._reset(executor)
+                return self.executor().submit(fn, *args).result()
+        finally:
+            self._release()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "capacity": self.capacity,
+            "in_flight": self.in_flight,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+hash_pool = HashingPool(
+    config.HASH_POOL_WORKERS, config.HASH_POOL_MAX_PENDING, config.HASH_POOL_NICENESS
+)
@@ -0,0 +1,89 @@
+import secrets
+from datetime import timedelta
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.orm import Session
+from ..settings.config import config
+from ..db.models import RefreshToken, utc_now
+from ..workers import register_worker
+from ..error import InvalidLoginCredentials
+
+
+def issue(session: Session, user_id: int, family: str | None = None) -> dict:
+    """Record a new refresh token for ``user_id`` and return the claims to
+    sign into it. Nothing is committed here."""
+    claims = {
+        "jti": secrets.token_urlsafe(16),
+        "fam": family or secrets.token_urlsafe(16),
+    }
+    session.execute(
+        insert(RefreshToken).values(
+            jti=claims["jti"],
+            family=claims["fam"],
+            user_id=user_id,
+            expires_at=utc_now() + timedelta(days=config.REFRESH_TOKEN_EXPIRE_DAYS),
+        )
+    )
+    return claims
+
+
+def rotate(session: Session, claims: dict) -> str:
+    """Spend the refresh token with ``claims`` and return its family, for the
+    token that replaces it.
+
+    Each refresh token works once. Presenting one again means it was copied:
+    the whole family is revoked, so whoever holds the newer token has to log
+    in again too.
+    """
+    jti, family = claims.get("jti"), claims.get("fam")
+    if not jti or not family:
+        # Issued before refresh tokens were tracked.
+        raise InvalidLoginCredentials(
+            "The refresh token is no longer valid. Kindly login again."
+        )
+    spent = session.execute(
+        update(RefreshToken)
+        .where(
+            RefreshToken.jti == jti,
+            RefreshToken.used_at == None,
+            RefreshToken.expires_at > utc_now(),
+        )
+        .values(used_at=utc_now())
+    )
+    if spent.rowcount == 1:
+        return family
+    session.execute(delete(RefreshToken).where(RefreshToken.family == family))
+    session.commit()
+    raise InvalidLoginCredentials(
+        "The refresh token is no longer valid. Kindly login again."
+    )
+
+
+def revoke(session: Session, user_ids: list[int]) -> None:
+    """Revoke every refresh token of ``user_ids`` in the caller's
+    transaction."""
+    session.execute(delete(RefreshToken).where(RefreshToken.user_id.in_(user_ids)))
+
+
+def purge_expired_refresh_tokens(session: Session) -> int:
+    """Delete expired refresh tokens in batches, committing after each one."""
+    purged = 0
+    while True:
+        expired = (
+            select(RefreshToken.jti)
+            .where(RefreshToken.expires_at <= utc_now())
+            .limit(config.REFRESH_TOKEN_PURGE_BATCH_SIZE)
+        )
+        result = session.execute(
+            delete(RefreshToken).where(RefreshToken.jti.in_(expired.scalar_subquery()))
+        )
+        session.commit()
+        purged += result.rowcount
+        if result.rowcount < config.REFRESH_TOKEN_PURGE_BATCH_SIZE:
+            return purged
+
+
+register_worker(
+    "refresh-token-purge",
+    config.REFRESH_TOKEN_PURGE_INTERVAL_SECONDS,
+    purge_expired_refresh_tokens,
+)
@@ -0,0 +1,164 @@
+import threading
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.orm import Session
+from ..settings.config import config
+from ..db.database import sessionLocal
+from ..db.models import AccountRevocation, AccountStatusVersion, utc_now
+from ..workers import register_worker
+from .. import invalidation
+from ..invalidation import bus
+
+DEACTIVATED = "deactivated"
+DELETED = "deleted"
+
+
+def revocation_window() -> timedelta:
+    # Past this, every access token issued before the change has expired and
+    # login/refresh read the account status from the users table anyway.
+    return timedelta(minutes=config.ACCESS_TOKEN_EXPIRE_MINUTES)
+
+
+def bump_version(session: Session) -> int:
+    """Take the next account-status version.
+
+    The UPDATE locks the counter row until the caller commits, so versions
+    become visible in order and a reader never skips one.
+    """
+    result = session.execute(
+        update(AccountStatusVersion)
+        .where(AccountStatusVersion.id == 1)
+        .values(version=AccountStatusVersion.version + 1)
+    )
+    if result.rowcount == 0:
+        session.execute(insert(AccountStatusVersion).values(id=1, version=1))
+    return session.execute(
+        select(AccountStatusVersion.version).where(AccountStatusVersion.id == 1)
+    ).scalar_one()
+
+
+def record_status_change(
+    session: Session, user_ids: list[int], reason: str | None
+) -> None:
+    """Stage a status change for ``user_ids`` in the caller's transaction.
+
+    ``reason`` is ``DEACTIVATED`` or ``DELETED``, or ``None`` to lift a
+    revocation. Call ``account_status.refresh`` after committing so this
+    process enforces it straight away; the invalidation bus wakes the
+    refresh in the other processes.
+    """
+    if not user_ids:
+        return
+    version = bump_version(session)
+    session.execute(
+        delete(AccountRevocation).where(AccountRevocation.user_id.in_(user_ids))
+    )
+    now = utc_now()
+    session.execute(
+        insert(AccountRevocation),
+        [
+            {
+                "user_id": user_id,
+                "reason": reason,
+                "version": version,
+                "updated_at": now,
+            }
+            for user_id in user_ids
+        ],
+    )
+    bus.publish(session, invalidation.ACCOUNT, user_ids)
+
+
+class AccountStatusCache:
+    """In-memory set of recently deactivated or deleted accounts.
+
+    ``refresh`` reads the single-row version counter and, only when it moved,
+    loads the revocation rows newer than the local version. Request handling
+    therefore checks a dict and never queries the database.
+    """
+
+    def __init__(self) -> None:
+        self.version: int | None = None
+        self._revoked: dict[int, tuple[str, datetime]] = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def refresh(self, session: Session) -> int:
+        with self._refresh_lock:
+            return self._refresh(session)
+
+    def _refresh(self, session: Session) -> int:
+        current = session.execute(
+            select(AccountStatusVersion.version).where(AccountStatusVersion.id == 1)
+        ).scalar()
+        current = current or 0
+        with self._lock:
+            local = self.version
+        if local is None or current != local:
+            since = local if local is not None and current > local else 0
+            rows = session.execute(
+                select(
+                    AccountRevocation.user_id,
+                    AccountRevocation.reason,
+                    AccountRevocation.updated_at,
+                ).where(
+                    AccountRevocation.version > since,
+                    AccountRevocation.version <= current,
+                )
+            ).all()
+            with self._lock:
+                if since == 0:
+                    self._revoked.clear()
+                for user_id, reason, updated_at in rows:
+                    if reason:
+                        self._revoked[user_id] = (reason, updated_at)
+                    else:
+                        self._revoked.pop(user_id, None)
+                self.version = current
+        self.prune()
+        return current
+
+    def prune(self) -> None:
+        cutoff = utc_now() - revocation_window()
+        with self._lock:
+            for user_id, (_, updated_at) in list(self._revoked.items()):
+                if updated_at.replace(tzinfo=timezone.utc) < cutoff:
+                    del self._revoked[user_id]
+
+    def reason(self, user_id: int) -> str | None:
+        if self.version is None:
+            with sessionLocal() as session:
+                self.refresh(session)
+        entry = self._revoked.get(user_id)
+        return entry[0] if entry else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"version": self.version, "revoked": len(self._revoked)}
+
+
+account_status = AccountStatusCache()
+
+
+def purge_old_revocations(session: Session) -> int:
+    result = session.execute(
+        delete(AccountRevocation).where(
+            AccountRevocation.updated_at < utc_now() - revocation_window()
+        )
+    )
+    session.commit()
+    return result.rowcount
+
+
+account_status_worker = register_worker(
+    "account-status-refresh",
+    config.ACCOUNT_STATUS_REFRESH_SECONDS,
+    account_status.refresh,
+)
+# The periodic refresh stays as a safety net for lost messages.
+bus.subscribe(invalidation.ACCOUNT, lambda user_ids: account_status_worker.wake())
+register_worker(
+    "account-revocation-purge",
+    config.ACCOUNT_REVOCATION_PURGE_INTERVAL_SECONDS,
+    purge_old_revocations,
+)
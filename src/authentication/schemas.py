@@ -1,10 +1,17 @@
 from datetime import date, datetime
-from pydantic import BaseModel, EmailStr, Field, field_validator
+from pydantic import BaseModel, EmailStr, Field, field_validator, model_validator
+from ..post.schemas import naive_utc
 
 
 class LoginBearerModel(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: str | None = None
+    expires_in: int | None = None
+
+
+class RefreshTokenModel(BaseModel):
+    refresh_token: str
 
 
 class Payload(BaseModel):
@@ -60,9 +67,61 @@ class UserOutModel(UserBaseModel):
         from_attributes = True
 
 
+class AdminUserOutModel(UserOutModel):
+    acct_deactivated: bool
+
+
+class UserPageModel(BaseModel):
+    users: list[AdminUserOutModel]
+    next_cursor: int | None = None
+
+
+class UserFilterModel(BaseModel):
+    is_active: bool | None = None
+    acct_deactivated: bool | None = None
+    is_admin: bool | None = None
+    created_from: datetime | None = None
+    created_to: datetime | None = None
+    username: str | None = Field(None, description="Username prefix")
+    email: str | None = Field(None, description="Email prefix")
+
+    _naive_utc = field_validator("created_from", "created_to")(naive_utc)
+
+
+class BulkUserActionModel(BaseModel):
+    user_ids: list[int] | None = Field(None, max_length=10000)
+    filters: UserFilterModel | None = None
+
+    @model_validator(mode="after")
+    def ids_or_filters(self):
+        if (self.user_ids is None) == (self.filters is None):
+            raise ValueError("Provide either user_ids or filters.")
+        if self.filters and not self.filters.model_dump(exclude_none=True):
+            raise ValueError("filters must set at least one field.")
+        return self
+
+
+class BulkChunkModel(BaseModel):
+    chunk: int
+    matched: int
+    affected: int
+
+
+class BulkUserResultModel(BaseModel):
+    action: str
+    matched: int
+    affected: int
+    chunks: list[BulkChunkModel]
+
+
 class UserUpdateModel(BaseModel):
     firstname: str | None = Field(None, examples=["John"])
     lastname: str | None = Field(None, examples=["Doe"])
     username: str | None = Field(None, examples=["johndoe123"])
     dob: date | None = Field(None, examples=["1991-10-11"])
     image_url: str | None = Field(None, examples=["https://profile.png"])
+
+    @field_validator("username")
+    @classmethod
+    def username_to_lowercase(cls, v: str | None):
+        return v.lower() if v else v
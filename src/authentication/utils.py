@@ -1,12 +1,39 @@
-from sqlalchemy.orm import Session
-from ..db.models import Users
+import csv
+import io
+import logging
+from typing import Iterator
+from sqlalchemy import delete, exists, func, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Query, Session, aliased, load_only
+from ..settings.config import config
+from ..db.database import sessionLocal
+from ..db.models import (
+    Comments,
+    Dislikes,
+    HashTags,
+    ImageMapper,
+    Likes,
+    MediaDeletion,
+    Posts,
+    RefreshToken,
+    Users,
+    post_hashtag,
+)
+from ..media.cache import media_cache
+from ..media.utils import proxied_urls
+from ..post.threads import in_subtree
 from . import schemas
 import random
 from .dependencies import HashVerifyPassword
+from . import revocation
+from .revocation import account_status
 from ..error import SQLAlchemyDataCreationError, UsernameExistException
 
 
 hasher = HashVerifyPassword()
+USERNAME_INSERT_ATTEMPTS = 3
+# Reply threads removed per DELETE when deleting users.
+THREAD_DELETE_CHUNK_SIZE = 500
 
 
 def get_user_by_id(user_id: int, session: Session) -> Users | None:
@@ -15,30 +42,332 @@ def get_user_by_id(user_id: int, session: Session) -> Users | None:
 
 
 def get_user_by_email(email: str, session: Session) -> Users | None:
-    user = session.query(Users).filter(Users.email == email).first()
+    # Emails are stored lowercased.
+    user = session.query(Users).filter(Users.email == email.lower()).first()
     return user
 
 
 def get_user_by_username(username: str, session: Session) -> Users | None:
-    user = session.query(Users).filter(Users.username == username).first()
+    user = (
+        session.query(Users)
+        .filter(func.lower(Users.username) == username.lower())
+        .first()
+    )
     return user
 
 
-def get_all_users(session: Session) -> list[Users]:
-    users = session.query(Users).all()
-    return users
+def prefix_pattern(prefix: str) -> str:
+    escaped = prefix.lower().replace("\\", "\\\\").replace("%", "\\%")
+    return escaped.replace("_", "\\_") + "%"
+
+
+def filter_users(query: Query, filters: schemas.UserFilterModel) -> Query:
+    for field in ("is_active", "acct_deactivated", "is_admin"):
+        value = getattr(filters, field)
+        if value is not None:
+            query = query.filter(getattr(Users, field) == value)
+    if filters.created_from:
+        query = query.filter(Users.created_at >= filters.created_from)
+    if filters.created_to:
+        query = query.filter(Users.created_at < filters.created_to)
+    if filters.username:
+        pattern = prefix_pattern(filters.username)
+        query = query.filter(func.lower(Users.username).like(pattern, escape="\\"))
+    if filters.email:
+        pattern = prefix_pattern(filters.email)
+        query = query.filter(func.lower(Users.email).like(pattern, escape="\\"))
+    return query
+
+
+def users_out(
+    session: Session, users: list[Users], model=schemas.UserOutModel
+) -> list[schemas.UserOutModel]:
+    """Serialize ``users`` with their profile images behind the media proxy
+    when it is enabled."""
+    image_urls = proxied_urls(session, [user.image_url for user in users])
+    return [
+        model.model_validate(user, from_attributes=True).model_copy(
+            update={"image_url": image_urls.get(user.image_url, user.image_url)}
+        )
+        for user in users
+    ]
+
+
+def get_users_page(
+    session: Session,
+    filters: schemas.UserFilterModel,
+    limit: int,
+    cursor: int | None = None,
+) -> tuple[list[Users], int | None]:
+    """Return up to ``limit`` users, newest first, and the next cursor.
+
+    Keyset pagination on ``user_id``: ``cursor`` is the last id of the
+    previous page, so each page costs the same however deep it is.
+    """
+    query = filter_users(session.query(Users), filters)
+    if cursor is not None:
+        query = query.filter(Users.user_id < cursor)
+    users = query.order_by(Users.user_id.desc()).limit(limit + 1).all()
+    next_cursor = users[limit - 1].user_id if len(users) > limit else None
+    return users[:limit], next_cursor
+
+
+EXPORT_COLUMNS = [
+    "user_id",
+    "username",
+    "email",
+    "firstname",
+    "lastname",
+    "dob",
+    "is_admin",
+    "is_active",
+    "acct_deactivated",
+    "created_at",
+]
+EXPORT_CHUNK_SIZE = 1000
+
+
+def iter_users_csv(filters: schemas.UserFilterModel) -> Iterator[str]:
+    """Yield the filtered users as CSV, one chunk of rows at a time.
+
+    Each chunk is read with its own short-lived session, so a slow download
+    neither holds a pooled connection nor keeps more than one chunk in memory.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    columns = [getattr(Users, column) for column in EXPORT_COLUMNS]
+    cursor = None
+    while True:
+        with sessionLocal() as session:
+            query = filter_users(session.query(*columns), filters)
+            if cursor is not None:
+                query = query.filter(Users.user_id < cursor)
+            rows = query.order_by(Users.user_id.desc()).limit(EXPORT_CHUNK_SIZE).all()
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        if len(rows) < EXPORT_CHUNK_SIZE:
+            return
+        cursor = rows[-1].user_id
+
+
+def iter_user_id_chunks(
+    session: Session, request: schemas.BulkUserActionModel, exclude: int
+) -> Iterator[list[int]]:
+    """Yield the targeted user ids in chunks of ``USER_BULK_CHUNK_SIZE``.
+
+    Filter matches are walked with keyset pagination on ``user_id``, so the
+    walk stays correct while earlier chunks are updated or deleted.
+    """
+    size = config.USER_BULK_CHUNK_SIZE
+    if request.user_ids is not None:
+        user_ids = sorted(set(request.user_ids) - {exclude}, reverse=True)
+        for start in range(0, len(user_ids), size):
+            yield user_ids[start : start + size]
+        return
+    cursor = None
+    while True:
+        query = filter_users(session.query(Users.user_id), request.filters).filter(
+            Users.user_id != exclude
+        )
+        if cursor is not None:
+            query = query.filter(Users.user_id < cursor)
+        user_ids = [
+            user_id for (user_id,) in query.order_by(Users.user_id.desc()).limit(size)
+        ]
+        if not user_ids:
+            return
+        yield user_ids
+        cursor = user_ids[-1]
+
+
+def set_accounts_deactivated(
+    session: Session, user_ids: list[int], deactivated: bool
+) -> int:
+    result = session.execute(
+        update(Users)
+        .where(Users.user_id.in_(user_ids), Users.acct_deactivated != deactivated)
+        .values(acct_deactivated=deactivated)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+def delete_users(session: Session, user_ids: list[int]) -> int:
+    """Delete users and everything that hangs off them with set-based statements.
+
+    Covers what the ORM cascade on ``Users`` does (posts and their comments,
+    likes, dislikes and hashtags) plus the users' own comments and reactions
+    on other posts and the replies under those comments, and queues their
+    images for deletion. Nothing is loaded into the session.
+    """
+    post_ids = select(Posts.post_id).where(Posts.user_id.in_(user_ids))
+    hashtag_ids = select(post_hashtag.c.hashtag_id).where(
+        post_hashtag.c.post_id.in_(post_ids)
+    )
+    images = session.execute(
+        select(ImageMapper.image_id, ImageMapper.image_url).where(
+            or_(
+                ImageMapper.image_url.in_(
+                    select(Users.image_url).where(Users.user_id.in_(user_ids))
+                ),
+                ImageMapper.image_url.in_(
+                    select(Posts.post_image).where(Posts.user_id.in_(user_ids))
+                ),
+            )
+        )
+    ).all()
+    if images:
+        session.execute(
+            insert(MediaDeletion),
+            [{"image_id": image_id, "image_url": url} for image_id, url in images],
+        )
+        session.execute(
+            delete(ImageMapper).where(
+                ImageMapper.image_id.in_([image_id for image_id, _ in images])
+            )
+        )
+
+    replies = aliased(Comments)
+    threads = session.execute(
+        select(Comments.post_id, Comments.path, Comments.comment_id).where(
+            Comments.user_id.in_(user_ids),
+            exists().where(replies.parent_id == Comments.comment_id),
+        )
+    ).all()
+    for start in range(0, len(threads), THREAD_DELETE_CHUNK_SIZE):
+        chunk = threads[start : start + THREAD_DELETE_CHUNK_SIZE]
+        session.execute(
+            delete(Comments)
+            .where(or_(*[in_subtree(thread) for thread in chunk]))
+            .execution_options(synchronize_session=False)
+        )
+
+    statements = [
+        delete(Likes).where(
+            or_(Likes.user_id.in_(user_ids), Likes.post_id.in_(post_ids))
+        ),
+        delete(Dislikes).where(
+            or_(Dislikes.user_id.in_(user_ids), Dislikes.post_id.in_(post_ids))
+        ),
+        delete(Comments).where(
+            or_(Comments.user_id.in_(user_ids), Comments.post_id.in_(post_ids))
+        ),
+        delete(RefreshToken).where(RefreshToken.user_id.in_(user_ids)),
+    ]
+    for statement in statements:
+        session.execute(statement.execution_options(synchronize_session=False))
+    hashtags = [hashtag_id for (hashtag_id,) in session.execute(hashtag_ids)]
+    session.execute(delete(post_hashtag).where(post_hashtag.c.post_id.in_(post_ids)))
+    if hashtags:
+        session.execute(
+            delete(HashTags)
+            .where(HashTags.hashtag_id.in_(hashtags))
+            .execution_options(synchronize_session=False)
+        )
+    session.execute(
+        delete(Posts)
+        .where(Posts.user_id.in_(user_ids))
+        .execution_options(synchronize_session=False)
+    )
+    result = session.execute(
+        delete(Users)
+        .where(Users.user_id.in_(user_ids))
+        .execution_options(synchronize_session=False)
+    )
+    for image_id, _ in images:
+        media_cache.discard(image_id)
+    return result.rowcount
+
+
+def bulk_user_action(
+    session: Session,
+    action: str,
+    request: schemas.BulkUserActionModel,
+    current_user_id: int,
+) -> dict:
+    """Apply ``action`` chunk by chunk, committing after each chunk.
+
+    The acting admin is never included. If a chunk fails, the chunks before
+    it stay applied and the error is raised.
+    """
+    matched, affected, chunks = 0, 0, []
+    for number, user_ids in enumerate(
+        iter_user_id_chunks(session, request, current_user_id), start=1
+    ):
+        if action == "delete":
+            count = delete_users(session, user_ids)
+            reason = revocation.DELETED
+        elif action == "deactivate":
+            count = set_accounts_deactivated(session, user_ids, True)
+            reason = revocation.DEACTIVATED
+        else:
+            count = set_accounts_deactivated(session, user_ids, False)
+            reason = None
+        revocation.record_status_change(session, user_ids, reason)
+        session.commit()
+        account_status.refresh(session)
+        matched += len(user_ids)
+        affected += count
+        chunks.append({"chunk": number, "matched": len(user_ids), "affected": count})
+        logging.info(
+            f"Bulk {action}: chunk {number} done, {affected} users affected so far"
+        )
+    return {
+        "action": action,
+        "matched": matched,
+        "affected": affected,
+        "chunks": chunks,
+    }
 
 
 def verify_user_email_or_username(
     email_or_username: str, session: Session
 ) -> Users | None:
-    user = get_user_by_email(email=email_or_username, session=session)
-    if not user:
-        user = get_user_by_username(username=email_or_username, session=session)
+    """Find a user by email or username, case-insensitively, in one query.
+
+    Only the columns login needs are loaded. An email match wins over a
+    username match.
+    """
+    identifier = email_or_username.strip().lower()
+    email_match = func.lower(Users.email) == identifier
+    user = (
+        session.query(Users)
+        .options(
+            load_only(
+                Users.user_id,
+                Users.password_hash,
+                Users.is_active,
+                Users.acct_deactivated,
+                Users.is_admin,
+            )
+        )
+        .filter(or_(email_match, func.lower(Users.username) == identifier))
+        .order_by(email_match.desc())
+        .first()
+    )
     return user
 
 
+def update_password_hash(user_id: int, password_hash: str, session: Session) -> None:
+    session.query(Users).filter(Users.user_id == user_id).update(
+        {"password_hash": password_hash}
+    )
+    session.commit()
+
+
 class UsernameGen:
+    """Generates ``firstname<symbol>lastname<5 digits>`` usernames.
+
+    Candidates are checked a batch at a time with one ``IN`` query, and the
+    number of batches is capped so a saturated name cannot loop forever.
+    """
+
+    BATCH_SIZE = 20
+    MAX_BATCHES = 5
+
     def __init__(self, session: Session) -> None:
         self.session = session
 
@@ -49,36 +378,62 @@ class UsernameGen:
         else:
             return False
 
-    def auto_username(self, firstname: str, lastname: str) -> str:
-        while True:
+    @staticmethod
+    def candidates(firstname: str, lastname: str, n: int) -> list[str]:
+        usernames = set()
+        while len(usernames) < n:
             num = "".join([str(random.randint(0, 9)) for _ in range(5)])
             symbol = random.choice(["", "-", "_", "."])
-            username = firstname.lower() + symbol + lastname.lower() + num
-            if not self.username_exists(username=username):
-                break
-        return username
+            usernames.add(firstname.lower() + symbol + lastname.lower() + num)
+        return list(usernames)
+
+    def taken_usernames(self, usernames: list[str]) -> set[str]:
+        taken = self.session.query(Users.username).filter(Users.username.in_(usernames))
+        return {username for (username,) in taken}
+
+    def auto_username(self, firstname: str, lastname: str) -> str:
+        for _ in range(self.MAX_BATCHES):
+            batch = self.candidates(firstname, lastname, self.BATCH_SIZE)
+            taken = self.taken_usernames(batch)
+            for username in batch:
+                if username not in taken:
+                    return username
+        raise UsernameExistException(
+            "Could not generate a unique username. Please try again."
+        )
 
 
 def create_new_user(user: schemas.UserSignUpModel, session: Session) -> Users:
+    password_hash = hasher.hash_password(user.password)
     user_gen = UsernameGen(session=session)
-    username = user_gen.auto_username(user.firstname, user.lastname)
-    user = schemas.UserInModel(
-        email=user.email,
-        firstname=user.firstname,
-        lastname=user.lastname,
-        is_admin=user.is_admin,
-        password_hash=hasher.hash_password(user.password),
-        username=username,
+    for _ in range(USERNAME_INSERT_ATTEMPTS):
+        username = user_gen.auto_username(user.firstname, user.lastname)
+        user_in = schemas.UserInModel(
+            email=user.email,
+            firstname=user.firstname,
+            lastname=user.lastname,
+            is_admin=user.is_admin,
+            password_hash=password_hash,
+            username=username,
+        )
+        try:
+            add_user = Users(**user_in.model_dump())
+            session.add(add_user)
+            session.commit()
+            session.refresh(add_user)
+        except IntegrityError as e:
+            session.rollback()
+            # Another signup took the same username between the check and the
+            # insert; anything else (e.g. the email) is a real error.
+            if not user_gen.username_exists(username):
+                raise SQLAlchemyDataCreationError(str(e))
+        except Exception as e:
+            raise SQLAlchemyDataCreationError(str(e))
+        else:
+            return add_user
+    raise UsernameExistException(
+        "Could not generate a unique username. Please try again."
     )
-    try:
-        add_user = Users(**user.model_dump())
-        session.add(add_user)
-        session.commit()
-        session.refresh(add_user)
-    except Exception as e:
-        raise SQLAlchemyDataCreationError(str(e))
-    else:
-        return add_user
 
 
 def update_user_profile(
@@ -94,12 +449,16 @@ def update_user_profile(
         username_gen = UsernameGen(session=session)
         username_exist = username_gen.username_exists(user_in.username)
         if username_exist:
-            raise UsernameExistException("Username does not exist.")
+            raise UsernameExistException("Username already exists.")
     else:
         user_in.username = user.username
     try:
         user_query.update(user_in.model_dump())
         session.commit()
+    except IntegrityError:
+        session.rollback()
+        # Taken by another update between the check and the write.
+        raise UsernameExistException("Username already exists.")
     except Exception as e:
         raise SQLAlchemyDataCreationError(str(e))
     else:
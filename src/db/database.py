@@ -1,12 +1,31 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, make_url
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 from ..settings.config import config
 
 
-engine = create_engine(url=config.DB_URL)
+url = make_url(config.DB_URL)
+# In-memory SQLite gets a single-connection pool, which takes no sizes.
+if issubclass(url.get_dialect().get_pool_class(url), QueuePool):
+    pool_sizes = {
+        "pool_size": config.DB_POOL_SIZE,
+        "max_overflow": config.DB_MAX_OVERFLOW,
+    }
+else:
+    pool_sizes = {}
+engine = create_engine(url=url, **pool_sizes)
 sessionLocal = sessionmaker(autoflush=False, autocommit=False, bind=engine)
 
 
+def pool_saturated() -> bool:
+    """True when every pooled connection is checked out, so the next
+    ``sessionLocal()`` query would have to wait for one."""
+    pool = engine.pool
+    if not isinstance(pool, QueuePool) or config.DB_MAX_OVERFLOW < 0:
+        return False
+    return pool.checkedin() == 0 and pool.overflow() >= config.DB_MAX_OVERFLOW
+
+
 class Base(DeclarativeBase):
     pass
 
@@ -0,0 +1,363 @@
+"""Explicit schema migration step.
+
+Run it once per deploy, before the app starts serving::
+
+    python -m src.db.migrate
+
+``create_all`` only creates missing tables, so columns and indexes added to
+existing tables are brought in by ``add_missing_columns`` and
+``create_missing_indexes``, which runs outside the migration's transaction
+so PostgreSQL can build indexes without blocking writes. New columns on
+existing tables must therefore be nullable or carry a ``server_default``.
+One-off data fixes that have to run after a schema change live here too.
+Those listed in ``DATA_MIGRATIONS`` run once per database, recorded in the
+``data_migration`` table; the others must be safe to run again.
+"""
+
+import hashlib
+import itertools
+import logging
+import re
+from datetime import timedelta
+from sqlalchemy import (
+    Connection,
+    DateTime,
+    Engine,
+    bindparam,
+    delete,
+    func,
+    insert,
+    inspect,
+    literal,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.schema import CreateColumn, CreateIndex
+from ..settings.config import config
+from ..post.threads import comment_path
+from .database import Base, engine
+from . import models  # noqa: F401  (registers the tables on Base.metadata)
+from .models import (
+    AccountRevocation,
+    AccountStatusVersion,
+    Comments,
+    DataMigration,
+    DIALECT_INDEXES,
+    EmailToken,
+    MediaDeletion,
+    Posts,
+    Users,
+    utc_now,
+)
+
+# Columns that used to be stamped with the worker's boot time.
+SERVER_TIMESTAMPS = (
+    (Users.user_id, Users.created_at),
+    (Posts.post_id, Posts.posted_at),
+    (Comments.comment_id, Comments.commented_at),
+)
+
+
+def add_missing_columns(conn: Connection) -> None:
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_ddl = CreateColumn(column).compile(dialect=conn.dialect)
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column_ddl}"))
+            logging.info(f"Added column {table.name}.{column.name}")
+
+
+def create_missing_indexes(conn: Connection) -> None:
+    """Create the indexes of ``Base.metadata`` that do not exist yet.
+
+    On PostgreSQL they are built ``CONCURRENTLY``, so adding one to a large
+    table does not block writes; ``conn`` must then be in autocommit mode.
+    A concurrent build that was interrupted leaves an invalid index behind,
+    which is dropped and built again. Indexes ``DIALECT_INDEXES`` lists for
+    another backend are skipped.
+    """
+    concurrently = conn.dialect.name == "postgresql"
+    if concurrently:
+        invalid = set(
+            conn.execute(
+                text(
+                    "SELECT c.relname FROM pg_index i "
+                    "JOIN pg_class c ON c.oid = i.indexrelid WHERE NOT i.indisvalid"
+                )
+            ).scalars()
+        )
+    other_dialects = {
+        index.name
+        for dialect, indexes in DIALECT_INDEXES.items()
+        if dialect != conn.dialect.name
+        for index in indexes
+    }
+    # IF NOT EXISTS rather than checkfirst: reflection does not report
+    # expression indexes such as lower(email) on every backend.
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name in other_dialects:
+                continue
+            ddl = str(
+                CreateIndex(index, if_not_exists=True).compile(dialect=conn.dialect)
+            )
+            if concurrently:
+                if index.name in invalid:
+                    conn.exec_driver_sql(f'DROP INDEX CONCURRENTLY "{index.name}"')
+                    logging.info(f"Dropped invalid index {index.name}")
+                ddl = re.sub(
+                    r"^CREATE (UNIQUE )?INDEX", r"CREATE \1INDEX CONCURRENTLY", ddl
+                )
+            conn.exec_driver_sql(ddl)
+
+
+def set_server_defaults(conn: Connection) -> None:
+    """Give existing timestamp columns their new ``server_default``.
+
+    PostgreSQL only: SQLite cannot change a column's default in place, and
+    the ORM renders the same expression into its INSERTs anyway.
+    """
+    if conn.dialect.name != "postgresql":
+        return
+    inspector = inspect(conn)
+    for _, column in SERVER_TIMESTAMPS:
+        table = column.table.name
+        reflected = {c["name"]: c for c in inspector.get_columns(table)}
+        if reflected[column.name]["default"] is None:
+            default = column.server_default.arg.compile(dialect=conn.dialect)
+            conn.execute(
+                text(
+                    f"ALTER TABLE {table} ALTER COLUMN {column.name} SET DEFAULT {default}"
+                )
+            )
+            logging.info(f"Set default of {table}.{column.name}")
+
+
+def backfill_timestamps(conn: Connection) -> None:
+    """Spread out rows that were stamped with their worker's boot time.
+
+    Each worker used to stamp every row it wrote with the time it started,
+    so rows share timestamps and their real times are lost. Ids still give
+    the order the rows were written in: the rows of each shared timestamp
+    are spaced evenly, in id order, between it and the next distinct
+    timestamp (or now), which keeps time ranges roughly right and time
+    order consistent with id order.
+
+    Rows the database stamped share a time for real when they land in the
+    same millisecond or transaction, so this runs once, from
+    ``DATA_MIGRATIONS``, over the rows written before that.
+    """
+    now = utc_now().replace(tzinfo=None)
+    for id_column, column in SERVER_TIMESTAMPS:
+        # Rows are picked by subquery: a stamp read back and bound again may
+        # not be stored the way the database wrote it.
+        shared = select(column).group_by(column).having(func.count() > 1)
+        rows = conn.execute(
+            select(column, id_column)
+            .where(column.in_(shared))
+            .order_by(column, id_column)
+        ).all()
+        for stamp, group in itertools.groupby(rows, key=lambda row: row[0]):
+            ids = [row_id for _, row_id in group]
+            following = conn.execute(
+                select(func.min(column)).where(column > stamp)
+            ).scalar()
+            step = (max(following or now, stamp) - stamp) / len(ids)
+            conn.execute(
+                update(column.table)
+                .where(id_column == bindparam("row_id"))
+                .values({column.name: bindparam("stamp")}),
+                [
+                    {"row_id": row_id, "stamp": stamp + step * index}
+                    for index, row_id in enumerate(ids)
+                ],
+            )
+            logging.info(f"Backfilled {len(ids)} {column.table.name}.{column.name}")
+
+
+def backfill_comment_paths(conn: Connection, batch_size: int = 5000) -> None:
+    """Give comments written before reply threads their path.
+
+    They are all top-level, so the path is just their own id. Runs once,
+    from ``DATA_MIGRATIONS``.
+    """
+    total = last_id = 0
+    while True:
+        ids = (
+            conn.execute(
+                select(Comments.comment_id)
+                .where(Comments.comment_id > last_id, Comments.path == "")
+                .order_by(Comments.comment_id)
+                .limit(batch_size)
+            )
+            .scalars()
+            .all()
+        )
+        if not ids:
+            break
+        conn.execute(
+            update(Comments)
+            .where(Comments.comment_id == bindparam("row_id"))
+            .values(path=bindparam("new_path")),
+            [
+                {"row_id": comment_id, "new_path": comment_path("", comment_id)}
+                for comment_id in ids
+            ],
+        )
+        total += len(ids)
+        last_id = ids[-1]
+    if total:
+        logging.info(f"Backfilled {total} comment paths")
+
+
+def backfill_email_tokens(conn: Connection) -> None:
+    """Hash and date email tokens issued before tokens were stored hashed.
+
+    Legacy rows are the ones without ``expires_at``. Their purpose is
+    inferred from the row and they get a fresh lifetime from now.
+    """
+    lifetimes = {
+        "activation": timedelta(hours=config.ACTIVATION_TOKEN_TTL_HOURS),
+        "password_reset": timedelta(minutes=config.PASSWORD_RESET_TOKEN_TTL_MINUTES),
+        "email_change": timedelta(hours=config.EMAIL_CHANGE_TOKEN_TTL_HOURS),
+    }
+    legacy = conn.execute(
+        select(EmailToken.id, EmailToken.token, EmailToken.old_email, Users.is_active)
+        .outerjoin(Users, Users.email == EmailToken.email)
+        .where(EmailToken.expires_at == None)
+    ).all()
+    now = utc_now()
+    for token_id, token, old_email, is_active in legacy:
+        if old_email:
+            purpose = "email_change"
+        elif not is_active:
+            purpose = "activation"
+        else:
+            purpose = "password_reset"
+        conn.execute(
+            update(EmailToken)
+            .where(EmailToken.id == token_id)
+            .values(
+                token=hashlib.sha256(token.encode()).hexdigest(),
+                purpose=purpose,
+                expires_at=now + lifetimes[purpose],
+            )
+        )
+    if legacy:
+        logging.info(f"Backfilled {len(legacy)} email tokens")
+
+
+def backfill_account_revocations(conn: Connection) -> None:
+    """Revoke live access tokens of accounts deactivated before revocations
+    were tracked. Runs once, while the version counter does not exist yet."""
+    if conn.execute(select(AccountStatusVersion.id)).first():
+        return
+    conn.execute(insert(AccountStatusVersion).values(id=1, version=1))
+    conn.execute(
+        insert(AccountRevocation).from_select(
+            ["user_id", "reason", "version", "updated_at"],
+            select(
+                Users.user_id,
+                literal("deactivated"),
+                literal(1),
+                literal(utc_now(), DateTime),
+            ).where(Users.acct_deactivated == True),
+        )
+    )
+
+
+def dedupe_media_deletions(conn: Connection) -> None:
+    """Keep the oldest queued deletion of each file, so the unique index on
+    ``media_deletion.image_id`` can be built."""
+    first = select(func.min(MediaDeletion.id)).group_by(MediaDeletion.image_id)
+    result = conn.execute(delete(MediaDeletion).where(MediaDeletion.id.not_in(first)))
+    if result.rowcount:
+        logging.info(f"Removed {result.rowcount} duplicate media deletions")
+
+
+def dedupe_user_identifiers(conn: Connection) -> None:
+    """Make emails and usernames unique regardless of case.
+
+    Emails are stored lowercased. Where two accounts differ only in case,
+    the oldest keeps the name and the others get their user id appended
+    (``bob+duplicate-7@x.com``, ``bob-7``), so the unique ``lower()``
+    indexes can be built; the non-unique ones they replace are dropped.
+    """
+    for column, rename in (
+        (
+            Users.email,
+            lambda name, user_id: name.replace("@", f"+duplicate-{user_id}@", 1),
+        ),
+        (Users.username, lambda name, user_id: f"{name}-{user_id}"),
+    ):
+        key = func.lower(column)
+        shared = select(key).group_by(key).having(func.count() > 1)
+        rows = conn.execute(
+            select(key, Users.user_id)
+            .where(key.in_(shared))
+            .order_by(key, Users.user_id)
+        ).all()
+        renamed = [
+            {"row_id": user_id, "name": rename(name, user_id)}
+            for name, group in itertools.groupby(rows, key=lambda row: row[0])
+            for _, user_id in list(group)[1:]
+        ]
+        if renamed:
+            conn.execute(
+                update(Users)
+                .where(Users.user_id == bindparam("row_id"))
+                .values({column.name: bindparam("name")}),
+                renamed,
+            )
+            logging.warning(
+                f"Renamed users.{column.name} of users "
+                f"{[row['row_id'] for row in renamed]}, which clashed by case"
+            )
+        conn.exec_driver_sql(f"DROP INDEX IF EXISTS ix_users_{column.name}_lower")
+    conn.execute(
+        update(Users)
+        .where(Users.email != func.lower(Users.email))
+        .values(email=func.lower(Users.email))
+    )
+
+
+# One-off data fixes, by name, in the order they were added. Each runs in
+# the migration's transaction, together with the row that records it.
+DATA_MIGRATIONS = (
+    ("spread_boot_timestamps", backfill_timestamps),
+    ("dedupe_media_deletions", dedupe_media_deletions),
+    ("dedupe_user_identifiers", dedupe_user_identifiers),
+    ("backfill_comment_paths", backfill_comment_paths),
+)
+
+
+def run_data_migrations(conn: Connection) -> None:
+    applied = set(conn.execute(select(DataMigration.name)).scalars())
+    for name, fix in DATA_MIGRATIONS:
+        if name in applied:
+            continue
+        fix(conn)
+        conn.execute(insert(DataMigration).values(name=name, applied_at=utc_now()))
+        logging.info(f"Applied data migration {name}")
+
+
+def migrate(bind: Engine = engine) -> None:
+    Base.metadata.create_all(bind=bind)
+    with bind.begin() as conn:
+        add_missing_columns(conn)
+        set_server_defaults(conn)
+        run_data_migrations(conn)
+        backfill_email_tokens(conn)
+        backfill_account_revocations(conn)
+    with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        create_missing_indexes(conn)
+    logging.info("Database schema is up to date.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    migrate()
@@ -1,26 +1,141 @@
-from sqlalchemy import Column, Integer, Table, Text, ForeignKey
+from sqlalchemy import Column, DateTime, Integer, Index, Table, Text, ForeignKey, func
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import mapped_column, Mapped, Relationship
+from sqlalchemy.sql.expression import FunctionElement
 from datetime import datetime, timezone, date
 from .database import Base
 from ..settings.config import config
 
-date_now = datetime.now(timezone.utc)
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class utcnow(FunctionElement):
+    """The database's current time in UTC, stored without a zone like the
+    values ``utc_now`` writes.
+
+    Used both as ``default``, which the ORM renders into its INSERTs, and as
+    ``server_default`` for rows written outside the ORM, so rows are stamped
+    by the database when they are inserted rather than by the worker.
+    """
+
+    type = DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow, "postgresql")
+def _utcnow_postgresql(element, compiler, **kw):
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
+
+@compiles(utcnow, "sqlite")
+def _utcnow_sqlite(element, compiler, **kw):
+    # CURRENT_TIMESTAMP only has whole seconds on SQLite, and %f only
+    # milliseconds: pad to the microseconds SQLAlchemy writes, or values
+    # stamped here never compare equal to the same time bound from Python.
+    return "STRFTIME('%Y-%m-%d %H:%M:%f000', 'now')"
+
+
+@compiles(utcnow)
+def _utcnow_default(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
+
+class StorageFolder(Base):
+    __tablename__ = "storage_folder"
+    name: Mapped[str] = mapped_column(primary_key=True)
+    handle: Mapped[str] = mapped_column(nullable=False)
 
 
 class ImageMapper(Base):
     __tablename__ = "image_mapper"
     image_id: Mapped[str] = mapped_column(primary_key=True)
     image_name: Mapped[str] = mapped_column(nullable=False)
-    image_url: Mapped[str] = mapped_column(nullable=False)
+    image_url: Mapped[str] = mapped_column(nullable=False, unique=True, index=True)
+    folder_handle: Mapped[str] = mapped_column(nullable=True)
+    created_at: Mapped[datetime] = mapped_column(default=utc_now, nullable=True)
+
+
+class MediaDeletion(Base):
+    __tablename__ = "media_deletion"
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    # One deletion per file, whoever queues it.
+    image_id: Mapped[str] = mapped_column(nullable=False, unique=True, index=True)
+    image_url: Mapped[str] = mapped_column(nullable=True)
+    status: Mapped[str] = mapped_column(default="pending", index=True)
+    attempts: Mapped[int] = mapped_column(default=0)
+    last_error: Mapped[str] = mapped_column(Text, nullable=True)
+    next_attempt_at: Mapped[datetime] = mapped_column(default=utc_now, index=True)
+    created_at: Mapped[datetime] = mapped_column(default=utc_now)
+
+
+class OutboxEmail(Base):
+    __tablename__ = "outbox_email"
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    recipients: Mapped[str] = mapped_column(Text, nullable=False)
+    subject: Mapped[str] = mapped_column(nullable=False)
+    html: Mapped[str] = mapped_column(Text, nullable=False)
+    status: Mapped[str] = mapped_column(default="pending", index=True)
+    attempts: Mapped[int] = mapped_column(default=0)
+    last_error: Mapped[str] = mapped_column(Text, nullable=True)
+    next_attempt_at: Mapped[datetime] = mapped_column(default=utc_now, index=True)
+    created_at: Mapped[datetime] = mapped_column(default=utc_now)
 
 
 class EmailToken(Base):
     __tablename__ = "email_token"
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
-    token: Mapped[str] = mapped_column(nullable=False)
+    # SHA-256 digest of the token sent by email, never the token itself.
+    token: Mapped[str] = mapped_column(nullable=False, unique=True, index=True)
+    purpose: Mapped[str] = mapped_column(nullable=True)
     email: Mapped[str] = mapped_column(nullable=False)
     old_email: Mapped[str] = mapped_column(nullable=True)
     is_verified: Mapped[bool] = mapped_column(default=False)
+    expires_at: Mapped[datetime] = mapped_column(nullable=True, index=True)
+
+
+class AccountRevocation(Base):
+    __tablename__ = "account_revocation"
+    # No foreign key: rows must outlive deleted users.
+    user_id: Mapped[int] = mapped_column(primary_key=True)
+    # "deactivated" or "deleted", None once the account is reactivated.
+    reason: Mapped[str] = mapped_column(nullable=True)
+    version: Mapped[int] = mapped_column(nullable=False, index=True)
+    updated_at: Mapped[datetime] = mapped_column(default=utc_now, index=True)
+
+
+class RefreshToken(Base):
+    __tablename__ = "refresh_token"
+    # The token's jti claim. Tokens of one login share a family.
+    jti: Mapped[str] = mapped_column(primary_key=True)
+    family: Mapped[str] = mapped_column(nullable=False, index=True)
+    # No foreign key, like account_revocation: delete_users removes the rows.
+    user_id: Mapped[int] = mapped_column(nullable=False, index=True)
+    expires_at: Mapped[datetime] = mapped_column(nullable=False, index=True)
+    used_at: Mapped[datetime] = mapped_column(nullable=True)
+
+
+class DataMigration(Base):
+    """One-off data fixes of ``db.migrate`` that have already run."""
+
+    __tablename__ = "data_migration"
+    name: Mapped[str] = mapped_column(primary_key=True)
+    applied_at: Mapped[datetime] = mapped_column(default=utc_now)
+
+
+class AccountStatusVersion(Base):
+    __tablename__ = "account_status_version"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    version: Mapped[int] = mapped_column(default=0)
+
+
+class CacheInvalidation(Base):
+    __tablename__ = "cache_invalidation"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    # JSON message published by invalidation.InvalidationBus.
+    message: Mapped[str] = mapped_column(Text, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(default=utc_now, index=True)
 
 
 class Users(Base):
@@ -35,18 +150,60 @@ class Users(Base):
     is_admin: Mapped[bool] = mapped_column(default=False)
     is_active: Mapped[bool] = mapped_column(default=False)
     acct_deactivated: Mapped[bool] = mapped_column(default=False)
-    created_at: Mapped[datetime] = mapped_column(default=lambda: date_now)
+    created_at: Mapped[datetime] = mapped_column(
+        default=utcnow(), server_default=utcnow(), index=True
+    )
     image_url: Mapped[str] = mapped_column(default=config.DEFAULT_PROFILE_IMAGE)
     posts = Relationship(
         "Posts", back_populates="user", uselist=True, cascade="all, delete"
     )
 
 
+# Case-insensitive login lookups (see authentication.utils). Unique, so an
+# identifier matches one account however it is cased.
+Index("ix_users_email_lower", func.lower(Users.email), unique=True)
+Index("ix_users_username_lower", func.lower(Users.username), unique=True)
+# Status filters of the admin user listing, which pages newest first by
+# user_id.
+Index("ix_users_is_active_user_id", Users.is_active, Users.user_id)
+Index("ix_users_acct_deactivated_user_id", Users.acct_deactivated, Users.user_id)
+Index("ix_users_is_admin_user_id", Users.is_admin, Users.user_id)
+
+# Indexes only some backends can use, by dialect. Neither create_all nor
+# migrate.create_missing_indexes builds them elsewhere.
+DIALECT_INDEXES = {
+    # Prefix search in the admin user listing. PostgreSQL only uses a btree
+    # for LIKE 'abc%' with the pattern operator class; other backends use
+    # the lower() indexes above.
+    "postgresql": (
+        Index(
+            "ix_users_email_lower_pattern",
+            func.lower(Users.email).label("email_lower"),
+            postgresql_ops={"email_lower": "text_pattern_ops"},
+        ),
+        Index(
+            "ix_users_username_lower_pattern",
+            func.lower(Users.username).label("username_lower"),
+            postgresql_ops={"username_lower": "text_pattern_ops"},
+        ),
+    ),
+}
+for dialect, indexes in DIALECT_INDEXES.items():
+    for index in indexes:
+        index.ddl_if(dialect=dialect)
+
+
 post_hashtag = Table(
     "post_hashtag",
     Base.metadata,
     Column("post_id", Integer, ForeignKey("posts.post_id"), primary_key=True),
-    Column("hashtag_id", Integer, ForeignKey("hashtags.hashtag_id"), primary_key=True),
+    Column(
+        "hashtag_id",
+        Integer,
+        ForeignKey("hashtags.hashtag_id"),
+        primary_key=True,
+        index=True,
+    ),
 )
 
 
@@ -57,7 +214,11 @@ class Posts(Base):
     post_title: Mapped[str] = mapped_column(nullable=False)
     post_content: Mapped[str] = mapped_column(Text, nullable=False)
     post_image: Mapped[str] = mapped_column(nullable=True)
-    posted_at: Mapped[datetime] = mapped_column(default=lambda: date_now)
+    # Written behind by post.views, so it trails reads by up to a flush.
+    views: Mapped[int] = mapped_column(default=0, server_default="0", index=True)
+    posted_at: Mapped[datetime] = mapped_column(
+        default=utcnow(), server_default=utcnow(), index=True
+    )
     user = Relationship("Users", back_populates="posts", uselist=False)
     comments = Relationship(
         "Comments", back_populates="post", uselist=True, cascade="all, delete"
@@ -79,31 +240,59 @@ class Posts(Base):
 class Comments(Base):
     __tablename__ = "comments"
     comment_id: Mapped[int] = mapped_column(primary_key=True, index=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.user_id"))
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.user_id"), index=True)
     post_id: Mapped[int] = mapped_column(ForeignKey("posts.post_id"))
     comment_content: Mapped[str] = mapped_column(Text, nullable=False)
-    commented_at: Mapped[datetime] = mapped_column(default=lambda: date_now)
+    commented_at: Mapped[datetime] = mapped_column(
+        default=utcnow(), server_default=utcnow()
+    )
+    # Reply threads: the comment replied to, the nesting depth (0 for a
+    # top-level comment) and the materialized path, see post.threads.
+    parent_id: Mapped[int] = mapped_column(
+        ForeignKey("comments.comment_id"), nullable=True, index=True
+    )
+    depth: Mapped[int] = mapped_column(default=0, server_default="0")
+    path: Mapped[str] = mapped_column(default="", server_default="")
     post = Relationship("Posts", back_populates="comments", uselist=False)
 
 
+# Time-ordered listings: a user's posts, and the comments on a post. They
+# also serve plain lookups by posts.user_id and comments.post_id.
+Index("ix_posts_user_id_posted_at", Posts.user_id, Posts.posted_at)
+Index("ix_comments_post_id_commented_at", Comments.post_id, Comments.commented_at)
+# Top-level comments and direct replies of a post, and subtrees by path.
+Index(
+    "ix_comments_post_id_parent_id",
+    Comments.post_id,
+    Comments.parent_id,
+    Comments.comment_id,
+)
+Index("ix_comments_post_id_path", Comments.post_id, Comments.path)
+
+
 class Likes(Base):
     __tablename__ = "likes"
     user_id: Mapped[int] = mapped_column(ForeignKey("users.user_id"), primary_key=True)
-    post_id: Mapped[int] = mapped_column(ForeignKey("posts.post_id"), primary_key=True)
+    # The primary key covers lookups by user; this one serves a post's likes.
+    post_id: Mapped[int] = mapped_column(
+        ForeignKey("posts.post_id"), primary_key=True, index=True
+    )
     post = Relationship("Posts", back_populates="likes", uselist=False)
 
 
 class Dislikes(Base):
     __tablename__ = "dislikes"
     user_id: Mapped[int] = mapped_column(ForeignKey("users.user_id"), primary_key=True)
-    post_id: Mapped[int] = mapped_column(ForeignKey("posts.post_id"), primary_key=True)
+    post_id: Mapped[int] = mapped_column(
+        ForeignKey("posts.post_id"), primary_key=True, index=True
+    )
     post = Relationship("Posts", back_populates="dislikes", uselist=False)
 
 
 class HashTags(Base):
     __tablename__ = "hashtags"
     hashtag_id: Mapped[int] = mapped_column(primary_key=True, index=True)
-    hashtag: Mapped[str] = mapped_column(nullable=False)
+    hashtag: Mapped[str] = mapped_column(nullable=False, index=True)
     post = Relationship(
         "Posts", secondary=post_hashtag, uselist=False, back_populates="hashtags"
     )
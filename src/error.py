@@ -1,13 +1,14 @@
 from typing import Callable, Any
 from fastapi import FastAPI, Request, status
 from fastapi.responses import JSONResponse
+from .settings.config import config
 
 
 class BaseException(Exception):
     pass
 
 
-class JWTDecodeError(BaseException):
+class TokenExpiredError(BaseException):
     pass
 
 
@@ -59,14 +60,25 @@ class ImageFormatNotSupportedException(BaseException):
     pass
 
 
+class ServiceOverloadedException(BaseException):
+    pass
+
+
+class RateLimitExceededException(BaseException):
+    def __init__(self, message: str, retry_after: int) -> None:
+        super().__init__(message)
+        self.headers = {"Retry-After": str(retry_after)}
+
+
 def create_error_handler(
-    status_code: int, error_code: str
+    status_code: int, error_code: str, headers: dict | None = None
 ) -> Callable[[Request, Exception], JSONResponse]:
 
     def error_handler(request: Request, exc: BaseException):
         return JSONResponse(
             status_code=status_code,
             content={"message": str(exc), "error_code": error_code},
+            headers={**(headers or {}), **getattr(exc, "headers", {})},
         )
 
     return error_handler
@@ -74,10 +86,10 @@ def create_error_handler(
 
 def add_error_handlers(app: FastAPI):
     app.add_exception_handler(
-        JWTDecodeError,
+        TokenExpiredError,
         handler=create_error_handler(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            error_code="jwt_decode_error",
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            error_code="token_expired_error",
         ),
     )
     app.add_exception_handler(
@@ -159,3 +171,18 @@ def add_error_handlers(app: FastAPI):
             error_code="enpoint_forbidden_error",
         ),
     )
+    app.add_exception_handler(
+        ServiceOverloadedException,
+        handler=create_error_handler(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            error_code="service_overloaded_error",
+            headers={"Retry-After": str(config.RETRY_AFTER_SECONDS)},
+        ),
+    )
+    app.add_exception_handler(
+        RateLimitExceededException,
+        handler=create_error_handler(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            error_code="rate_limit_error",
+        ),
+    )
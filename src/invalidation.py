@@ -0,0 +1,247 @@
+import json
+import logging
+import secrets
+import select
+import time
+from datetime import timedelta
+from typing import Callable
+from sqlalchemy import delete, event, func, insert
+from sqlalchemy import select as sql_select
+from sqlalchemy.orm import Session
+from .settings.config import config
+from .db.database import engine
+from .db.models import CacheInvalidation, utc_now
+from .workers import register_worker
+
+# Topics. Keys are user ids for ACCOUNT (status changes). Add a topic with
+# the cache that subscribes to it.
+ACCOUNT = "account"
+
+# Keeps a NOTIFY payload well under PostgreSQL's 8000 byte limit.
+MAX_KEYS_PER_MESSAGE = 500
+
+PENDING = "pending_invalidations"
+
+
+class LocalBackend:
+    """Single-process deployments: there is no other worker to tell."""
+
+    interval = None
+
+    def publish(self, session: Session, message: str) -> None:
+        pass
+
+    def poll(self, session: Session) -> list[str] | None:
+        return []
+
+    def close(self) -> None:
+        pass
+
+
+class NotifyBackend:
+    """PostgreSQL ``LISTEN``/``NOTIFY``.
+
+    ``pg_notify`` runs in the writer's transaction, so PostgreSQL delivers
+    the message when the write commits and drops it on rollback. Each
+    process keeps one connection outside the pool that listens on
+    ``channel``; ``poll`` waits on its socket for up to ``timeout`` seconds.
+    """
+
+    interval = 0
+    RECONNECT_DELAY = 1.0
+
+    def __init__(self, channel: str, timeout: float = 1.0) -> None:
+        self.channel = channel
+        self.timeout = timeout
+        self._conn = None
+
+    def publish(self, session: Session, message: str) -> None:
+        session.execute(sql_select(func.pg_notify(self.channel, message)))
+
+    def connect(self) -> None:
+        conn = engine.raw_connection()
+        # A listening connection must never be handed to a request.
+        conn.detach()
+        conn.dbapi_connection.autocommit = True
+        with conn.dbapi_connection.cursor() as cursor:
+            cursor.execute(f'LISTEN "{self.channel}"')
+        self._conn = conn
+
+    def poll(self, session: Session) -> list[str] | None:
+        try:
+            if self._conn is None:
+                self.connect()
+                # Anything published while we were not listening is lost.
+                return None
+            dbapi = self._conn.dbapi_connection
+            if select.select([dbapi], [], [], self.timeout) == ([], [], []):
+                return []
+            dbapi.poll()
+        except Exception:
+            self.close()
+            time.sleep(self.RECONNECT_DELAY)
+            raise
+        messages = [notify.payload for notify in dbapi.notifies]
+        dbapi.notifies.clear()
+        return messages
+
+    def close(self) -> None:
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+
+class PollingBackend:
+    """Messages go to the ``cache_invalidation`` table in the writer's
+    transaction and every process polls for rows it has not seen.
+
+    Works on any database, e.g. SQLite for tests and single-host
+    deployments. It relies on rows becoming visible in id order, which holds
+    when writers are serialized as on SQLite; use ``NotifyBackend`` on
+    PostgreSQL.
+    """
+
+    def __init__(self, interval: float) -> None:
+        self.interval = float(interval)
+        self.last_id: int | None = None
+
+    def publish(self, session: Session, message: str) -> None:
+        session.execute(insert(CacheInvalidation).values(message=message))
+
+    def poll(self, session: Session) -> list[str] | None:
+        if self.last_id is None:
+            self.last_id = (
+                session.execute(sql_select(func.max(CacheInvalidation.id))).scalar()
+                or 0
+            )
+            return None
+        rows = session.execute(
+            sql_select(CacheInvalidation.id, CacheInvalidation.message)
+            .where(CacheInvalidation.id > self.last_id)
+            .order_by(CacheInvalidation.id)
+        ).all()
+        if rows:
+            self.last_id = rows[-1][0]
+        return [message for _, message in rows]
+
+    def close(self) -> None:
+        pass
+
+
+class InvalidationBus:
+    """Tells every worker process which cached keys a write made stale.
+
+    Write paths call ``publish`` before they commit. The message goes out
+    with the commit and not at all on rollback. Topics nothing subscribes to
+    are not sent: every process subscribes the same callbacks at import, so
+    no other process is listening for them either. Subscribers in this process
+    run right after the commit, and those in other processes run as soon as
+    their listener picks the message up. A subscriber receives the list of
+    keys, or ``None`` when messages may have been missed and it should drop
+    everything it caches for the topic.
+    """
+
+    def __init__(self, backend) -> None:
+        self.backend = backend
+        self.origin = secrets.token_hex(8)
+        self.published = 0
+        self.received = 0
+        self.resyncs = 0
+        self._subscribers: dict[str, list[Callable]] = {}
+
+    def subscribe(self, topic: str, callback: Callable[[list | None], None]) -> None:
+        self._subscribers.setdefault(topic, []).append(callback)
+
+    def publish(self, session: Session, topic: str, keys) -> None:
+        keys = list(dict.fromkeys(keys))
+        if not keys or topic not in self._subscribers:
+            return
+        for start in range(0, len(keys), MAX_KEYS_PER_MESSAGE):
+            message = {
+                "origin": self.origin,
+                "topic": topic,
+                "keys": keys[start : start + MAX_KEYS_PER_MESSAGE],
+            }
+            self.backend.publish(session, json.dumps(message))
+            self.published += 1
+        session.info.setdefault(PENDING, []).append((topic, keys))
+
+    def dispatch(self, topic: str, keys: list | None) -> None:
+        for callback in self._subscribers.get(topic, []):
+            try:
+                callback(keys)
+            except Exception as e:
+                logging.error(f"Invalidation subscriber for {topic} failed: {str(e)}")
+
+    def poll(self, session: Session) -> None:
+        messages = self.backend.poll(session)
+        if messages is None:
+            self.resyncs += 1
+            for topic in list(self._subscribers):
+                self.dispatch(topic, None)
+            return
+        for payload in messages:
+            message = json.loads(payload)
+            if message["origin"] == self.origin:
+                continue
+            self.received += 1
+            self.dispatch(message["topic"], message["keys"])
+
+    def close(self) -> None:
+        self.backend.close()
+
+    def stats(self) -> dict:
+        return {
+            "published": self.published,
+            "received": self.received,
+            "resyncs": self.resyncs,
+        }
+
+
+@event.listens_for(Session, "after_commit")
+def _dispatch_after_commit(session: Session) -> None:
+    for topic, keys in session.info.pop(PENDING, []):
+        bus.dispatch(topic, keys)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session: Session) -> None:
+    session.info.pop(PENDING, None)
+
+
+def purge_invalidations(session: Session) -> int:
+    cutoff = utc_now() - timedelta(seconds=config.INVALIDATION_RETENTION_SECONDS)
+    result = session.execute(
+        delete(CacheInvalidation).where(CacheInvalidation.created_at < cutoff)
+    )
+    session.commit()
+    return result.rowcount
+
+
+backends: dict[str, Callable[[], object]] = {
+    "notify": lambda: NotifyBackend(config.INVALIDATION_CHANNEL),
+    "polling": lambda: PollingBackend(config.INVALIDATION_POLL_SECONDS),
+    "local": LocalBackend,
+}
+
+
+def backend_name() -> str:
+    if config.INVALIDATION_BACKEND != "auto":
+        return config.INVALIDATION_BACKEND
+    if engine.dialect.name == "postgresql":
+        return "notify"
+    return "polling" if config.WEB_CONCURRENCY > 1 else "local"
+
+
+bus = InvalidationBus(backends[backend_name()]())
+if bus.backend.interval is not None:
+    register_worker("cache-invalidation", bus.backend.interval, bus.poll)
+if isinstance(bus.backend, PollingBackend):
+    register_worker(
+        "cache-invalidation-purge",
+        config.INVALIDATION_RETENTION_SECONDS / 5,
+        purge_invalidations,
+    )
@@ -1,9 +1,22 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, status
 from fastapi.responses import JSONResponse
-from .db.database import Base, engine
 from .authentication.auth import auth_router
 from .post.posts import post_router
+from .media.media import media_router, media_proxy_router
+from .settings.config import config
 from .error import add_error_handlers
+from .workers import start_workers, stop_workers
+from .authentication.hashing import hash_pool
+from .outbox import sender
+from .middleware import LoadSheddingMiddleware, MetricsMiddleware, ProfilingMiddleware
+from .profiling import profile_store, profiling_router
+from .metrics import metrics_router, register_stats
+from .authentication.dependencies import token_cache
+from .authentication.revocation import account_status
+from .invalidation import bus
+from .media.cache import media_cache
+from .post.views import view_counter, view_flush_worker
 
 description = """
 **MyBlog** is a role-based blogging platform with user and admin roles. It allows users to create, manage, and interact with blog posts while providing administrators the ability to manage users and content. The project uses **PostgreSQL** as the database (via **neon.tech**), **Mega.nz** for cloud storage, and is deployed on **Render**.
@@ -20,14 +33,57 @@ description = """
 """
 
 version = "v1"
-app = FastAPI(title="MyBlog", description=description, version=version)
-# Base.metadata.drop_all(bind=engine)
-Base.metadata.create_all(bind=engine)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_workers()
+    yield
+    stop_workers()
+    # Write out the views counted since the last flush.
+    view_flush_worker.run_once()
+    bus.close()
+    hash_pool.shutdown()
+    sender.close()
+
+
+app = FastAPI(
+    title="MyBlog", description=description, version=version, lifespan=lifespan
+)
 app.include_router(auth_router)
 app.include_router(post_router)
+app.include_router(media_router)
+if config.MEDIA_PROXY_ENABLED:
+    app.include_router(media_proxy_router)
 
 add_error_handlers(app)
+if config.PROFILING_ENABLED:
+    # Innermost, so shed requests are never profiled.
+    app.add_middleware(
+        ProfilingMiddleware,
+        store=profile_store,
+        sample_rate=config.PROFILE_SAMPLE_RATE,
+        interval=config.PROFILE_INTERVAL_MS / 1000,
+    )
+    app.include_router(profiling_router)
+app.add_middleware(
+    LoadSheddingMiddleware,
+    max_concurrent=config.MAX_CONCURRENT_REQUESTS,
+    shed_on_db_pool=config.SHED_ON_DB_POOL_SATURATION,
+    retry_after=config.RETRY_AFTER_SECONDS,
+)
+if config.METRICS_ENABLED or config.DEBUG:
+    # Added last so it is outermost and also sees shed requests.
+    app.add_middleware(MetricsMiddleware, debug_headers=config.DEBUG)
+if config.METRICS_ENABLED:
+    app.include_router(metrics_router)
+    register_stats("token_cache", token_cache.stats)
+    register_stats("account_status", account_status.stats)
+    register_stats("hash_pool", hash_pool.stats)
+    register_stats("media_cache", media_cache.stats)
+    register_stats("smtp", sender.stats)
+    register_stats("invalidation", bus.stats)
+    register_stats("post_views", view_counter.stats)
 
 
 @app.exception_handler(status.HTTP_401_UNAUTHORIZED)
@@ -0,0 +1,132 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable
+from ..settings.config import config
+
+
+class DiskLRUCache:
+    """Size-bounded least-recently-used file cache in a single directory.
+
+    ``get_or_fill`` collapses concurrent misses for the same key: the first
+    caller runs ``fetch(tmp_path)`` and every other caller waits for it, for
+    up to ``timeout`` seconds before raising ``TimeoutError``.
+    Files are written to a temporary name and renamed into place, so a
+    partially downloaded file is never served. Workers on the same host may
+    share the directory; a file evicted by another worker is treated as a miss.
+    """
+
+    KEY_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = int(max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._size = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._inflight: dict[str, threading.Event] = {}
+
+    def _path(self, key: str) -> str:
+        if not self.KEY_PATTERN.match(key):
+            raise ValueError(f"Invalid cache key {key!r}")
+        return os.path.join(self.directory, key)
+
+    def _load(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and self.KEY_PATTERN.match(entry.name):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._size += size
+        self._loaded = True
+
+    def _lookup(self, key: str) -> str | None:
+        path = self._path(key)
+        if key in self._entries:
+            if os.path.exists(path):
+                self._entries.move_to_end(key)
+                return path
+            self._size -= self._entries.pop(key)
+        elif os.path.exists(path):
+            # Filled by another worker sharing the directory.
+            self._add(key, os.path.getsize(path))
+            return path
+        return None
+
+    def _add(self, key: str, size: int) -> None:
+        if key in self._entries:
+            self._size -= self._entries.pop(key)
+        self._entries[key] = size
+        self._size += size
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            old_key, old_size = self._entries.popitem(last=False)
+            self._size -= old_size
+            try:
+                os.remove(self._path(old_key))
+            except FileNotFoundError:
+                pass
+
+    def get_or_fill(
+        self, key: str, fetch: Callable[[str], None], timeout: float | None = None
+    ) -> str:
+        while True:
+            with self._lock:
+                if not self._loaded:
+                    self._load()
+                path = self._lookup(key)
+                if path:
+                    self.hits += 1
+                    os.utime(path)
+                    return path
+                event = self._inflight.get(key)
+                if event is None:
+                    event = self._inflight[key] = threading.Event()
+                    self.misses += 1
+                    break
+            if not event.wait(timeout):
+                raise TimeoutError(f"Timed out waiting for {key} to be fetched")
+            # The filling thread finished, loop to pick up its result (or to
+            # try ourselves if it failed).
+
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        try:
+            fetch(tmp_path)
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._add(key, os.path.getsize(path))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            with self._lock:
+                self._inflight.pop(key).set()
+        return path
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)
+            try:
+                os.remove(self._path(key))
+            except (FileNotFoundError, ValueError):
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+media_cache = DiskLRUCache(config.MEDIA_CACHE_DIR, config.MEDIA_CACHE_MAX_BYTES)
@@ -0,0 +1,61 @@
+from typing import Literal
+from fastapi import APIRouter, Depends, Query, Request, Response
+from sqlalchemy.orm import Session
+from ..authentication.dependencies import get_current_user, admin_role_checker
+from ..authentication.schemas import Payload
+from ..db.database import get_session
+from ..processor_image import media_deletion_worker
+from . import schemas, utils
+
+
+media_router = APIRouter(prefix="/api/media", tags=["media"])
+media_proxy_router = APIRouter(prefix="/media", tags=["media"])
+
+
+@media_router.get("/deletions/", response_model=list[schemas.MediaDeletionOutModel])
+def get_media_deletions(
+    status: Literal["pending", "dead"] = "pending",
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    current_user: Payload = Depends(get_current_user),
+    session: Session = Depends(get_session),
+):
+    admin_role_checker(current_user)
+    deletions = utils.get_media_deletions(session, status, limit, offset)
+    return deletions
+
+
+@media_router.get(
+    "/deletions/summary/", response_model=schemas.MediaDeletionSummaryModel
+)
+def get_media_deletion_summary(
+    current_user: Payload = Depends(get_current_user),
+    session: Session = Depends(get_session),
+):
+    admin_role_checker(current_user)
+    return utils.get_media_deletion_summary(session)
+
+
+@media_router.post(
+    "/deletions/{deletion_id}/retry/",
+    response_model=schemas.MediaDeletionOutModel,
+    status_code=201,
+)
+def retry_media_deletion(
+    deletion_id: int,
+    current_user: Payload = Depends(get_current_user),
+    session: Session = Depends(get_session),
+):
+    admin_role_checker(current_user)
+    deletion = utils.retry_media_deletion(deletion_id, session)
+    media_deletion_worker.wake()
+    return deletion
+
+
+@media_proxy_router.get("/{image_id}")
+def get_image(image_id: str, request: Request, session: Session = Depends(get_session)):
+    image = utils.get_image(image_id, session)
+    if utils.is_not_modified(image, request):
+        return Response(status_code=304, headers=utils.image_headers(image))
+    path = utils.get_cached_image_path(image)
+    return utils.image_file_response(path, image, request)
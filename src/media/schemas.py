@@ -0,0 +1,21 @@
+from datetime import datetime
+from pydantic import BaseModel
+
+
+class MediaDeletionOutModel(BaseModel):
+    id: int
+    image_id: str
+    image_url: str | None = None
+    status: str
+    attempts: int
+    last_error: str | None = None
+    next_attempt_at: datetime
+    created_at: datetime
+
+    class ConfigDict:
+        from_attributes = True
+
+
+class MediaDeletionSummaryModel(BaseModel):
+    pending: int
+    dead: int
@@ -0,0 +1,209 @@
+import mimetypes
+import os
+import anyio
+import threading
+from collections import OrderedDict
+from fastapi import Request, Response, status
+from fastapi.responses import FileResponse
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from ..settings.config import config
+from ..db.models import ImageMapper, MediaDeletion, utc_now
+from ..error import ItemNotFoundException, ServiceOverloadedException
+from ..processor_image import download_image
+from .cache import media_cache
+
+# Image URL -> image id, or None for URLs that are not ours (such as the
+# default profile image). An upload always gets a new URL, so entries never
+# go stale.
+IMAGE_ID_CACHE_SIZE = 10000
+_image_ids: OrderedDict[str, str | None] = OrderedDict()
+_image_ids_lock = threading.Lock()
+
+
+def get_media_deletions(
+    session: Session, status: str, limit: int, offset: int
+) -> list[MediaDeletion]:
+    deletions = (
+        session.query(MediaDeletion)
+        .filter(MediaDeletion.status == status)
+        .order_by(MediaDeletion.next_attempt_at)
+        .offset(offset)
+        .limit(limit)
+        .all()
+    )
+    return deletions
+
+
+def get_media_deletion_summary(session: Session) -> dict:
+    counts = dict(
+        session.query(MediaDeletion.status, func.count(MediaDeletion.id))
+        .group_by(MediaDeletion.status)
+        .all()
+    )
+    return {"pending": counts.get("pending", 0), "dead": counts.get("dead", 0)}
+
+
+def retry_media_deletion(deletion_id: int, session: Session) -> MediaDeletion:
+    deletion = (
+        session.query(MediaDeletion).filter(MediaDeletion.id == deletion_id).first()
+    )
+    if not deletion:
+        raise ItemNotFoundException(f"Media deletion with id {deletion_id} not found")
+    deletion.status = "pending"
+    deletion.attempts = 0
+    deletion.next_attempt_at = utc_now()
+    session.commit()
+    session.refresh(deletion)
+    return deletion
+
+
+def proxied_urls(session: Session, urls) -> dict[str, str]:
+    """Map the image URLs in ``urls`` to their ``/media/{image_id}`` proxy
+    URL when the proxy is enabled; URLs missing from the result are served
+    as they are. Costs one query for the URLs not seen before, if any."""
+    if not config.MEDIA_PROXY_ENABLED:
+        return {}
+    urls = {url for url in urls if url}
+    with _image_ids_lock:
+        known = {url: _image_ids[url] for url in urls if url in _image_ids}
+    missing = urls - known.keys()
+    if missing:
+        found = dict(
+            session.query(ImageMapper.image_url, ImageMapper.image_id).filter(
+                ImageMapper.image_url.in_(missing)
+            )
+        )
+        with _image_ids_lock:
+            for url in missing:
+                known[url] = _image_ids[url] = found.get(url)
+                _image_ids.move_to_end(url)
+            while len(_image_ids) > IMAGE_ID_CACHE_SIZE:
+                _image_ids.popitem(last=False)
+    return {
+        url: f"http://{config.HOST_SERVER}/media/{image_id}"
+        for url, image_id in known.items()
+        if image_id
+    }
+
+
+def get_image(image_id: str, session: Session) -> ImageMapper:
+    image = session.query(ImageMapper).filter(ImageMapper.image_id == image_id).first()
+    if not image:
+        raise ItemNotFoundException(f"Image with id {image_id} not found")
+    return image
+
+
+def get_cached_image_path(image: ImageMapper) -> str:
+    try:
+        return media_cache.get_or_fill(
+            image.image_id,
+            lambda dest: download_image(image=image, dest=dest),
+            timeout=config.MEDIA_FETCH_TIMEOUT_SECONDS,
+        )
+    except TimeoutError:
+        raise ServiceOverloadedException(
+            "The image is still being fetched. Please retry shortly."
+        )
+
+
+def image_headers(image: ImageMapper) -> dict:
+    # Image ids are never reused for new content, so the id pins the bytes.
+    return {
+        "ETag": f'"{image.image_id}"',
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Accept-Ranges": "bytes",
+    }
+
+
+def is_not_modified(image: ImageMapper, request: Request) -> bool:
+    if_none_match = request.headers.get("if-none-match", "")
+    etags = {etag.strip().removeprefix("W/") for etag in if_none_match.split(",")}
+    return image_headers(image)["ETag"] in etags or "*" in etags
+
+
+def parse_range(range_header: str, size: int) -> tuple[int, int] | None:
+    """Return the inclusive ``(start, end)`` of a single ``bytes=`` range.
+
+    Multi-range and malformed headers return ``None`` so the whole file is
+    served, which RFC 9110 allows. Unsatisfiable ranges raise ``ValueError``.
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    start, _, end = spec.strip().partition("-")
+    try:
+        if start:
+            start, end = int(start), int(end) if end else size - 1
+        else:
+            start, end = size - int(end), size - 1
+    except ValueError:
+        return None
+    start, end = max(start, 0), min(end, size - 1)
+    if start > end:
+        raise ValueError(range_header)
+    return start, end
+
+
+class FileRangeResponse(FileResponse):
+    """A ``206 Partial Content`` response with bytes ``start`` to ``end``
+    (inclusive) of ``path``, read straight from the file like
+    ``FileResponse``; Starlette's own only learns ranges in 0.39."""
+
+    def __init__(self, path: str, start: int, end: int, **kwargs) -> None:
+        super().__init__(path, status_code=status.HTTP_206_PARTIAL_CONTENT, **kwargs)
+        self.start, self.end = start, end
+
+    async def __call__(self, scope, receive, send) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        remaining = (
+            0 if scope["method"].upper() == "HEAD" else self.end - self.start + 1
+        )
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": True}
+                )
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def image_file_response(path: str, image: ImageMapper, request: Request) -> Response:
+    stat_result = os.stat(path)
+    size = stat_result.st_size
+    headers = image_headers(image)
+    media_type = mimetypes.guess_type(image.image_name)[0] or "application/octet-stream"
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range == headers["ETag"]):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            return Response(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers={**headers, "Content-Range": f"bytes */{size}"},
+            )
+        if byte_range:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return FileRangeResponse(
+                path, start, end, media_type=media_type, headers=headers
+            )
+
+    # FileResponse hands the file to the server via the ASGI pathsend
+    # extension (sendfile) when the server supports it.
+    return FileResponse(
+        path, media_type=media_type, headers=headers, stat_result=stat_result
+    )
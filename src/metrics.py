@@ -0,0 +1,238 @@
+import bisect
+import secrets
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable
+from fastapi import APIRouter, Depends, Header
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import event
+from .settings.config import config
+from .db.database import engine
+from .error import InvalidLoginCredentials
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_time")
+
+    def __init__(self) -> None:
+        self.queries = 0
+        self.db_time = 0.0
+
+
+# Set by the metrics middleware for the duration of a request. Sync routes
+# run in a worker thread with a copy of the context, which still points at
+# the same RequestStats object.
+request_stats: ContextVar[RequestStats | None] = ContextVar(
+    "request_stats", default=None
+)
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_start"].pop()
+    stats = request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += time.perf_counter() - started
+
+
+@event.listens_for(engine, "handle_error")
+def _handle_error(context):
+    starts = context.connection.info.get("query_start") if context.connection else None
+    if starts:
+        starts.pop()
+
+
+def query_budget(max_queries: int) -> Callable:
+    """Declare the most SQL statements a route may issue per request.
+
+    Put it under the router decorator. ``benchmarks.query_budgets`` fails
+    when a route goes over its budget, and in DEBUG mode the response
+    headers show the count next to the budget.
+    """
+
+    def decorator(endpoint: Callable) -> Callable:
+        endpoint.query_budget = max_queries
+        return endpoint
+
+    return decorator
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram, one series per label set."""
+
+    def __init__(self, name: str, help: str, buckets: list[float]) -> None:
+        self.name = name
+        self.help = help
+        self.buckets = sorted(buckets)
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self, label_names: tuple) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {
+                labels: (list(b), s, c) for labels, (b, s, c) in self._series.items()
+            }
+        for labels, (counts, total, count) in sorted(series.items()):
+            base = format_labels(label_names, labels)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = format_labels(label_names + ("le",), labels + (bound,))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = format_labels(label_names + ("le",), labels + ("+Inf",))
+            lines.append(f"{self.name}_bucket{le} {count}")
+            lines.append(f"{self.name}_sum{base} {total}")
+            lines.append(f"{self.name}_count{base} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help: str) -> None:
+        self.name = name
+        self.help = help
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: tuple, value: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def render(self, label_names: tuple) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{format_labels(label_names, labels)} {value}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, help: str) -> None:
+        self.name = name
+        self.help = help
+        self.value = 0
+
+    def render(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {self.value}",
+        ]
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def format_labels(names: tuple, values: tuple) -> str:
+    pairs = ",".join(
+        f'{name}="{escape_label(value)}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+ROUTE_LABELS = ("method", "route")
+STATUS_LABELS = ("method", "route", "status")
+
+request_duration = Histogram(
+    "http_request_duration_seconds",
+    "Request latency by route.",
+    [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10],
+)
+request_queries = Histogram(
+    "http_request_db_queries",
+    "SQL statements issued per request by route.",
+    [0, 1, 2, 3, 5, 10, 20, 50, 100],
+)
+requests_total = Counter("http_requests_total", "Requests by route and status.")
+db_time_total = Counter(
+    "http_request_db_seconds_total", "Time spent in SQL statements by route."
+)
+requests_in_flight = Gauge("http_requests_in_flight", "Requests being served.")
+
+
+def observe_request(
+    method: str, route: str, status: int, duration: float, stats: RequestStats
+) -> None:
+    labels = (method, route)
+    request_duration.observe(labels, duration)
+    request_queries.observe(labels, stats.queries)
+    requests_total.inc((method, route, status))
+    db_time_total.inc(labels, stats.db_time)
+
+
+# Components register a function returning a flat dict of numbers; each key
+# is exposed as a gauge named ``myblog_<component>_<key>``.
+stats_providers: dict[str, Callable[[], dict]] = {}
+
+
+def register_stats(component: str, provider: Callable[[], dict]) -> None:
+    stats_providers[component] = provider
+
+
+def db_pool_stats() -> dict:
+    pool = engine.pool
+    stats = {}
+    for key in ("size", "checkedin", "checkedout", "overflow"):
+        method = getattr(pool, key, None)
+        if callable(method):
+            stats[key] = method()
+    return stats
+
+
+register_stats("db_pool", db_pool_stats)
+
+
+def render_metrics() -> str:
+    lines = []
+    lines += request_duration.render(ROUTE_LABELS)
+    lines += request_queries.render(ROUTE_LABELS)
+    lines += requests_total.render(STATUS_LABELS)
+    lines += db_time_total.render(ROUTE_LABELS)
+    lines += requests_in_flight.render()
+    for component, provider in sorted(stats_providers.items()):
+        for key, value in provider().items():
+            if isinstance(value, (int, float)):
+                name = f"myblog_{component}_{key}"
+                lines += [f"# TYPE {name} gauge", f"{name} {float(value)}"]
+    return "\n".join(lines) + "\n"
+
+
+def metrics_token(authorization: str = Header("")) -> None:
+    """Require ``Authorization: Bearer <METRICS_TOKEN>`` when a token is set."""
+    expected = f"Bearer {config.METRICS_TOKEN}".encode()
+    if config.METRICS_TOKEN and not secrets.compare_digest(
+        authorization.encode(), expected
+    ):
+        raise InvalidLoginCredentials("Invalid metrics token.")
+
+
+metrics_router = APIRouter()
+
+
+@metrics_router.get(
+    "/metrics", include_in_schema=False, dependencies=[Depends(metrics_token)]
+)
+def metrics():
+    return PlainTextResponse(
+        render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
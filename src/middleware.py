@@ -0,0 +1,242 @@
+import logging
+import random
+import threading
+import time
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from .db.database import pool_saturated
+from .authentication.hashing import hash_pool
+from .authentication.dependencies import get_current_user
+from . import metrics
+from .profiling import ProfileStore, SamplingProfiler
+
+
+class LoadSheddingMiddleware:
+    """Answers 503 with ``Retry-After`` instead of queueing when overloaded.
+
+    A request is shed when ``max_concurrent`` requests are already in
+    flight, when every DB pool connection is checked out, or, for routes
+    that hash a password, when the hashing pool is full. Shedding happens
+    before the body is read or any dependency runs, so a rejected request
+    costs almost nothing.
+    """
+
+    EXEMPT_PATHS = ("/", "/docs", "/redoc", "/openapi.json", "/metrics")
+    HASHING_PATHS = (
+        "/api/auth/login/",
+        "/api/auth/signup/",
+        "/api/auth/reset-password/update-password/",
+        "/api/auth/change-password/",
+    )
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        max_concurrent: int = 0,
+        shed_on_db_pool: bool = True,
+        retry_after: int = 1,
+    ) -> None:
+        self.app = app
+        self.max_concurrent = int(max_concurrent)
+        self.shed_on_db_pool = shed_on_db_pool
+        self.retry_after = str(retry_after)
+        self.in_flight = 0
+        self.shed = 0
+        metrics.register_stats("load_shedding", self.stats)
+
+    def stats(self) -> dict:
+        return {"in_flight": self.in_flight, "shed": self.shed}
+
+    def overloaded(self, path: str) -> bool:
+        if self.max_concurrent and self.in_flight >= self.max_concurrent:
+            return True
+        if self.shed_on_db_pool and pool_saturated():
+            return True
+        return path.startswith(self.HASHING_PATHS) and hash_pool.saturated()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"] in self.EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+        if self.overloaded(scope["path"]):
+            self.shed += 1
+            response = JSONResponse(
+                status_code=503,
+                content={
+                    "message": "The server is busy. Please retry shortly.",
+                    "error_code": "service_overloaded_error",
+                },
+                headers={"Retry-After": self.retry_after},
+            )
+            await response(scope, receive, send)
+            return
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+
+
+class MetricsMiddleware:
+    """Records latency, status and SQL statement count/time per route.
+
+    Routes are labelled with their path template (``/api/posts/{post_id}/``)
+    so the number of series stays bounded; requests that match no route
+    share the ``unmatched`` label.
+    """
+
+    def __init__(self, app: ASGIApp, debug_headers: bool = False) -> None:
+        self.app = app
+        self.debug_headers = debug_headers
+
+    def add_debug_headers(
+        self, scope: Scope, message: Message, stats: metrics.RequestStats, start: float
+    ) -> None:
+        total_ms = (time.perf_counter() - start) * 1000
+        headers = MutableHeaders(scope=message)
+        headers["X-Query-Count"] = str(stats.queries)
+        headers["Server-Timing"] = (
+            f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries", '
+            f"total;dur={total_ms:.1f}"
+        )
+        route = scope.get("route")
+        budget = getattr(getattr(route, "endpoint", None), "query_budget", None)
+        if budget is not None:
+            headers["X-Query-Budget"] = str(budget)
+            if stats.queries > budget:
+                logging.warning(
+                    f"{scope['method']} {route.path} issued {stats.queries} "
+                    f"queries, over its budget of {budget}"
+                )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = metrics.RequestStats()
+        token = metrics.request_stats.set(stats)
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.debug_headers:
+                    self.add_debug_headers(scope, message, stats, start)
+            await send(message)
+
+        metrics.requests_in_flight.value += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            metrics.requests_in_flight.value -= 1
+            metrics.request_stats.reset(token)
+            route = scope.get("route")
+            metrics.observe_request(
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                status,
+                duration,
+                stats,
+            )
+
+
+class ProfilingMiddleware:
+    """Profiles single requests and saves them to ``store``.
+
+    A request is profiled when it carries ``X-Profile: 1`` and an admin's
+    bearer token, or at random for a ``sample_rate`` fraction of requests.
+    One request is profiled at a time; others pass through untouched. The
+    response of a profiled request carries ``X-Profile-Id``.
+
+    The sampler sees the whole process, so the saved summary says so
+    (``"scope": "process"``) and counts the other requests that ran during
+    the profile (``concurrent_requests``); with none, every busy stack is
+    the profiled request's.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        store: ProfileStore,
+        sample_rate: float = 0.0,
+        interval: float = 0.005,
+    ) -> None:
+        self.app = app
+        self.store = store
+        self.sample_rate = float(sample_rate)
+        self.interval = float(interval)
+        self._busy = threading.Lock()
+        self.in_flight = 0
+        self.started = 0
+
+    async def requested_by_admin(self, scope: Scope) -> bool:
+        headers = dict(scope["headers"])
+        if headers.get(b"x-profile", b"").lower() not in (b"1", b"true"):
+            return False
+        scheme, _, token = headers.get(b"authorization", b"").decode().partition(" ")
+        if scheme.lower() != "bearer":
+            return False
+        try:
+            # In a worker thread: checking the account may query the DB.
+            return (await run_in_threadpool(get_current_user, token)).is_admin
+        except Exception:
+            return False
+
+    async def wanted(self, scope: Scope) -> bool:
+        if self.sample_rate and random.random() < self.sample_rate:
+            return True
+        return await self.requested_by_admin(scope)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        self.in_flight += 1
+        self.started += 1
+        try:
+            if await self.wanted(scope) and self._busy.acquire(blocking=False):
+                await self.profile(scope, receive, send)
+            else:
+                await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+
+    async def profile(self, scope: Scope, receive: Receive, send: Send) -> None:
+        profile_id = self.store.new_id()
+        profiler = SamplingProfiler(self.interval)
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                MutableHeaders(scope=message)["X-Profile-Id"] = profile_id
+            await send(message)
+
+        start = time.perf_counter()
+        others, started = self.in_flight - 1, self.started
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.stop()
+            self._busy.release()
+            route = scope.get("route")
+            self.store.save(
+                profile_id,
+                profiler,
+                {
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "route": getattr(route, "path", "unmatched"),
+                    "status": status,
+                    "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+                    "scope": "process",
+                    "concurrent_requests": others + self.started - started,
+                },
+            )
@@ -0,0 +1,229 @@
+import logging
+import smtplib
+import ssl
+import threading
+import time
+from datetime import timedelta
+from email.message import EmailMessage
+from email.utils import formataddr
+from sqlalchemy.orm import Session
+from .settings.config import config
+from .db.models import OutboxEmail, utc_now
+from .workers import register_worker
+
+
+class SMTPSender:
+    """One long-lived SMTP connection shared by every outbox batch.
+
+    The connection is opened on first use and kept for the following
+    messages. It is closed once it has been idle for ``SMTP_IDLE_SECONDS``
+    (most servers drop idle clients anyway), and a dropped connection is
+    reopened once before the message is reported as failed. Sends are
+    spaced out to at most ``rate`` messages per second.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        username: str | None = None,
+        password: str | None = None,
+        starttls: bool = True,
+        ssl_tls: bool = False,
+        validate_certs: bool = True,
+        timeout: float = 30,
+        idle_seconds: float = 60,
+        rate: float = 0,
+    ) -> None:
+        self.host = host
+        self.port = int(port)
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.ssl_tls = ssl_tls
+        self.validate_certs = validate_certs
+        self.timeout = float(timeout)
+        self.idle_seconds = float(idle_seconds)
+        self.interval = 1 / float(rate) if rate else 0
+        self.connections = 0
+        self.sent = 0
+        self._smtp: smtplib.SMTP | None = None
+        self._last_used = 0.0
+        self._lock = threading.Lock()
+
+    def _ssl_context(self) -> ssl.SSLContext:
+        context = ssl.create_default_context()
+        if not self.validate_certs:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        return context
+
+    def _connect(self) -> smtplib.SMTP:
+        if self.ssl_tls:
+            smtp = smtplib.SMTP_SSL(
+                self.host,
+                self.port,
+                timeout=self.timeout,
+                context=self._ssl_context(),
+            )
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.starttls:
+                smtp.starttls(context=self._ssl_context())
+        if self.username:
+            smtp.login(self.username, self.password)
+        self.connections += 1
+        return smtp
+
+    def _connection(self) -> smtplib.SMTP:
+        idle = time.monotonic() - self._last_used
+        if self._smtp is not None and idle > self.idle_seconds:
+            self._close()
+        if self._smtp is None:
+            self._smtp = self._connect()
+        return self._smtp
+
+    def _close(self) -> None:
+        smtp, self._smtp = self._smtp, None
+        if smtp is not None:
+            try:
+                smtp.quit()
+            except smtplib.SMTPException:
+                smtp.close()
+            except OSError:
+                pass
+
+    def _throttle(self) -> None:
+        wait = self._last_used + self.interval - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+    def send(self, message: EmailMessage) -> None:
+        with self._lock:
+            self._throttle()
+            try:
+                self._connection().send_message(message)
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                logging.info("SMTP connection dropped, reconnecting.")
+                self._close()
+                self._connection().send_message(message)
+            finally:
+                self._last_used = time.monotonic()
+            self.sent += 1
+
+    def close(self) -> None:
+        with self._lock:
+            self._close()
+
+    def stats(self) -> dict:
+        return {"connections": self.connections, "sent": self.sent}
+
+
+sender = SMTPSender(
+    host=config.MAIL_SERVER,
+    port=config.MAIL_PORT,
+    username=config.MAIL_USERNAME if config.MAIL_USE_CREDENTIALS else None,
+    password=config.MAIL_PASSWORD,
+    starttls=config.MAIL_STARTTLS,
+    ssl_tls=config.MAIL_SSL_TLS,
+    validate_certs=config.MAIL_VALIDATE_CERTS,
+    timeout=config.SMTP_TIMEOUT_SECONDS,
+    idle_seconds=config.SMTP_IDLE_SECONDS,
+    rate=config.OUTBOX_RATE_PER_SECOND,
+)
+
+
+def queue_email(
+    session: Session, recipients: list[str], html: str, subject: str
+) -> OutboxEmail:
+    """Store an email in the outbox and wake the sender.
+
+    The row is committed here, so the email survives a restart of the
+    worker that queued it.
+    """
+    email = OutboxEmail(recipients=",".join(recipients), subject=subject, html=html)
+    session.add(email)
+    session.commit()
+    outbox_worker.wake()
+    return email
+
+
+def build_message(email: OutboxEmail) -> EmailMessage:
+    message = EmailMessage()
+    message["From"] = formataddr((config.MAIL_FROM_NAME or "", config.MAIL_FROM))
+    message["To"] = ", ".join(email.recipients.split(","))
+    message["Subject"] = email.subject
+    message.set_content(email.html, subtype="html")
+    return message
+
+
+PERMANENT_CODES = range(550, 555)
+
+
+def is_permanent(error: Exception) -> bool:
+    """Whether the server rejected the message itself, so retrying is pointless.
+
+    Only the mailbox and policy rejections (550-554) of the recipients or the
+    data count. Other 5xx replies, such as 530/535 authentication failures,
+    come from our own setup and clear once it is fixed.
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        return bool(codes) and all(code in PERMANENT_CODES for code in codes)
+    if isinstance(error, smtplib.SMTPDataError):
+        return error.smtp_code in PERMANENT_CODES
+    return False
+
+
+def outbox_backoff(attempts: int) -> timedelta:
+    delay = config.OUTBOX_BACKOFF_SECONDS * 2 ** max(attempts - 1, 0)
+    return timedelta(seconds=min(delay, config.OUTBOX_MAX_BACKOFF_SECONDS))
+
+
+def drain_outbox(session: Session) -> dict:
+    """Send one batch of due emails over the shared SMTP connection.
+
+    Failed sends are retried with exponential backoff. An email is moved to
+    the ``dead`` status when the server rejects it permanently (550-554) or
+    after ``OUTBOX_MAX_ATTEMPTS`` tries.
+    """
+    now = utc_now()
+    batch = (
+        session.query(OutboxEmail)
+        .filter(OutboxEmail.status == "pending", OutboxEmail.next_attempt_at <= now)
+        .order_by(OutboxEmail.next_attempt_at)
+        .limit(config.OUTBOX_BATCH_SIZE)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    # Claim the batch before sending so the row locks can be released after
+    # each message without another process picking the rest up.
+    for email in batch:
+        email.next_attempt_at = now + timedelta(seconds=config.OUTBOX_CLAIM_SECONDS)
+    session.commit()
+    sent, failed = 0, 0
+    for email in batch:
+        try:
+            sender.send(build_message(email))
+        except Exception as e:
+            failed += 1
+            email.attempts += 1
+            email.last_error = str(e)
+            if is_permanent(e) or email.attempts >= config.OUTBOX_MAX_ATTEMPTS:
+                email.status = "dead"
+                logging.error(f"Giving up sending email {email.id}: {str(e)}")
+            else:
+                email.next_attempt_at = utc_now() + outbox_backoff(email.attempts)
+        else:
+            sent += 1
+            session.delete(email)
+        # Commit per message so a crash mid-batch does not resend what went out.
+        session.commit()
+    if len(batch) == config.OUTBOX_BATCH_SIZE:
+        outbox_worker.wake()
+    return {"sent": sent, "failed": failed}
+
+
+outbox_worker = register_worker(
+    "email-outbox", config.OUTBOX_INTERVAL_SECONDS, drain_outbox
+)
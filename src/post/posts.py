@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, File, Form, UploadFile
+from fastapi import APIRouter, Depends, File, Form, Query, UploadFile
 from sqlalchemy.orm import Session
 from ..error import ItemNotFoundException, OperationNotAllowedException
 from ..authentication.dependencies import get_current_user
@@ -7,12 +7,23 @@ from ..db.database import get_session
 from . import schemas, utils
 from ..processor_image import delete_image, upload_image
 from ..settings.config import config
+from ..ratelimit import user_rate_limit
+from ..metrics import query_budget
+from .views import view_counter
 
 
 post_router = APIRouter(prefix="/api/posts", tags=["post"])
 
 
-@post_router.post("/", response_model=schemas.PostOutModel, status_code=201)
+@post_router.post(
+    "/",
+    response_model=schemas.PostOutModel,
+    status_code=201,
+    dependencies=[
+        Depends(user_rate_limit("create-post", config.RATE_LIMIT_CREATE_POST))
+    ],
+)
+@query_budget(16)
 async def make_a_post(
     post_title: str = Form(None, examples=["My First Trip to Lagos"]),
     post_content: str = Form(None, examples=["I am about to share..."]),
@@ -35,31 +46,51 @@ async def make_a_post(
 
 
 @post_router.get("/users/", response_model=list[schemas.PostOutModel])
+@query_budget(7)
 def get_user_posts(
+    time_range: schemas.TimeRangeModel = Depends(),
     current_user: Payload = Depends(get_current_user),
     session: Session = Depends(get_session),
 ):
-    user_posts = utils.get_all_user_posts(session, current_user.user_id)
+    user_posts = utils.get_all_user_posts(session, current_user.user_id, time_range)
     return user_posts
 
 
+@post_router.get("/most-viewed/", response_model=list[schemas.PostOutModel])
+@query_budget(7)
+def get_most_viewed_posts(
+    time_range: schemas.TimeRangeModel = Depends(),
+    limit: int = Query(10, ge=1, le=100),
+    session: Session = Depends(get_session),
+):
+    posts = utils.get_most_viewed_posts(session, time_range, limit)
+    return posts
+
+
 @post_router.get("/{post_id}/", response_model=schemas.PostOutModel)
+@query_budget(7)
 def get_post(
     post_id: int,
     current_user: Payload = Depends(get_current_user),
     session: Session = Depends(get_session),
 ):
     post = utils.get_post_by_id(post_id=post_id, session=session)
+    view_counter.add(post_id)
     return post
 
 
 @post_router.get("/", response_model=list[schemas.PostOutModel])
-def get_all_posts_in_db(session: Session = Depends(get_session)):
-    posts = utils.get_all_posts(session=session)
+@query_budget(7)
+def get_all_posts_in_db(
+    time_range: schemas.TimeRangeModel = Depends(),
+    session: Session = Depends(get_session),
+):
+    posts = utils.get_all_posts(session=session, time_range=time_range)
     return posts
 
 
 @post_router.put("/{post_id}/", response_model=schemas.PostOutModel, status_code=201)
+@query_budget(20)
 async def update_post(
     post_id: int,
     post_title: str | None = Form(None, examples=["My First Trip to Lagos"]),
@@ -90,6 +121,7 @@ async def update_post(
 
 
 @post_router.delete("/{post_id}/", response_model=schemas.DeleteOutModel)
+@query_budget(15)
 def delete_post(
     post_id: int,
     current_user: Payload = Depends(get_current_user),
@@ -100,20 +132,54 @@ def delete_post(
 
 
 @post_router.get("/hashtags/{hashtag}", response_model=list[schemas.PostOutModel])
+@query_budget(7)
 def get_posts_by_hashtags(
     hashtag: str,
+    time_range: schemas.TimeRangeModel = Depends(),
     current_user: Payload = Depends(get_current_user),
     session: Session = Depends(get_session),
 ):
     hashtag = hashtag.replace("#", "").lower().strip()
-    posts = utils.get_posts_by_hashtags(hashtag=hashtag, session=session)
+    posts = utils.get_posts_by_hashtags(
+        hashtag=hashtag, session=session, time_range=time_range
+    )
     return posts
 
 
+@post_router.get("/{post_id}/comments/", response_model=list[schemas.CommentOutModel])
+@query_budget(3)
+def get_post_comments(
+    post_id: int,
+    time_range: schemas.TimeRangeModel = Depends(),
+    limit: int = Query(50, ge=1, le=500),
+    current_user: Payload = Depends(get_current_user),
+    session: Session = Depends(get_session),
+):
+    comments = utils.get_post_comments(post_id, session, time_range, limit)
+    return comments
+
+
+@post_router.get(
+    "/{post_id}/comments/threads/", response_model=schemas.CommentThreadPageModel
+)
+@query_budget(5)
+def get_comment_threads(
+    post_id: int,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: int | None = None,
+    replies: int = Query(config.REPLY_PREVIEW_SIZE, ge=0, le=20),
+    current_user: Payload = Depends(get_current_user),
+    session: Session = Depends(get_session),
+):
+    page = utils.get_comment_threads(post_id, session, limit, cursor, replies)
+    return page
+
+
 @post_router.post("/{post_id}/comments/", status_code=201)
+@query_budget(12)
 def add_comment_to_post(
     post_id: int,
-    comment: schemas.CommentBaseModel,
+    comment: schemas.CommentCreateModel,
     current_user: Payload = Depends(get_current_user),
     session: Session = Depends(get_session),
 ):
@@ -124,9 +190,26 @@ def add_comment_to_post(
     return post
 
 
+@post_router.get(
+    "/comments/{comment_id}/replies/", response_model=schemas.CommentRepliesPageModel
+)
+@query_budget(3)
+def get_comment_replies(
+    comment_id: int,
+    limit: int = Query(50, ge=1, le=500),
+    after: str | None = Query(None, pattern=r"^(\d{10}/)+$"),
+    depth: int | None = Query(None, ge=1),
+    current_user: Payload = Depends(get_current_user),
+    session: Session = Depends(get_session),
+):
+    page = utils.get_comment_replies(comment_id, session, limit, after, depth)
+    return page
+
+
 @post_router.put(
     "/comments/{comment_id}/", response_model=schemas.CommentOutModel, status_code=201
 )
+@query_budget(5)
 def update_comment(
     comment_id: int,
     new_comment: schemas.CommentBaseModel,
@@ -140,6 +223,7 @@ def update_comment(
 
 
 @post_router.delete("/comments/{comment_id}/", response_model=schemas.DeleteOutModel)
+@query_budget(4)
 def delete_comment(
     comment_id: int,
     current_user: Payload = Depends(get_current_user),
@@ -152,6 +236,7 @@ def delete_comment(
 @post_router.post(
     "/{post_id}/like/", response_model=schemas.PostOutModel, status_code=201
 )
+@query_budget(13)
 def like_post(
     post_id: int,
     current_user: Payload = Depends(get_current_user),
@@ -162,6 +247,7 @@ def like_post(
 
 
 @post_router.delete("/{post_id}/like/", response_model=schemas.DeleteOutModel)
+@query_budget(10)
 def remove_like_from_post(
     post_id: int,
     current_user: Payload = Depends(get_current_user),
@@ -174,6 +260,7 @@ def remove_like_from_post(
 @post_router.post(
     "/{post_id}/dislike/", response_model=schemas.DeleteOutModel, status_code=201
 )
+@query_budget(13)
 def dislike_post(
     post_id: int,
     current_user: Payload = Depends(get_current_user),
@@ -186,6 +273,7 @@ def dislike_post(
 @post_router.delete(
     "/{post_id}/dislike/", response_model=schemas.PostOutModel, status_code=201
 )
+@query_budget(10)
 def remove_dislike_from_post(
     post_id: int,
     current_user: Payload = Depends(get_current_user),
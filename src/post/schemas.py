@@ -1,24 +1,53 @@
-from datetime import datetime
-from pydantic import BaseModel
+from datetime import datetime, timezone
+from pydantic import BaseModel, Field, field_validator
+
+
+def naive_utc(value: datetime | None) -> datetime | None:
+    # Timestamps are stored as naive UTC.
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
 
 
 class CommentBaseModel(BaseModel):
     comment_content: str
 
 
+class CommentCreateModel(CommentBaseModel):
+    parent_id: int | None = Field(None, description="Comment to reply to")
+
+
 class CommentInModel(CommentBaseModel):
     user_id: int
     post_id: int
+    parent_id: int | None = None
 
 
 class CommentOutModel(CommentInModel):
     comment_id: int
     commented_at: datetime
+    depth: int = 0
 
     class ConfigDict:
         from_attributes = True
 
 
+class ThreadCommentModel(CommentOutModel):
+    username: str | None = None
+    reply_count: int | None = None
+    replies: list["ThreadCommentModel"] = []
+
+
+class CommentThreadPageModel(BaseModel):
+    comments: list[ThreadCommentModel]
+    next_cursor: int | None = None
+
+
+class CommentRepliesPageModel(BaseModel):
+    comments: list[ThreadCommentModel]
+    next_cursor: str | None = None
+
+
 class PostBaseModel(BaseModel):
     post_title: str
     post_content: str
@@ -33,6 +62,7 @@ class PostOutModel(PostBaseModel):
     post_id: int
     user_id: int
     posted_at: datetime
+    views: int
     total_likes: int
     total_dislikes: int
     total_comments: int
@@ -54,3 +84,10 @@ class PostUpdateModel(BaseModel):
 class DeleteOutModel(BaseModel):
     message: str
     post: PostOutModel | None = None
+
+
+class TimeRangeModel(BaseModel):
+    since: datetime | None = Field(None, description="Inclusive lower bound")
+    until: datetime | None = Field(None, description="Exclusive upper bound")
+
+    _naive_utc = field_validator("since", "until")(naive_utc)
@@ -0,0 +1,207 @@
+"""Reply threads stored as materialized paths.
+
+A comment's ``path`` lists the ids from its top-level comment down to
+itself, each zero-padded to ``PATH_WIDTH`` digits and followed by "/": reply
+42 to comment 7 has the path ``0000000007/0000000042/``. Sorting by path
+puts a thread in reading order, and the subtree under a comment is one range
+of paths, read a page at a time with a range scan on ``(post_id, path)``.
+Previews read a few comments per parent and count the rest separately, so
+no query here loads a whole thread on PostgreSQL.
+"""
+
+from sqlalchemy import Integer, and_, column, func, select, true, values
+from sqlalchemy.orm import Session
+from ..db.models import Comments
+
+PATH_WIDTH = 10
+
+
+def comment_path(parent_path: str, comment_id: int) -> str:
+    return f"{parent_path}{comment_id:0{PATH_WIDTH}d}/"
+
+
+def path_comment_id(path: str) -> int:
+    """The id of the last comment on ``path``."""
+    return int(path[-(PATH_WIDTH + 1) : -1])
+
+
+def subtree_range(comment) -> tuple[str, str]:
+    """Paths in the subtree of ``comment``, itself included, are ``>= lower``
+    and ``< upper``.
+
+    ``upper`` is the path a next sibling would have. It sorts after every
+    path in the subtree, also under collations that ignore the "/".
+    """
+    parent_path = comment.path[: -(PATH_WIDTH + 1)]
+    return comment.path, comment_path(parent_path, comment.comment_id + 1)
+
+
+def in_subtree(comment):
+    if not comment.path:
+        # Not backfilled yet (see ``db.migrate``); it cannot have replies.
+        return Comments.comment_id == comment.comment_id
+    lower, upper = subtree_range(comment)
+    return and_(
+        Comments.post_id == comment.post_id,
+        Comments.path >= lower,
+        Comments.path < upper,
+    )
+
+
+def first_per_parent(
+    session: Session, key, parent_ids: list[int], where: tuple, order_by, size: int
+):
+    """Ids of the first ``size`` comments, in ``order_by`` order, of each of
+    ``parent_ids``, the values of ``key`` (a post or parent comment id).
+
+    One statement whatever the number of parents. On PostgreSQL each parent
+    gets its own ``LIMIT`` through ``LATERAL``, so it reads at most ``size``
+    entries of ``ix_comments_post_id_parent_id``; elsewhere the comments of
+    the parents are ranked with ``row_number()``.
+    """
+    if session.get_bind().dialect.name == "postgresql":
+        parents = values(column("parent", Integer), name="parents").data(
+            [(parent_id,) for parent_id in parent_ids]
+        )
+        first = (
+            select(Comments.comment_id)
+            .where(key == parents.c.parent, *where)
+            .order_by(order_by)
+            .limit(size)
+            .lateral()
+        )
+        return select(first.c.comment_id).select_from(parents).join(first, true())
+    ranked = (
+        select(
+            Comments.comment_id,
+            func.row_number()
+            .over(partition_by=key, order_by=order_by)
+            .label("preview_rank"),
+        )
+        .where(key.in_(parent_ids), *where)
+        .subquery()
+    )
+    return select(ranked.c.comment_id).where(ranked.c.preview_rank <= size)
+
+
+def post_comment_previews(
+    session: Session, post_ids: list[int], size: int
+) -> tuple[dict[int, list[Comments]], dict[int, int]]:
+    """The newest ``size`` top-level comments of each post, and each post's
+    number of comments, replies included, in two queries."""
+    if not post_ids:
+        return {}, {}
+    totals = dict(
+        session.execute(
+            select(Comments.post_id, func.count())
+            .where(Comments.post_id.in_(post_ids))
+            .group_by(Comments.post_id)
+        ).all()
+    )
+    previews: dict[int, list[Comments]] = {}
+    if size < 1 or not totals:
+        return previews, totals
+    newest = first_per_parent(
+        session,
+        Comments.post_id,
+        list(totals),
+        (Comments.parent_id.is_(None),),
+        Comments.comment_id.desc(),
+        size,
+    )
+    rows = (
+        session.query(Comments)
+        .filter(Comments.comment_id.in_(newest))
+        .order_by(Comments.comment_id.desc())
+    )
+    for comment in rows:
+        previews.setdefault(comment.post_id, []).append(comment)
+    return previews, totals
+
+
+def top_level_page(
+    session: Session, post_id: int, limit: int, cursor: int | None = None
+) -> tuple[list[Comments], int | None]:
+    """Top-level comments of a post, newest first, and the next cursor.
+
+    Keyset pagination on ``comment_id`` as in the admin user listing.
+    """
+    query = session.query(Comments).filter(
+        Comments.post_id == post_id, Comments.parent_id.is_(None)
+    )
+    if cursor is not None:
+        query = query.filter(Comments.comment_id < cursor)
+    comments = query.order_by(Comments.comment_id.desc()).limit(limit + 1).all()
+    next_cursor = comments[limit - 1].comment_id if len(comments) > limit else None
+    return comments[:limit], next_cursor
+
+
+def reply_previews(
+    session: Session, post_id: int, parent_ids: list[int], size: int
+) -> dict[int, tuple[list[Comments], int]]:
+    """The first ``size`` direct replies to each of ``parent_ids``, oldest
+    first, with how many direct replies each has, in two queries."""
+    if not parent_ids:
+        return {}
+    counts = dict(
+        session.execute(
+            select(Comments.parent_id, func.count())
+            .where(Comments.post_id == post_id, Comments.parent_id.in_(parent_ids))
+            .group_by(Comments.parent_id)
+        ).all()
+    )
+    previews = {parent_id: ([], replies) for parent_id, replies in counts.items()}
+    if size < 1 or not counts:
+        return previews
+    first = first_per_parent(
+        session,
+        Comments.parent_id,
+        list(counts),
+        (Comments.post_id == post_id,),
+        Comments.comment_id,
+        size,
+    )
+    rows = (
+        session.query(Comments)
+        .filter(Comments.comment_id.in_(first))
+        .order_by(Comments.comment_id)
+    )
+    for comment in rows:
+        previews[comment.parent_id][0].append(comment)
+    return previews
+
+
+def subtree_page(
+    session: Session,
+    root: Comments,
+    limit: int,
+    after: str | None = None,
+    depth: int | None = None,
+) -> tuple[list[Comments], str | None]:
+    """Replies under ``root`` in reading order, ``limit`` at a time.
+
+    ``after`` is the cursor returned with the previous page. ``depth`` keeps
+    replies at most that many levels below ``root``; with 1, only its direct
+    replies are read, in id order, which is their path order.
+    """
+    lower, upper = subtree_range(root)
+    after = max(after or lower, lower)
+    if depth == 1:
+        query = session.query(Comments).filter(
+            Comments.post_id == root.post_id, Comments.parent_id == root.comment_id
+        )
+        if after != lower:
+            query = query.filter(Comments.comment_id > path_comment_id(after))
+        query = query.order_by(Comments.comment_id)
+    else:
+        query = session.query(Comments).filter(
+            Comments.post_id == root.post_id,
+            Comments.path > after,
+            Comments.path < upper,
+        )
+        if depth is not None:
+            query = query.filter(Comments.depth <= root.depth + depth)
+        query = query.order_by(Comments.path)
+    comments = query.limit(limit + 1).all()
+    next_cursor = comments[limit - 1].path if len(comments) > limit else None
+    return comments[:limit], next_cursor
@@ -1,49 +1,69 @@
 from fastapi import HTTPException
 from ..processor_image import delete_image
 from ..error import SQLAlchemyDataCreationError
-from sqlalchemy.orm import Session
-from sqlalchemy import delete
+from sqlalchemy.orm import Query, Session, selectinload
+from sqlalchemy import delete, select
 from ..db.models import Comments, Dislikes, Likes, Posts, HashTags, post_hashtag, Users
+from ..db.models import utc_now
 from . import schemas
 from ..error import ItemNotFoundException, OperationNotAllowedException
 from ..settings.config import config
+from .views import view_counter
+from ..media.utils import proxied_urls
+from . import threads
 import re
+from datetime import timedelta
 
 
-def return_username_from_user_id(session: Session, user_id):
-    user = session.query(Users).filter(Users.user_id == user_id).first()
-    return user.username
+# Everything post_out_sqlalchemy_to_pydantic reads, loaded with one extra
+# query per relationship for the whole list of posts. Comments are not
+# loaded: posts show a preview, see threads.post_comment_previews.
+POST_OUT_LOADERS = (
+    selectinload(Posts.hashtags),
+    selectinload(Posts.likes),
+    selectinload(Posts.dislikes),
+)
 
 
-def post_out_sqlalchemy_to_pydantic(
-    session: Session, post: Posts
+def usernames_for(session: Session, user_ids: set[int]) -> dict[int, str]:
+    if not user_ids:
+        return {}
+    rows = session.query(Users.user_id, Users.username).filter(
+        Users.user_id.in_(user_ids)
+    )
+    return dict(rows.all())
+
+
+def post_out(
+    post: Posts,
+    usernames: dict[int, str],
+    comments: list[Comments],
+    total_comments: int,
+    image_urls: dict[str, str],
 ) -> schemas.PostOutModel:
     hashtags = [hashtag_model.hashtag for hashtag_model in post.hashtags]
     comments = [
         {
-            "username": return_username_from_user_id(session, comment.user_id),
+            "comment_id": comment.comment_id,
+            "username": usernames.get(comment.user_id),
             "comment": comment.comment_content,
             "comment_date": comment.commented_at,
         }
-        for comment in post.comments
-    ]
-    liked_by = [
-        return_username_from_user_id(session, like.user_id) for like in post.likes
-    ]
-    disliked_by = [
-        return_username_from_user_id(session, dislike.user_id)
-        for dislike in post.dislikes
+        for comment in comments
     ]
+    liked_by = [usernames.get(like.user_id) for like in post.likes]
+    disliked_by = [usernames.get(dislike.user_id) for dislike in post.dislikes]
     post_out = schemas.PostOutModel(
         post_title=post.post_title,
         post_content=post.post_content,
         post_id=post.post_id,
         user_id=post.user_id,
-        post_image=post.post_image,
+        post_image=image_urls.get(post.post_image, post.post_image),
         posted_at=post.posted_at,
+        views=post.views + view_counter.pending(post.post_id),
         total_likes=len(post.likes),
         total_dislikes=len(post.dislikes),
-        total_comments=len(post.comments),
+        total_comments=total_comments,
         hashtags=hashtags,
         comments=comments,
         liked_by=liked_by,
@@ -52,10 +72,46 @@ def post_out_sqlalchemy_to_pydantic(
     return post_out
 
 
+def posts_out(session: Session, posts: list[Posts]) -> list[schemas.PostOutModel]:
+    """Serialize ``posts`` with a fixed number of queries, however many
+    posts, comments or reactions there are."""
+    previews, totals = threads.post_comment_previews(
+        session, [post.post_id for post in posts], config.COMMENT_PREVIEW_SIZE
+    )
+    usernames = usernames_for(
+        session,
+        {
+            item.user_id
+            for post in posts
+            for item in (*previews.get(post.post_id, []), *post.likes, *post.dislikes)
+        },
+    )
+    image_urls = proxied_urls(session, [post.post_image for post in posts])
+    return [
+        post_out(
+            post,
+            usernames,
+            previews.get(post.post_id, []),
+            totals.get(post.post_id, 0),
+            image_urls,
+        )
+        for post in posts
+    ]
+
+
+def post_out_sqlalchemy_to_pydantic(
+    session: Session, post: Posts
+) -> schemas.PostOutModel:
+    return posts_out(session, [post])[0]
+
+
 def get_post_by_id(
     post_id: int, session: Session, return_pydantic=True
 ) -> Posts | schemas.PostOutModel:
-    post = session.query(Posts).filter(Posts.post_id == post_id).first()
+    query = session.query(Posts).filter(Posts.post_id == post_id)
+    if return_pydantic:
+        query = query.options(*POST_OUT_LOADERS)
+    post = query.first()
     if not post:
         raise ItemNotFoundException(f"Post with id {post_id} not found")
     if return_pydantic:
@@ -63,24 +119,37 @@ def get_post_by_id(
     return post
 
 
-def get_all_posts(session: Session) -> list[schemas.PostOutModel]:
-    posts = session.query(Posts).all()
-    if posts:
-        posts = [
-            post_out_sqlalchemy_to_pydantic(session=session, post=post)
-            for post in posts
-        ]
-    return posts
+def in_time_range(query: Query, column, time_range: schemas.TimeRangeModel) -> Query:
+    if time_range.since:
+        query = query.filter(column >= time_range.since)
+    if time_range.until:
+        query = query.filter(column < time_range.until)
+    return query
+
 
+def newest_posts(
+    session: Session, time_range: schemas.TimeRangeModel | None = None
+) -> Query:
+    """Posts newest first, optionally within ``time_range``; served by the
+    ``posted_at`` indexes."""
+    query = session.query(Posts).options(*POST_OUT_LOADERS)
+    if time_range is not None:
+        query = in_time_range(query, Posts.posted_at, time_range)
+    return query.order_by(Posts.posted_at.desc(), Posts.post_id.desc())
 
-def get_all_user_posts(session: Session, user_id: int) -> list[schemas.PostOutModel]:
-    user_posts = session.query(Posts).filter(Posts.user_id == user_id).all()
-    if user_posts:
-        user_posts = [
-            post_out_sqlalchemy_to_pydantic(post=post, session=session)
-            for post in user_posts
-        ]
-    return user_posts
+
+def get_all_posts(
+    session: Session, time_range: schemas.TimeRangeModel | None = None
+) -> list[schemas.PostOutModel]:
+    posts = newest_posts(session, time_range).all()
+    return posts_out(session, posts)
+
+
+def get_all_user_posts(
+    session: Session, user_id: int, time_range: schemas.TimeRangeModel | None = None
+) -> list[schemas.PostOutModel]:
+    user_posts = newest_posts(session, time_range).filter(Posts.user_id == user_id)
+    return posts_out(session, user_posts.all())
 
 
 def find_hashtags_in_post(post: Posts) -> list[str]:
@@ -115,6 +184,7 @@ def create_new_post(
     if hashtags:
         for hashtag in hashtags:
             add_new_hashtag(session, hashtag, post)
+    session.commit()
     post = post_out_sqlalchemy_to_pydantic(session=session, post=post)
     return post
 
@@ -165,6 +235,8 @@ def update_post(
         if new_post_hashtags:
             for hashtag in new_post_hashtags:
                 add_new_hashtag(session, hashtag, post)
+    # The edit spans several commits; announce it once the last one is in.
+    session.commit()
     post = post_out_sqlalchemy_to_pydantic(session=session, post=post)
     return post
 
@@ -179,26 +251,97 @@ def delete_post(post_id: int, user_id: int, session: Session) -> None:
         )
     if post.post_image:
         delete_image(post.post_image, session)
+    # Set-based, so the cascade below does not load every comment.
+    session.execute(
+        delete(Comments)
+        .where(Comments.post_id == post_id)
+        .execution_options(synchronize_session=False)
+    )
     session.delete(post)
     session.commit()
 
 
-def get_posts_by_hashtags(hashtag: str, session: Session) -> list[schemas.PostOutModel]:
-    hashs = session.query(HashTags).filter(HashTags.hashtag == hashtag).all()
-    posts = [
-        post_out_sqlalchemy_to_pydantic(session=session, post=hash.post)
-        for hash in hashs
-    ]
-    return posts
+def get_posts_by_hashtags(
+    hashtag: str, session: Session, time_range: schemas.TimeRangeModel | None = None
+) -> list[schemas.PostOutModel]:
+    # Start from the hashtag rather than testing every post for it.
+    post_ids = (
+        select(post_hashtag.c.post_id)
+        .join(HashTags, HashTags.hashtag_id == post_hashtag.c.hashtag_id)
+        .where(HashTags.hashtag == hashtag)
+    )
+    posts = newest_posts(session, time_range).filter(Posts.post_id.in_(post_ids)).all()
+    return posts_out(session, posts)
+
+
+def get_most_viewed_posts(
+    session: Session, time_range: schemas.TimeRangeModel, limit: int
+) -> list[schemas.PostOutModel]:
+    """The ``limit`` most viewed posts, optionally among those posted within
+    ``time_range``. Views not flushed yet are not counted.
+
+    Without a range the ``views`` index is walked until ``limit`` rows are
+    found. A range ends at ``until`` (or now) and spans at most
+    ``MOST_VIEWED_MAX_RANGE_DAYS``, so its posts are read from the
+    ``posted_at`` index and sorted, however many posts are older or newer.
+    """
+    query = session.query(Posts).options(*POST_OUT_LOADERS)
+    if time_range.since or time_range.until:
+        until = time_range.until or utc_now().replace(tzinfo=None)
+        earliest = until - timedelta(days=config.MOST_VIEWED_MAX_RANGE_DAYS)
+        since = max(time_range.since or earliest, earliest)
+        time_range = schemas.TimeRangeModel(since=since, until=until)
+        query = in_time_range(query, Posts.posted_at, time_range)
+    posts = query.order_by(Posts.views.desc(), Posts.post_id.desc()).limit(limit).all()
+    return posts_out(session, posts)
+
+
+def get_post_comments(
+    post_id: int, session: Session, time_range: schemas.TimeRangeModel, limit: int
+) -> list[Comments]:
+    """Newest comments on a post first, served by ``(post_id, commented_at)``."""
+    get_post_by_id(post_id, session, return_pydantic=False)
+    query = session.query(Comments).filter(Comments.post_id == post_id)
+    query = in_time_range(query, Comments.commented_at, time_range)
+    return (
+        query.order_by(Comments.commented_at.desc(), Comments.comment_id.desc())
+        .limit(limit)
+        .all()
+    )
 
 
 def add_comment_to_post(
     comment: schemas.CommentInModel, session: Session
 ) -> schemas.PostOutModel:
-    _ = get_post_by_id(comment.post_id, session)
+    get_post_by_id(comment.post_id, session, return_pydantic=False)
+    parent = None
+    if comment.parent_id is not None:
+        parent = (
+            session.query(Comments)
+            .filter(
+                Comments.comment_id == comment.parent_id,
+                Comments.post_id == comment.post_id,
+            )
+            .first()
+        )
+        if not parent:
+            raise ItemNotFoundException(
+                f"Comment with id {comment.parent_id} not found on post {comment.post_id}"
+            )
+        if parent.depth + 1 > config.COMMENT_MAX_DEPTH:
+            raise OperationNotAllowedException(
+                f"Replies cannot be nested more than {config.COMMENT_MAX_DEPTH} levels deep."
+            )
     try:
-        add_commnet = Comments(**comment.model_dump())
+        add_commnet = Comments(
+            **comment.model_dump(), depth=parent.depth + 1 if parent else 0
+        )
         session.add(add_commnet)
+        # The path ends with the comment's own id.
+        session.flush()
+        add_commnet.path = threads.comment_path(
+            parent.path if parent else "", add_commnet.comment_id
+        )
         session.commit()
         session.refresh(add_commnet)
     except Exception as e:
@@ -214,7 +357,12 @@ def delete_comment(comment_id: int, user_id: int, session: Session) -> None:
         raise OperationNotAllowedException(
             "You are not allowed to delete to this comment."
         )
-    session.delete(comment)
+    # Replies go with the comment, in one range delete.
+    session.execute(
+        delete(Comments)
+        .where(threads.in_subtree(comment))
+        .execution_options(synchronize_session=False)
+    )
     session.commit()
 
 
@@ -274,13 +422,11 @@ def like_post(post_id: int, user_id: int, session: Session) -> schemas.PostOutMo
     if already_liked:
         return post_out_sqlalchemy_to_pydantic(session, post)
 
-    already_disliked = (
-        session.query(Dislikes)
-        .filter((Dislikes.post_id == post_id) & (Dislikes.user_id == user_id))
-        .first()
-    )
-    if already_disliked:
-        remove_dislike(post_id, user_id, session)
+    # Drop an earlier dislike in the same transaction; remove_dislike would
+    # also serialize the post.
+    session.query(Dislikes).filter(
+        (Dislikes.post_id == post_id) & (Dislikes.user_id == user_id)
+    ).delete(synchronize_session=False)
     add_like = Likes(user_id=user_id, post_id=post_id)
     session.add(add_like)
     session.commit()
@@ -298,15 +444,74 @@ def dislike_post(post_id: int, user_id: int, session: Session) -> schemas.PostOu
     if already_disliked:
         return post_out_sqlalchemy_to_pydantic(session, post)
 
-    already_liked = (
-        session.query(Likes)
-        .filter((Likes.post_id == post_id) & (Likes.user_id == user_id))
-        .first()
-    )
-    if already_liked:
-        remove_like(post_id, user_id, session)
+    session.query(Likes).filter(
+        (Likes.post_id == post_id) & (Likes.user_id == user_id)
+    ).delete(synchronize_session=False)
     add_dislike = Dislikes(user_id=user_id, post_id=post_id)
     session.add(add_dislike)
     session.commit()
     session.refresh(add_dislike)
     return post_out_sqlalchemy_to_pydantic(session, post)
+
+
+def thread_comment_out(
+    comment: Comments,
+    usernames: dict[int, str],
+    replies: list[Comments] | None = None,
+    reply_count: int | None = None,
+) -> schemas.ThreadCommentModel:
+    return schemas.ThreadCommentModel(
+        comment_id=comment.comment_id,
+        post_id=comment.post_id,
+        user_id=comment.user_id,
+        parent_id=comment.parent_id,
+        depth=comment.depth,
+        comment_content=comment.comment_content,
+        commented_at=comment.commented_at,
+        username=usernames.get(comment.user_id),
+        reply_count=reply_count,
+        replies=[thread_comment_out(reply, usernames) for reply in replies or []],
+    )
+
+
+def get_comment_threads(
+    post_id: int, session: Session, limit: int, cursor: int | None, replies: int
+) -> dict:
+    """A page of a post's top-level comments, newest first, each with its
+    first ``replies`` direct replies and how many it has."""
+    get_post_by_id(post_id, session, return_pydantic=False)
+    comments, next_cursor = threads.top_level_page(session, post_id, limit, cursor)
+    previews = threads.reply_previews(
+        session, post_id, [comment.comment_id for comment in comments], replies
+    )
+    usernames = usernames_for(
+        session,
+        {
+            item.user_id
+            for comment in comments
+            for item in (comment, *previews.get(comment.comment_id, ([], 0))[0])
+        },
+    )
+    page = []
+    for comment in comments:
+        preview, reply_count = previews.get(comment.comment_id, ([], 0))
+        page.append(thread_comment_out(comment, usernames, preview, reply_count))
+    return {"comments": page, "next_cursor": next_cursor}
+
+
+def get_comment_replies(
+    comment_id: int,
+    session: Session,
+    limit: int,
+    after: str | None,
+    depth: int | None,
+) -> dict:
+    """A page of the replies under a comment in reading order, flat: each
+    carries its ``parent_id`` and ``depth``."""
+    root = session.query(Comments).filter(Comments.comment_id == comment_id).first()
+    if not root:
+        raise ItemNotFoundException(f"Comment with id {comment_id} not found")
+    comments, next_cursor = threads.subtree_page(session, root, limit, after, depth)
+    usernames = usernames_for(session, {comment.user_id for comment in comments})
+    page = [thread_comment_out(comment, usernames) for comment in comments]
+    return {"comments": page, "next_cursor": next_cursor}
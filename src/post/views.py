@@ -0,0 +1,97 @@
+import itertools
+import threading
+from collections import Counter
+from sqlalchemy import bindparam, update
+from sqlalchemy.orm import Session
+from ..settings.config import config
+from ..db.models import Posts
+from ..workers import register_worker
+
+
+class ViewCounter:
+    """Counts post views in memory and writes them behind in batches.
+
+    Reading a post must not turn into a write: a per-request
+    ``UPDATE posts SET views = views + 1`` would contend on the row lock of
+    every popular post. Views are counted per process instead, in
+    ``shards`` counters picked by thread so request threads rarely share a
+    lock, and ``flush`` adds them to ``posts.views`` every
+    ``POST_VIEW_FLUSH_SECONDS``. A crash loses at most the views counted
+    since the last flush.
+    """
+
+    def __init__(self, shards: int) -> None:
+        self._shards = [
+            (threading.Lock(), Counter()) for _ in range(max(int(shards), 1))
+        ]
+        self._local = threading.local()
+        self._next_shard = itertools.count()
+        self.flushed = 0
+        self.flushes = 0
+
+    def _shard(self) -> tuple[threading.Lock, Counter]:
+        # Threads take shards in turn; their idents are too regular to hash.
+        index = getattr(self._local, "shard", None)
+        if index is None:
+            index = self._local.shard = next(self._next_shard) % len(self._shards)
+        return self._shards[index]
+
+    def add(self, post_id: int, count: int = 1) -> None:
+        lock, counts = self._shard()
+        with lock:
+            counts[post_id] += count
+
+    def pending(self, post_id: int) -> int:
+        """Views of ``post_id`` counted here but not flushed yet."""
+        return sum(counts.get(post_id, 0) for _, counts in self._shards)
+
+    def drain(self) -> Counter:
+        total = Counter()
+        for lock, counts in self._shards:
+            with lock:
+                total.update(counts)
+                counts.clear()
+        return total
+
+    def flush(self, session: Session) -> int:
+        """Add the counted views to ``posts.views`` in one batched UPDATE.
+
+        Rows are updated in post id order so flushes from several workers
+        lock them in the same order. Counts go back in the buffer if the
+        write fails and are retried on the next flush.
+        """
+        views = self.drain()
+        if not views:
+            return 0
+        try:
+            session.connection().execute(
+                update(Posts)
+                .where(Posts.post_id == bindparam("b_post_id"))
+                .values(views=Posts.views + bindparam("b_views")),
+                [
+                    {"b_post_id": post_id, "b_views": count}
+                    for post_id, count in sorted(views.items())
+                ],
+            )
+            session.commit()
+        except Exception:
+            session.rollback()
+            for post_id, count in views.items():
+                self.add(post_id, count)
+            raise
+        self.flushed += sum(views.values())
+        self.flushes += 1
+        return len(views)
+
+    def stats(self) -> dict:
+        return {
+            "pending": sum(sum(counts.values()) for _, counts in self._shards),
+            "flushed": self.flushed,
+            "flushes": self.flushes,
+        }
+
+
+view_counter = ViewCounter(config.POST_VIEW_SHARDS)
+view_flush_worker = register_worker(
+    "post-view-flush", config.POST_VIEW_FLUSH_SECONDS, view_counter.flush
+)
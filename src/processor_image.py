@@ -1,16 +1,97 @@
+from datetime import timedelta
 from fastapi import UploadFile
-from mega import Mega
-import os, secrets
+import logging, os, secrets, threading
 from .settings.config import config
 from .error import ImageFormatNotSupportedException
-from .db.models import ImageMapper
+from .db.models import (
+    ImageMapper,
+    MediaDeletion,
+    Posts,
+    StorageFolder,
+    Users,
+    utc_now,
+)
+from .workers import register_worker
+from .media.cache import media_cache
+from sqlalchemy import exists
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
-mega = Mega()
-
 EMAIL = config.MAIL_USERNAME
 MEGA_PASSWORD = config.MEGA_PASSWORD
-m = mega.login(EMAIL, MEGA_PASSWORD)
+
+
+class MegaStorage:
+    """Mega client that logs in on first use and is shared by all threads.
+
+    The logged-in session is reused for every call. When Mega reports that
+    the session id has expired, the client logs in again once and retries.
+    """
+
+    SESSION_EXPIRED = -15
+
+    def __init__(self, email: str, password: str) -> None:
+        self.email = email
+        self.password = password
+        self._client = None
+        self._lock = threading.Lock()
+
+    def client(self):
+        client = self._client
+        if client is None:
+            with self._lock:
+                if self._client is None:
+                    from mega import Mega
+
+                    self._client = Mega().login(self.email, self.password)
+                client = self._client
+        return client
+
+    def relogin(self, stale_client):
+        with self._lock:
+            if self._client is stale_client:
+                self._client = None
+        return self.client()
+
+    def call(self, method: str, *args, **kwargs):
+        client = self.client()
+        try:
+            return getattr(client, method)(*args, **kwargs)
+        except Exception as e:
+            if getattr(e, "code", None) != self.SESSION_EXPIRED:
+                raise
+            logging.info("Mega session expired, logging in again.")
+            client = self.relogin(client)
+            return getattr(client, method)(*args, **kwargs)
+
+
+storage = MegaStorage(EMAIL, MEGA_PASSWORD)
+
+
+_folder_handles: dict[str, str] = {}
+
+
+def get_folder_handle(folder_name: str, session: Session) -> str:
+    """Return the Mega handle of ``folder_name``.
+
+    Handles are cached in memory and in the ``storage_folder`` table, so
+    Mega is only searched the first time a folder is used.
+    """
+    handle = _folder_handles.get(folder_name)
+    if handle:
+        return handle
+    folder = (
+        session.query(StorageFolder).filter(StorageFolder.name == folder_name).first()
+    )
+    if folder:
+        handle = folder.handle
+    else:
+        existing_folder = storage.call("find", folder_name)
+        handle = existing_folder[1]["h"]
+        session.merge(StorageFolder(name=folder_name, handle=handle))
+        session.commit()
+    _folder_handles[folder_name] = handle
+    return handle
 
 
 async def upload_image(file: UploadFile, folder_name: str, session: Session) -> str:
@@ -22,26 +103,23 @@ async def upload_image(file: UploadFile, folder_name: str, session: Session) ->
         )
 
     filename = secrets.token_hex(10) + "." + ext
-    existing_folder = m.find(folder_name)
-    folder_id = existing_folder[1]["h"]
+    folder_id = get_folder_handle(folder_name, session)
 
     with open(filename, "wb") as f:
         f.write(await file.read())
 
-    mega_file = m.upload(filename, dest=folder_id)
-    public_url = m.get_upload_link(mega_file)
+    mega_file = storage.call("upload", filename, dest=folder_id)
+    public_url = storage.call("get_upload_link", mega_file)
     os.remove(filename)
 
-    image_key = None
-    folder_id = existing_folder[1]["h"]
-    files_in_folder = m.get_files_in_node(folder_id)
-    for file_key, file_info in files_in_folder.items():
-        if file_info["a"]["n"] == filename:
-            image_key = file_key
-            break
+    # The upload response already carries the new node, no need to list the folder.
+    image_key = mega_file["f"][0]["h"]
 
     add_image_mapper = ImageMapper(
-        image_name=filename, image_id=image_key, image_url=public_url
+        image_name=filename,
+        image_id=image_key,
+        image_url=public_url,
+        folder_handle=folder_id,
     )
     session.add(add_image_mapper)
     session.commit()
@@ -51,18 +129,176 @@ async def upload_image(file: UploadFile, folder_name: str, session: Session) ->
 
 
 def delete_image(link: str, session: Session):
+    """Queue the remote file behind ``link`` for deletion.
+
+    Nothing is committed here: the queue row and the mapper removal are part
+    of the caller's transaction, so they land together with the change that
+    made the image obsolete. The remote delete happens later in
+    ``drain_media_deletions``.
+    """
     image_details = (
         session.query(ImageMapper).filter(ImageMapper.image_url == link).first()
     )
     if image_details:
-        file_to_delete = image_details.image_id
-        m.destroy(file_to_delete)
+        session.add(
+            MediaDeletion(
+                image_id=image_details.image_id, image_url=image_details.image_url
+            )
+        )
         session.delete(image_details)
-        session.commit()
+        media_cache.discard(image_details.image_id)
     else:
         return {"message": "Invalid link"}
 
 
+def download_image(image: ImageMapper, dest: str) -> None:
+    storage.call(
+        "download_url",
+        image.image_url,
+        dest_path=os.path.dirname(dest),
+        dest_filename=os.path.basename(dest),
+    )
+
+
+def deletion_backoff(attempts: int) -> timedelta:
+    delay = config.MEDIA_DELETE_BACKOFF_SECONDS * 2 ** max(attempts - 1, 0)
+    return timedelta(seconds=min(delay, config.MEDIA_DELETE_MAX_BACKOFF_SECONDS))
+
+
+def drain_media_deletions(session: Session) -> dict:
+    """Delete one batch of due files from storage.
+
+    Failed deletions are retried with exponential backoff and moved to the
+    ``dead`` status once ``MEDIA_DELETE_MAX_ATTEMPTS`` is reached.
+    """
+    now = utc_now()
+    batch = (
+        session.query(MediaDeletion)
+        .filter(MediaDeletion.status == "pending", MediaDeletion.next_attempt_at <= now)
+        .order_by(MediaDeletion.next_attempt_at)
+        .limit(config.MEDIA_DELETE_BATCH_SIZE)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    deleted, failed = 0, 0
+    for deletion in batch:
+        try:
+            storage.call("destroy", deletion.image_id)
+        except Exception as e:
+            failed += 1
+            deletion.attempts += 1
+            deletion.last_error = str(e)
+            if deletion.attempts >= config.MEDIA_DELETE_MAX_ATTEMPTS:
+                deletion.status = "dead"
+                logging.error(f"Giving up deleting image {deletion.image_id}: {str(e)}")
+            else:
+                deletion.next_attempt_at = now + deletion_backoff(deletion.attempts)
+        else:
+            deleted += 1
+            session.delete(deletion)
+    session.commit()
+    if len(batch) == config.MEDIA_DELETE_BATCH_SIZE:
+        media_deletion_worker.wake()
+    return {"deleted": deleted, "failed": failed}
+
+
+def reconcile_images(session: Session) -> dict:
+    """Compare the image folders on Mega with the ``image_mapper`` table.
+
+    - Remote files with no mapper row are orphans and get queued for deletion.
+    - Mapper rows whose remote file is gone are dangling and get removed.
+    - Mapper rows no user or post points at any more get queued for deletion.
+
+    Anything younger than ``IMAGE_RECONCILE_GRACE_SECONDS`` is left alone so
+    an upload whose post or profile update is still in flight is not touched.
+    A folder that lists as empty is skipped: Mega returning nothing is not
+    proof that its files are gone, and neither is a mapper row that never
+    recorded its folder.
+    """
+    cutoff = utc_now() - timedelta(seconds=config.IMAGE_RECONCILE_GRACE_SECONDS)
+    for folder_name in (config.PROFLE_IMAGE_FOLDER, config.POST_IMAGE_FOLDER):
+        if folder_name:
+            get_folder_handle(folder_name, session)
+    folder_handles = {handle for (handle,) in session.query(StorageFolder.handle)}
+
+    remote_files = {}
+    listed = set()
+    for handle in folder_handles:
+        nodes = storage.call("get_files_in_node", handle)
+        if not nodes:
+            continue
+        listed.add(handle)
+        remote_files.update(
+            {key: node for key, node in nodes.items() if node.get("t") == 0}
+        )
+
+    mapped = {image_id for (image_id,) in session.query(ImageMapper.image_id)}
+    # Dead deletions too: image ids are unique in the queue.
+    queued = {image_id for (image_id,) in session.query(MediaDeletion.image_id)}
+
+    orphaned = 0
+    for key, node in remote_files.items():
+        if key in mapped or key in queued:
+            continue
+        if node.get("ts", 0) > cutoff.timestamp():
+            continue
+        # Another process reconciling at the same time may queue it first.
+        try:
+            with session.begin_nested():
+                session.add(MediaDeletion(image_id=key))
+        except IntegrityError:
+            continue
+        orphaned += 1
+
+    # Rows written after the folders were listed are not in remote_files.
+    dangling = [
+        image_id
+        for (image_id,) in session.query(ImageMapper.image_id).filter(
+            ImageMapper.folder_handle.in_(listed),
+            (ImageMapper.created_at == None) | (ImageMapper.created_at < cutoff),
+        )
+        if image_id not in remote_files
+    ]
+    if dangling:
+        session.query(ImageMapper).filter(ImageMapper.image_id.in_(dangling)).delete(
+            synchronize_session=False
+        )
+
+    unreferenced = (
+        session.query(ImageMapper.image_url)
+        .filter(
+            ~exists().where(Users.image_url == ImageMapper.image_url),
+            ~exists().where(Posts.post_image == ImageMapper.image_url),
+            (ImageMapper.created_at == None) | (ImageMapper.created_at < cutoff),
+        )
+        .all()
+    )
+    for (url,) in unreferenced:
+        delete_image(url, session)
+
+    session.commit()
+    report = {
+        "remote_files": len(remote_files),
+        "orphaned": orphaned,
+        "dangling": len(dangling),
+        "unreferenced": len(unreferenced),
+    }
+    logging.info(f"Image reconciliation: {report}")
+    return report
+
+
+media_deletion_worker = register_worker(
+    "media-deletion", config.MEDIA_DELETE_INTERVAL_SECONDS, drain_media_deletions
+)
+# Not at boot: it logs in to Mega and lists every image folder.
+image_reconcile_worker = register_worker(
+    "image-reconcile",
+    config.IMAGE_RECONCILE_INTERVAL_SECONDS,
+    reconcile_images,
+    initial_delay=config.IMAGE_RECONCILE_INTERVAL_SECONDS,
+)
+
+
 # {
 #     "Ijl2UYJS": {
 #         "h": "Ijl2UYJS",
@@ -0,0 +1,163 @@
+import json
+import os
+import re
+import secrets
+import sys
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from fastapi import APIRouter, Depends
+from fastapi.responses import FileResponse
+from .settings.config import config
+from .error import ItemNotFoundException
+from .authentication.dependencies import admin_role_checker, get_current_user
+from .authentication.schemas import Payload
+
+# Leaf frames of a thread that is waiting rather than working: idle pool
+# threads, background workers between runs and the event loop in select.
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+}
+
+
+def frame_label(code) -> str:
+    path = os.sep.join(code.co_filename.split(os.sep)[-2:])
+    return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Statistical profiler: a thread records the stack of every busy thread
+    each ``interval`` seconds.
+
+    Stacks are kept in collapsed form (``thread;outer;...;inner count``),
+    which flamegraph.pl and speedscope read directly. Sync routes run in a
+    pool thread and async code on the event loop thread, so the whole
+    process is sampled; anything else busy at the same time shows up too,
+    which is why ``ProfilingMiddleware`` labels its profiles as process
+    profiles.
+    """
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self.samples = 0
+        self.stacks: Counter[str] = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="request-profiler", daemon=True
+        )
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.sample(own)
+
+    def sample(self, own: int) -> None:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            code = frame.f_code
+            if ident == own or (
+                (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+            ):
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(ident, f"thread-{ident}"))
+            self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def collapsed(self) -> str:
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.stacks.most_common()
+        )
+
+
+class ProfileStore:
+    """Profiles on disk as ``<id>.collapsed`` with an ``<id>.json`` summary.
+
+    Only the newest ``max_profiles`` are kept.
+    """
+
+    ID_PATTERN = re.compile(r"^\d{8}T\d{12}-[0-9a-f]{6}$")
+
+    def __init__(self, directory: str, max_profiles: int) -> None:
+        self.directory = directory
+        self.max_profiles = int(max_profiles)
+
+    def new_id(self) -> str:
+        now = datetime.now(timezone.utc)
+        return f"{now:%Y%m%dT%H%M%S%f}-{secrets.token_hex(3)}"
+
+    def save(self, profile_id: str, profiler: SamplingProfiler, summary: dict) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, profile_id)
+        with open(base + ".collapsed", "w") as f:
+            f.write(profiler.collapsed())
+        with open(base + ".json", "w") as f:
+            json.dump({"id": profile_id, "samples": profiler.samples, **summary}, f)
+        self.prune()
+
+    def list(self) -> list[dict]:
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for name in sorted(os.listdir(self.directory), reverse=True):
+            if name.endswith(".json"):
+                with open(os.path.join(self.directory, name)) as f:
+                    profiles.append(json.load(f))
+        return profiles
+
+    def path(self, profile_id: str) -> str | None:
+        if not self.ID_PATTERN.match(profile_id):
+            return None
+        path = os.path.join(self.directory, profile_id + ".collapsed")
+        return path if os.path.exists(path) else None
+
+    def prune(self) -> None:
+        ids = sorted(
+            name[: -len(".json")]
+            for name in os.listdir(self.directory)
+            if name.endswith(".json")
+        )
+        for profile_id in ids[: max(len(ids) - self.max_profiles, 0)]:
+            for ext in (".json", ".collapsed"):
+                try:
+                    os.remove(os.path.join(self.directory, profile_id + ext))
+                except FileNotFoundError:
+                    pass
+
+
+profile_store = ProfileStore(config.PROFILE_DIR, config.PROFILE_MAX_FILES)
+
+
+profiling_router = APIRouter(prefix="/api/profiles", tags=["profiling"])
+
+
+@profiling_router.get("/")
+def list_profiles(current_user: Payload = Depends(get_current_user)):
+    admin_role_checker(current_user)
+    return profile_store.list()
+
+
+@profiling_router.get("/{profile_id}/")
+def download_profile(
+    profile_id: str, current_user: Payload = Depends(get_current_user)
+):
+    admin_role_checker(current_user)
+    path = profile_store.path(profile_id)
+    if not path:
+        raise ItemNotFoundException(f"Profile {profile_id} not found")
+    return FileResponse(
+        path, media_type="text/plain", filename=f"{profile_id}.collapsed"
+    )
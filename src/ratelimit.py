@@ -0,0 +1,121 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+from fastapi import Depends, Request
+from fastapi.security import OAuth2PasswordRequestForm
+from .settings.config import config
+from .error import RateLimitExceededException
+from .authentication.dependencies import get_current_user
+from .authentication.schemas import Payload
+
+PERIODS = {"second": 1, "minute": 60, "hour": 60 * 60, "day": 24 * 60 * 60}
+
+
+def parse_rate(rate: str | None) -> tuple[int, float] | None:
+    """Parse ``"10/minute"`` into ``(10, 60.0)``. An empty rate disables the limit."""
+    if not rate:
+        return None
+    count, _, period = rate.partition("/")
+    return int(count), float(PERIODS[period.strip().rstrip("s")])
+
+
+class MemoryBackend:
+    """Token buckets kept in this process.
+
+    Each key gets a bucket of ``limit`` tokens refilled at ``limit / period``
+    per second. At most ``max_keys`` buckets are kept; the least recently
+    used one is dropped first, which only ever makes a client look fresh.
+    """
+
+    def __init__(self, max_keys: int) -> None:
+        self.max_keys = int(max_keys)
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, limit: int, period: float) -> float:
+        """Take a token for ``key``; return 0, or the seconds until one is free."""
+        rate = limit / period
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (limit, now))
+            tokens = min(limit, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                wait = 0.0
+            else:
+                self._buckets[key] = (tokens, now)
+                wait = (1 - tokens) / rate
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def reset(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+
+
+# A shared backend (e.g. Redis) only needs the same ``hit`` method; register
+# a factory here and select it with RATE_LIMIT_BACKEND.
+backends: dict[str, Callable[[], object]] = {
+    "memory": lambda: MemoryBackend(config.RATE_LIMIT_MAX_KEYS),
+}
+backend = backends[config.RATE_LIMIT_BACKEND]()
+
+
+def check(scope: str, identity: str, rate: tuple[int, float]) -> None:
+    wait = backend.hit(f"{scope}:{identity}", *rate)
+    if wait:
+        raise RateLimitExceededException(
+            "Too many requests. Please slow down.", retry_after=math.ceil(wait)
+        )
+
+
+def client_ip(request: Request) -> str:
+    # Behind a proxy, run uvicorn with --proxy-headers so this is the
+    # address from X-Forwarded-For.
+    return request.client.host if request.client else "unknown"
+
+
+def rate_limit(name: str, rate: str | None) -> Callable:
+    """Dependency limiting the route to ``rate`` requests per client IP."""
+    parsed = parse_rate(rate)
+
+    def dependency(request: Request) -> None:
+        if parsed:
+            check(name, f"ip:{client_ip(request)}", parsed)
+
+    return dependency
+
+
+def login_rate_limit(name: str, rate: str | None) -> Callable:
+    """Dependency limiting the route to ``rate`` requests per client IP and
+    per submitted username or email, so guessing one account's password
+    from many IPs is limited too."""
+    parsed = parse_rate(rate)
+
+    def dependency(
+        request: Request, formdata: OAuth2PasswordRequestForm = Depends()
+    ) -> None:
+        if parsed:
+            check(name, f"ip:{client_ip(request)}", parsed)
+            check(name, f"login:{formdata.username.strip().lower()}", parsed)
+
+    return dependency
+
+
+def user_rate_limit(name: str, rate: str | None) -> Callable:
+    """Dependency limiting the route to ``rate`` requests per client IP and
+    per authenticated user, so neither switching IPs nor sharing one helps."""
+    parsed = parse_rate(rate)
+
+    def dependency(
+        request: Request, current_user: Payload = Depends(get_current_user)
+    ) -> None:
+        if parsed:
+            check(name, f"ip:{client_ip(request)}", parsed)
+            check(name, f"user:{current_user.user_id}", parsed)
+
+    return dependency
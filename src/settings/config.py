@@ -10,16 +10,112 @@ class Settings(BaseSettings):
     SECRET_KEY: str = os.getenv("SECRET_KEY")
     ALGORITHM: str = os.getenv("ALGORITHM")
     DB_URL: str = os.getenv("DB_URL")
+    DB_POOL_SIZE: int = os.getenv("DB_POOL_SIZE", 5)
+    DB_MAX_OVERFLOW: int = os.getenv("DB_MAX_OVERFLOW", 10)
     MAIL_USERNAME: str = os.getenv("MAIL_USERNAME")
     MAIL_PASSWORD: str = os.getenv("MAIL_PASSWORD")
     MAIL_FROM: str = os.getenv("MAIL_FROM")
     MAIL_PORT: int = os.getenv("MAIL_PORT")
     MAIL_SERVER: str = os.getenv("MAIL_SERVER")
     MAIL_FROM_NAME: str = os.getenv("MAIL_FROM_NAME")
+    MAIL_STARTTLS: bool = os.getenv("MAIL_STARTTLS", True)
+    MAIL_SSL_TLS: bool = os.getenv("MAIL_SSL_TLS", False)
+    MAIL_USE_CREDENTIALS: bool = os.getenv("MAIL_USE_CREDENTIALS", True)
+    MAIL_VALIDATE_CERTS: bool = os.getenv("MAIL_VALIDATE_CERTS", False)
+    SMTP_TIMEOUT_SECONDS: float = os.getenv("SMTP_TIMEOUT_SECONDS", 30)
+    SMTP_IDLE_SECONDS: float = os.getenv("SMTP_IDLE_SECONDS", 60)
+    OUTBOX_INTERVAL_SECONDS: float = os.getenv("OUTBOX_INTERVAL_SECONDS", 10)
+    OUTBOX_BATCH_SIZE: int = os.getenv("OUTBOX_BATCH_SIZE", 50)
+    OUTBOX_CLAIM_SECONDS: float = os.getenv("OUTBOX_CLAIM_SECONDS", 5 * 60)
+    OUTBOX_RATE_PER_SECOND: float = os.getenv("OUTBOX_RATE_PER_SECOND", 10)
+    OUTBOX_MAX_ATTEMPTS: int = os.getenv("OUTBOX_MAX_ATTEMPTS", 6)
+    OUTBOX_BACKOFF_SECONDS: float = os.getenv("OUTBOX_BACKOFF_SECONDS", 30)
+    OUTBOX_MAX_BACKOFF_SECONDS: float = os.getenv("OUTBOX_MAX_BACKOFF_SECONDS", 60 * 60)
     HOST_SERVER: str = os.getenv("HOST_SERVER")
+    ACCESS_TOKEN_EXPIRE_MINUTES: int = os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30)
+    REFRESH_TOKEN_EXPIRE_DAYS: int = os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", 7)
+    REFRESH_TOKEN_PURGE_INTERVAL_SECONDS: float = os.getenv(
+        "REFRESH_TOKEN_PURGE_INTERVAL_SECONDS", 60 * 60
+    )
+    REFRESH_TOKEN_PURGE_BATCH_SIZE: int = os.getenv(
+        "REFRESH_TOKEN_PURGE_BATCH_SIZE", 1000
+    )
+    TOKEN_CACHE_SIZE: int = os.getenv("TOKEN_CACHE_SIZE", 10000)
+    ACCOUNT_STATUS_REFRESH_SECONDS: float = os.getenv(
+        "ACCOUNT_STATUS_REFRESH_SECONDS", 2
+    )
+    ACCOUNT_REVOCATION_PURGE_INTERVAL_SECONDS: float = os.getenv(
+        "ACCOUNT_REVOCATION_PURGE_INTERVAL_SECONDS", 10 * 60
+    )
+    USER_BULK_CHUNK_SIZE: int = os.getenv("USER_BULK_CHUNK_SIZE", 500)
+    ACTIVATION_TOKEN_TTL_HOURS: float = os.getenv("ACTIVATION_TOKEN_TTL_HOURS", 48)
+    PASSWORD_RESET_TOKEN_TTL_MINUTES: float = os.getenv(
+        "PASSWORD_RESET_TOKEN_TTL_MINUTES", 30
+    )
+    EMAIL_CHANGE_TOKEN_TTL_HOURS: float = os.getenv("EMAIL_CHANGE_TOKEN_TTL_HOURS", 24)
+    EMAIL_TOKEN_PURGE_INTERVAL_SECONDS: float = os.getenv(
+        "EMAIL_TOKEN_PURGE_INTERVAL_SECONDS", 60 * 60
+    )
+    EMAIL_TOKEN_PURGE_BATCH_SIZE: int = os.getenv("EMAIL_TOKEN_PURGE_BATCH_SIZE", 1000)
+    PASSWORD_HASH_SCHEME: str = os.getenv("PASSWORD_HASH_SCHEME", "bcrypt")
+    # Cost for PASSWORD_HASH_SCHEME; unset keeps passlib's default for it.
+    PASSWORD_HASH_ROUNDS: int | None = os.getenv("PASSWORD_HASH_ROUNDS")
+    HASH_POOL_WORKERS: int = os.getenv("HASH_POOL_WORKERS", 2)
+    HASH_POOL_MAX_PENDING: int = os.getenv("HASH_POOL_MAX_PENDING", 16)
+    HASH_POOL_NICENESS: int = os.getenv("HASH_POOL_NICENESS", 10)
+    RETRY_AFTER_SECONDS: int = os.getenv("RETRY_AFTER_SECONDS", 1)
+    RATE_LIMIT_BACKEND: str = os.getenv("RATE_LIMIT_BACKEND", "memory")
+    RATE_LIMIT_MAX_KEYS: int = os.getenv("RATE_LIMIT_MAX_KEYS", 100000)
+    RATE_LIMIT_LOGIN: str = os.getenv("RATE_LIMIT_LOGIN", "10/minute")
+    RATE_LIMIT_SIGNUP: str = os.getenv("RATE_LIMIT_SIGNUP", "5/hour")
+    RATE_LIMIT_FORGET_PASSWORD: str = os.getenv("RATE_LIMIT_FORGET_PASSWORD", "5/hour")
+    RATE_LIMIT_CREATE_POST: str = os.getenv("RATE_LIMIT_CREATE_POST", "30/hour")
+    MAX_CONCURRENT_REQUESTS: int = os.getenv("MAX_CONCURRENT_REQUESTS", 0)
+    SHED_ON_DB_POOL_SATURATION: bool = os.getenv("SHED_ON_DB_POOL_SATURATION", True)
+    DEBUG: bool = os.getenv("DEBUG", False)
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", False)
+    METRICS_TOKEN: str = os.getenv("METRICS_TOKEN", "")
+    # Worker processes per host; uvicorn and gunicorn read it too.
+    WEB_CONCURRENCY: int = os.getenv("WEB_CONCURRENCY", 1)
+    INVALIDATION_BACKEND: str = os.getenv("INVALIDATION_BACKEND", "auto")
+    INVALIDATION_CHANNEL: str = os.getenv("INVALIDATION_CHANNEL", "cache_invalidation")
+    INVALIDATION_POLL_SECONDS: float = os.getenv("INVALIDATION_POLL_SECONDS", 0.1)
+    INVALIDATION_RETENTION_SECONDS: float = os.getenv(
+        "INVALIDATION_RETENTION_SECONDS", 5 * 60
+    )
+    COMMENT_PREVIEW_SIZE: int = os.getenv("COMMENT_PREVIEW_SIZE", 3)
+    REPLY_PREVIEW_SIZE: int = os.getenv("REPLY_PREVIEW_SIZE", 3)
+    COMMENT_MAX_DEPTH: int = os.getenv("COMMENT_MAX_DEPTH", 50)
+    POST_VIEW_FLUSH_SECONDS: float = os.getenv("POST_VIEW_FLUSH_SECONDS", 5)
+    POST_VIEW_SHARDS: int = os.getenv("POST_VIEW_SHARDS", 8)
+    MOST_VIEWED_MAX_RANGE_DAYS: float = os.getenv("MOST_VIEWED_MAX_RANGE_DAYS", 31)
+    PROFILING_ENABLED: bool = os.getenv("PROFILING_ENABLED", False)
+    PROFILE_SAMPLE_RATE: float = os.getenv("PROFILE_SAMPLE_RATE", 0)
+    PROFILE_INTERVAL_MS: float = os.getenv("PROFILE_INTERVAL_MS", 5)
+    PROFILE_DIR: str = os.getenv("PROFILE_DIR", "profiles")
+    PROFILE_MAX_FILES: int = os.getenv("PROFILE_MAX_FILES", 100)
     MEGA_PASSWORD: str = os.getenv("MEGA_PASSWORD")
     PROFLE_IMAGE_FOLDER: str = os.getenv("PROFLE_IMAGE_FOLDER")
     POST_IMAGE_FOLDER: str = os.getenv("POST_IMAGE_FOLDER")
+    MEDIA_DELETE_INTERVAL_SECONDS: float = os.getenv(
+        "MEDIA_DELETE_INTERVAL_SECONDS", 30
+    )
+    MEDIA_DELETE_BATCH_SIZE: int = os.getenv("MEDIA_DELETE_BATCH_SIZE", 50)
+    MEDIA_DELETE_MAX_ATTEMPTS: int = os.getenv("MEDIA_DELETE_MAX_ATTEMPTS", 8)
+    MEDIA_DELETE_BACKOFF_SECONDS: float = os.getenv("MEDIA_DELETE_BACKOFF_SECONDS", 30)
+    MEDIA_DELETE_MAX_BACKOFF_SECONDS: float = os.getenv(
+        "MEDIA_DELETE_MAX_BACKOFF_SECONDS", 6 * 60 * 60
+    )
+    IMAGE_RECONCILE_INTERVAL_SECONDS: float = os.getenv(
+        "IMAGE_RECONCILE_INTERVAL_SECONDS", 6 * 60 * 60
+    )
+    IMAGE_RECONCILE_GRACE_SECONDS: float = os.getenv(
+        "IMAGE_RECONCILE_GRACE_SECONDS", 60 * 60
+    )
+    MEDIA_PROXY_ENABLED: bool = os.getenv("MEDIA_PROXY_ENABLED", False)
+    MEDIA_CACHE_DIR: str = os.getenv("MEDIA_CACHE_DIR", "media_cache")
+    MEDIA_CACHE_MAX_BYTES: int = os.getenv("MEDIA_CACHE_MAX_BYTES", 512 * 1024 * 1024)
+    MEDIA_FETCH_TIMEOUT_SECONDS: float = os.getenv("MEDIA_FETCH_TIMEOUT_SECONDS", 30)
 
 
 config = Settings()
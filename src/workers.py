@@ -0,0 +1,91 @@
+import logging
+import threading
+from typing import Callable
+from sqlalchemy.orm import Session
+from .db.database import sessionLocal
+
+
+class PeriodicWorker:
+    """Runs ``job(session)`` every ``interval`` seconds on a daemon thread.
+
+    Each run gets a fresh session that is closed afterwards. ``wake()`` lets
+    a request ask for an early run instead of waiting for the next tick. The
+    first run waits ``initial_delay`` seconds, for jobs too costly to run in
+    every process as it boots.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        interval: float,
+        job: Callable[[Session], object],
+        initial_delay: float = 0,
+    ) -> None:
+        self.name = name
+        self.interval = float(interval)
+        self.initial_delay = float(initial_delay)
+        self.job = job
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def run_once(self) -> object:
+        session = sessionLocal()
+        try:
+            return self.job(session)
+        except Exception as e:
+            session.rollback()
+            logging.error(f"Background worker {self.name} failed: {str(e)}")
+        finally:
+            session.close()
+
+    def _loop(self) -> None:
+        if self.initial_delay:
+            self._stop.wait(self.initial_delay)
+        while not self._stop.is_set():
+            self.run_once()
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float | None = 5) -> None:
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+workers: list[PeriodicWorker] = []
+
+
+def register_worker(
+    name: str,
+    interval: float,
+    job: Callable[[Session], object],
+    initial_delay: float = 0,
+) -> PeriodicWorker:
+    worker = PeriodicWorker(
+        name=name, interval=interval, job=job, initial_delay=initial_delay
+    )
+    workers.append(worker)
+    return worker
+
+
+def start_workers() -> None:
+    for worker in workers:
+        worker.start()
+
+
+def stop_workers() -> None:
+    for worker in workers:
+        worker.stop()